@@ -0,0 +1,200 @@
+# 將歸檔的 data_collect.csv 重新計算並輸出成 VictoriaMetrics /api/v1/import 的 JSON lines。
+# scrape 無法回補歷史資料，這支工具以多個 process 平行解析 (與 LogExporter 共用 parse_row)，
+# 依檔案時間切成 bucket 後寫成檔案，或以大批次 POST 到 VictoriaMetrics。
+# 檔案依時間排序後逐個 bucket 加總，bucket 的檔案都解析完就輸出，記憶體只保留最多 WINDOW_BUCKETS 個 bucket，
+# 同一個 series 在不同時間窗會寫成多行 (import API 會合併同一 series 的多行)。
+#
+# 用法：
+#   python backfill.py --output backfill.jsonl archive/tmp_log_*.csv
+#   python backfill.py --url http://victoriametrics:8428 --bucket 80 archive/*.csv
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import time
+import urllib.request
+from datetime import datetime
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Tuple
+from exporter import parse_row
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+METRIC_NAME = "log_host_job_count"
+CHUNK_SIZE = 32 << 20  # 每個 worker 工作單位約 32 MiB
+BATCH_BYTES = 16 << 20  # 每次 POST 的 JSON lines 大小上限
+WINDOW_BUCKETS = 45  # 每行最多合併的 bucket 數 (80 秒 bucket 約 1 小時)
+
+# tmp_log_<timestamp>.csv / data_collect.<timestamp>.csv 等歸檔檔名中的時間戳
+_FILE_TIMESTAMP_RE = re.compile(r"(\d{14})")
+
+SeriesKey = Tuple[Tuple[str, str], ...]
+
+
+def file_timestamp(path: str) -> float:
+    """優先使用檔名中的 YYYYmmddHHMMSS 時間戳，否則使用檔案修改時間。"""
+    match = _FILE_TIMESTAMP_RE.search(os.path.basename(path))
+    if match:
+        return datetime.strptime(match.group(1), "%Y%m%d%H%M%S").timestamp()
+    return os.path.getmtime(path)
+
+
+def split_file(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, int, int]]:
+    """把檔案切成以換行對齊的 (path, start, end) 區段，交給不同 worker 解析。"""
+    size = os.path.getsize(path)
+    start = 0
+    with open(path, "rb") as f:
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            yield path, start, end
+            start = end
+
+
+def count_chunk(task: Tuple[str, int, int, int]) -> Tuple[int, Dict[SeriesKey, int]]:
+    """worker：解析一個區段並依 label set 加總次數。"""
+    path, start, end, bucket = task
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    counts: Dict[SeriesKey, int] = {}
+    for row in csv.reader(io.StringIO(data.decode("utf-8", errors="replace"))):
+        parsed = parse_row(row)
+        if parsed is None:
+            continue
+        labels, value = parsed
+        key = tuple(sorted((k, v) for k, v in labels.items() if v))
+        counts[key] = counts.get(key, 0) + value
+    return bucket, counts
+
+
+def aggregate(paths: Iterable[str], bucket_seconds: int, processes: int = 0) -> Iterator[Tuple[int, Dict[SeriesKey, int]]]:
+    """平行解析所有檔案，依時間順序逐一產生 (bucket 起始時間(秒), series -> 次數)。
+
+    檔案先依 bucket 排序，imap 依序回傳結果，bucket 改變時前一個 bucket 不會再收到資料，立即輸出並釋放。
+    """
+    files = []
+    for path in paths:
+        ts = int(file_timestamp(path))
+        files.append((ts - ts % bucket_seconds, path))
+    files.sort()
+    tasks = ((p, start, end, bucket) for bucket, path in files for p, start, end in split_file(path))
+
+    current = None
+    counts: Dict[SeriesKey, int] = {}
+    with Pool(processes or None) as pool:
+        for bucket, chunk_counts in pool.imap(count_chunk, tasks):
+            if bucket != current:
+                if counts:
+                    yield current, counts
+                current, counts = bucket, {}
+            for key, value in chunk_counts.items():
+                counts[key] = counts.get(key, 0) + value
+    if counts:
+        yield current, counts
+
+
+def iter_import_lines(
+    buckets: Iterable[Tuple[int, Dict[SeriesKey, int]]],
+    metric_name: str = METRIC_NAME,
+    window_buckets: int = WINDOW_BUCKETS,
+) -> Iterator[bytes]:
+    """VictoriaMetrics import 格式：每個時間窗內每個 series 一行 {"metric":…, "values":…, "timestamps":…}。"""
+    window: Dict[SeriesKey, Dict[int, int]] = {}
+    held = 0
+    for bucket, counts in buckets:
+        for key, value in counts.items():
+            series = window.setdefault(key, {})
+            series[bucket] = series.get(bucket, 0) + value
+        held += 1
+        if held >= window_buckets:
+            yield from _window_lines(window, metric_name)
+            window, held = {}, 0
+    yield from _window_lines(window, metric_name)
+
+
+def _window_lines(window: Dict[SeriesKey, Dict[int, int]], metric_name: str) -> Iterator[bytes]:
+    for key, series in window.items():
+        timestamps = sorted(series)
+        line = {
+            "metric": {"__name__": metric_name, **dict(key)},
+            "values": [series[ts] for ts in timestamps],
+            "timestamps": [ts * 1000 for ts in timestamps],
+        }
+        yield json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def write_file(lines: Iterable[bytes], output: str) -> int:
+    written = 0
+    opener = gzip.open if output.endswith(".gz") else open
+    with opener(output, "wb") as f:
+        for line in lines:
+            f.write(line)
+            written += 1
+    return written
+
+
+def post_batches(lines: Iterable[bytes], url: str, batch_bytes: int = BATCH_BYTES) -> int:
+    """以 gzip 壓縮的大批次 POST 到 <url>/api/v1/import。"""
+    import_url = url.rstrip("/") + "/api/v1/import"
+    batch: List[bytes] = []
+    size = sent = 0
+
+    def send() -> None:
+        request = urllib.request.Request(
+            import_url,
+            data=gzip.compress(b"".join(batch)),
+            method="POST",
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=300) as resp:
+            resp.read()
+
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= batch_bytes:
+            send()
+            sent += len(batch)
+            batch, size = [], 0
+    if batch:
+        send()
+        sent += len(batch)
+    return sent
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill archived data_collect CSVs into VictoriaMetrics")
+    parser.add_argument("files", nargs="+", help="archived CSV files")
+    parser.add_argument("--bucket", type=int, default=80, help="bucket size in seconds (default: exporter FREQUENCY)")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes (default: all cores)")
+    parser.add_argument("--metric-name", default=METRIC_NAME)
+    parser.add_argument("--window", type=int, default=WINDOW_BUCKETS, help="buckets merged into one line per series (bounds memory)")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="write JSON lines to this file (.gz for gzip)")
+    target.add_argument("--url", help="VictoriaMetrics base url, e.g. http://victoriametrics:8428")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    started = time.monotonic()
+    buckets = aggregate(args.files, args.bucket, args.processes)
+    lines = iter_import_lines(buckets, args.metric_name, args.window)
+    if args.output:
+        written = write_file(lines, args.output)
+        logger.info(f"Wrote {written} lines to {args.output}")
+    else:
+        written = post_batches(lines, args.url)
+        logger.info(f"Imported {written} lines into {args.url}")
+    logger.info(f"Backfill of {len(args.files)} files finished in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
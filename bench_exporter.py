@@ -0,0 +1,171 @@
+# LogExporter 熱路徑的 benchmark：以 gen_data_collect.py 產生的 CSV 量測
+# _count_host_job、update_metrics、CustomGauge.collect 與完整 exposition，
+# 並與舊版 (eex6.py) 每次 scrape 重新分組的 collect 對照 (legacy_collect / legacy_scrape)。
+# 結果寫成 JSON，可用 --compare 與前一版的結果比較。
+#
+# 用法：
+#   python bench_exporter.py --rows 100000 --rows 1000000 --output bench_output.txt
+#   python bench_exporter.py --compare old.json --output bench_output.txt
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+from prometheus_client import generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from exporter import ENGINES, LogExporter
+from gen_data_collect import write_csv
+
+DEFAULT_OUTPUT = "bench_output.txt"
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {"min_s": min(timings), "median_s": statistics.median(timings), "max_s": max(timings)}
+
+
+def collect_cold(metric) -> list:
+    """第一次 scrape 的成本：丟棄 collect() 的快取後重新建立 GaugeMetricFamily。"""
+    metric._families = None
+    return list(metric.collect())
+
+
+def legacy_collect(metric_cache: dict) -> list:
+    """eex6.py 每次 scrape 的做法 (對照組)：走訪 metric_cache 的每個 series 依 label 名稱組合重新分組，
+    再建立 GaugeMetricFamily；成本與 series 數成正比且每次 scrape 都要付。"""
+    group: Dict[tuple, list] = {}
+    for labels, value in metric_cache.values():
+        label_keys = tuple(labels.keys())
+        if label_keys not in group:
+            group[label_keys] = []
+        group[label_keys].append((labels, value))
+    families = []
+    for label_keys, series in group.items():
+        gauge = GaugeMetricFamily("log_host_job_count", "Count of host and job_name with optional labels", labels=label_keys)
+        for labels, value in series:
+            gauge.add_metric([labels[k] for k in label_keys], value)
+        families.append(gauge)
+    return families
+
+
+class LegacyCollector:
+    """以 legacy_collect 輸出的 collector，量測舊版完整 scrape (重新分組 + generate_latest)。"""
+
+    def __init__(self, metric_cache: dict) -> None:
+        self.metric_cache = metric_cache
+
+    def collect(self):
+        return iter(legacy_collect(self.metric_cache))
+
+
+def bench_case(path: str, rows: int, repeat: int, engine: str = "python") -> Dict[str, object]:
+    exporter = LogExporter(f"bench_{engine}", tmp_log_file=path, engine=engine)
+    exporter.update_metrics()
+    metric = exporter.metric
+    # 舊版的 metric_cache：label tuple -> (labels, value) 的一般 dict，沒有寫入時維護的分組
+    metric_cache = dict(metric.metrics)
+    results = {
+        "count_host_job": measure(lambda: exporter._count_host_job(path), repeat),
+        "update_metrics": measure(exporter.update_metrics, repeat),
+        "collect": measure(lambda: list(metric.collect()), repeat),
+        "collect_cold": measure(lambda: collect_cold(metric), repeat),
+        # 舊版每次 scrape 都重新分組 vs. 新版寫入時維護分組、scrape 只取快取的 exposition
+        "legacy_collect": measure(lambda: legacy_collect(metric_cache), repeat),
+        "legacy_scrape": measure(lambda: generate_latest(LegacyCollector(metric_cache)), repeat),
+        "scrape": measure(lambda: b"".join(exporter.scrape("bench")[1]), repeat),
+        "iter_exposition": measure(lambda: b"".join(metric.iter_exposition()), repeat),
+        "generate_latest": measure(lambda: generate_latest(metric), repeat),
+    }
+    for name in ("count_host_job", "update_metrics"):
+        results[name]["rows_per_s"] = rows / results[name]["median_s"]
+    return {
+        "rows": rows,
+        "file_bytes": os.path.getsize(path),
+        "series": len(metric.metrics),
+        "results": results,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: Dict[str, object], baseline: Dict[str, object]) -> List[str]:
+    """以 median 計算相對於 baseline 的倍率 (>1 表示變慢)。"""
+    lines = []
+    old_cases = {case["name"]: case for case in baseline["cases"]}
+    for case in current["cases"]:
+        old = old_cases.get(case["name"])
+        if old is None:
+            continue
+        for name, result in case["results"].items():
+            if name in old["results"]:
+                ratio = result["median_s"] / old["results"][name]["median_s"]
+                lines.append(f"{case['name']:>24} {name:>16} {ratio:6.2f}x")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the LogExporter hot paths")
+    parser.add_argument("--rows", type=int, action="append", help="rows per case (repeatable, default: 10000 and 100000)")
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--label-ratio", type=float, default=0.3)
+    parser.add_argument("--count-ratio", type=float, default=0.5)
+    parser.add_argument("--malformed-ratio", type=float, default=0.001)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES), help="parse engines to compare (default: python)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "timestamp": int(time.time()),
+        "cases": [],
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for rows in args.rows or [10000, 100000]:
+            path = os.path.join(tmpdir, f"data_collect_{rows}.csv")
+            write_csv(
+                path,
+                rows,
+                hosts=args.hosts,
+                jobs=args.jobs,
+                label_ratio=args.label_ratio,
+                count_ratio=args.count_ratio,
+                malformed_ratio=args.malformed_ratio,
+            )
+            for engine in args.engine or ["python"]:
+                case = bench_case(path, rows, args.repeat, engine)
+                case["name"] = f"rows={rows},hosts={args.hosts},jobs={args.jobs},engine={engine}"
+                report["cases"].append(case)
+                for name, result in case["results"].items():
+                    print(f"{case['name']:>24} {name:>16} {result['median_s'] * 1000:10.2f} ms")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print("\n".join(compare(report, json.load(f))))
+
+
+if __name__ == "__main__":
+    main()
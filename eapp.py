@@ -1,6 +1,7 @@
 """LogExporter"""
 import time
 import os
+import atexit
 import csv
 # from datetime import datetime
 import logging
@@ -17,11 +18,15 @@ from prometheus_client.exposition import MetricsHandler, generate_latest
 from tsre.common.settings.base_config import Config
 from tsre.common.settings.log import get_logger
 from src.setting.config import get_settings
+from log_pipeline import queue_handlers
 
 settings = get_settings()
 Config.load_yaml(path="src/setting/logging.yaml")
 logger: logging.Logger = get_logger()
 
+# debug 等級時每 N 列記錄一列 CSV 內容，而不是每列都寫 log
+ROW_LOG_SAMPLE = int(os.environ.get("ROW_LOG_SAMPLE", "1000"))
+
 class LogExporter(Collector):
     def __init__(self, log_file: str) -> None:
         self.log_file = log_file
@@ -110,7 +115,7 @@ class CustomMetricsHandler(MetricsHandler):
             scraper_ip = scraper_ip.split(',')[0].strip()
         else:
             scraper_ip = self.client_address[0]
-            logger.info(
+            logger.debug(
                 "can not find X-Forwarded-For IP use non-X-Forwarded-For IP"
             )
 
@@ -141,14 +146,19 @@ def start_custom_http_server(port: int) -> None:
     logger.info(f"Starting HTTP server on port {port}")
     server.serve_forever()
 
-def print_csv_contents(file_path: str) -> None:
+def log_csv_sample(file_path: str, sample: int = ROW_LOG_SAMPLE) -> None:
+    """debug 等級時記錄每 sample 列中的一列與總列數；其他等級不讀檔。"""
+    if not logger.isEnabledFor(logging.DEBUG) or sample <= 0:
+        return
+    rows = 0
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                logger.info(row)
+            for rows, row in enumerate(csv.reader(file), 1):
+                if rows % sample == 0:
+                    logger.debug(f"{file_path} row {rows}: {row}")
     except Exception as p_error:
         logger.error(f"Error reading file {file_path}: {p_error}")
+    logger.debug(f"{file_path} has {rows} rows")
 
 if __name__ == "__main__":
     LOGFILE = "logs/data_collect.csv"
@@ -156,6 +166,9 @@ if __name__ == "__main__":
     PORT = 6379
     FREQUENCY = 80
     exporter = LogExporter(LOGFILE)
+    # logging.yaml 設定的 handler 改由背景 thread 寫出，更新與 scrape 不會等磁碟
+    log_listener = queue_handlers(logger)
+    atexit.register(log_listener.stop)
 
     try:
         shutil.copyfile(LOGFILE, TMPLOGFILE)
@@ -187,8 +200,8 @@ if __name__ == "__main__":
             logger.warning(
                 f"Copy {LOGFILE} to {TMPLOGFILE} success"
             )
-            # 打印TMPLOGFILE內容
-            print_csv_contents(TMPLOGFILE)
+            # 取樣記錄TMPLOGFILE內容
+            log_csv_sample(TMPLOGFILE)
         except Exception as cpoy_e:
             logger.error(
                 f"Copy {LOGFILE} to {TMPLOGFILE} fail: {cpoy_e}"
@@ -1,7 +1,43 @@
 import unittest
 import tempfile
 import os
-from exporter import CustomGauge, LogExporter
+import io
+import threading
+import tracemalloc
+import time
+import urllib.request
+import urllib.error
+import urllib.parse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from prometheus_client.exposition import generate_latest
+from prometheus_client import CollectorRegistry, REGISTRY
+import exporter as exporter_module
+import csv
+import json
+import backfill
+from exporter import CustomGauge, DynamicGauge, LogExporter, CustomMetricsHandler, parse_selector, parse_row
+from gen_data_collect import generate_rows
+import load_harness
+import logging
+import queue
+from log_pipeline import RateLimitFilter, DroppingQueueHandler, queue_handlers, setup_logging
+import spool
+import subprocess
+import sys
+import socket
+import file_lock
+from file_lock import AdvisoryLock
+from producer import LogProducer
+import routing
+import sqlite3
+import series_store
+from multiprocessing import Pool
+import shutil
+from persistent_queue import PersistentQueue
+from remote_write import (
+    RemoteWriteClient, RemoteWriteError, TimeSeries, marshal_write_request, unmarshal_write_request,
+    snappy_compress, snappy_decompress,
+)
 
 class TestCustomGauge(unittest.TestCase):
     def test_set_ignores_empty_labels(self):
@@ -11,6 +47,218 @@ class TestCustomGauge(unittest.TestCase):
         key = list(gauge.metrics.keys())[0]
         self.assertNotIn(("b", ""), key)
 
+    def test_groups_maintained_on_set(self):
+        gauge = CustomGauge("test_metric", "test")
+        gauge.set({"host": "a", "job_name": "j"}, 1)
+        gauge.set({"host": "b", "job_name": "j", "pod": "p"}, 2)
+        gauge.set({"host": "c", "job_name": "j"}, 3)
+        self.assertEqual(list(gauge.groups), [("host", "job_name"), ("host", "job_name", "pod")])
+        families = list(gauge.collect())
+        self.assertEqual([len(family.samples) for family in families], [2, 1])
+        # 未寫入時重用同一批 family；寫入後重新建立
+        self.assertIs(next(gauge.collect()), families[0])
+        gauge.inc({"host": "a", "job_name": "j"}, 4)
+        self.assertEqual(next(gauge.collect()).samples[0].value, 5)
+        # 同一 label set 換了 label 順序時移到新的分組
+        gauge.set({"pod": "p", "host": "b", "job_name": "j"}, 6)
+        self.assertEqual(list(gauge.groups), [("host", "job_name"), ("pod", "host", "job_name")])
+
+    def test_freeze_shares_unchanged_groups(self):
+        gauge = CustomGauge("test_metric", "test")
+        gauge.set({"host": "a", "job_name": "j"}, 1)
+        gauge.set({"host": "b", "job_name": "j", "pod": "p"}, 2)
+        frozen = gauge.freeze()
+        gauge.inc({"host": "a", "job_name": "j"}, 4)
+        refrozen = gauge.freeze()
+        # 先前發佈的版本不受之後寫入影響
+        self.assertEqual(frozen.metrics[(("host", "a"), ("job_name", "j"))][1], 1)
+        self.assertEqual(refrozen.metrics[(("host", "a"), ("job_name", "j"))][1], 5)
+        # 只有數值變動：未寫入的分組與反向索引沿用同一批物件
+        pod_group = ("host", "job_name", "pod")
+        self.assertIs(refrozen.groups[pod_group], frozen.groups[pod_group])
+        self.assertIs(refrozen._rendered[pod_group], frozen._rendered[pod_group])
+        self.assertIs(refrozen.index, frozen.index)
+        gauge.set({"host": "c", "job_name": "j"}, 3)
+        self.assertEqual(set(gauge.freeze().index["host"]), {"a", "b", "c"})
+        self.assertNotIn("c", frozen.index["host"])
+        self.assertEqual(b"".join(frozen.iter_exposition()).count(b"\n"), 6)
+        with self.assertRaises(TypeError):
+            frozen.set({"host": "d"}, 1)
+
+class TestDynamicGauge(unittest.TestCase):
+    def test_new_label_names_update_in_place(self):
+        registry = CollectorRegistry()
+        gauge = DynamicGauge("log_host_job_count", "test")
+        registry.register(gauge)
+        gauge.update([({"host": "host_1", "job_name": "job_A"}, 1)])
+        gauge.update([
+            ({"host": "host_1", "job_name": "job_A"}, 1),
+            ({"host": "host_1", "job_name": "job_A"}, 1),
+            ({"host": "host_3", "job_name": "job_B", "module_name": "cbbb"}, 1),
+        ])
+        body = generate_latest(registry).decode()
+        self.assertIn('log_host_job_count{host="host_1",job_name="job_A"} 2.0', body)
+        self.assertIn('log_host_job_count{host="host_3",job_name="job_B",module_name="cbbb"} 1.0', body)
+        gauge.update([({"host": "host_2", "job_name": "job_C"}, 1)])
+        self.assertEqual([dict(key)["host"] for key in gauge.metrics], ["host_2"])
+        self.assertEqual(list(gauge.index), ["host", "job_name"])
+
+    def test_memory_stays_flat_under_label_churn(self):
+        gauge = DynamicGauge("log_host_job_count", "test")
+
+        def cycle(i):
+            gauge.update(({"host": f"host_{j}", "job_name": "job", f"label_{i % 7}": str(i + j)}, 1) for j in range(200))
+            list(gauge.collect())
+
+        # 追蹤開始前配置的物件不計入，先在追蹤中跑過一輪完整的 label 組合
+        tracemalloc.start()
+        for i in range(50):
+            cycle(i)
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(50, 250):
+            cycle(i)
+        grown = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        self.assertEqual(len(gauge.metrics), 200)
+        self.assertEqual(len(gauge.groups), 1)
+        self.assertLess(grown, 64 * 1024)
+
+class TestParseRow(unittest.TestCase):
+    def test_label_syntaxes(self):
+        rows = csv.reader([
+            'host_1,job_A, {service_name=”aaa”, container_name=”bbbb”}',
+            'aaa,job1,2,"{\'k1\': \'v1\'}"',
+            'host_2,job_C',
+            'bad',
+            ',,,',
+            'h,j,abc',
+            'h,j,{service_name=',
+            'h,j,"{\'k1\': }"',
+            'h,j,3,{k=""},',
+        ])
+        parsed = [parse_row(row) for row in rows]
+        self.assertEqual(parsed[0], ({"service_name": "aaa", "container_name": "bbbb", "host": "host_1", "job_name": "job_A"}, 1))
+        self.assertEqual(parsed[1], ({"k1": "v1", "host": "aaa", "job_name": "job1"}, 2))
+        self.assertEqual(parsed[2], ({"host": "host_2", "job_name": "job_C"}, 1))
+        self.assertIsNone(parsed[3])
+        # 空 host/job_name、非數字 count、未閉合或缺值的 labels 皆為無效列
+        self.assertEqual(parsed[4:8], [None] * 4)
+        self.assertEqual(parsed[8], ({"host": "h", "job_name": "j"}, 3))
+
+    def test_generated_rows(self):
+        lines = list(generate_rows(2000, hosts=5, jobs=3, malformed_ratio=0.05, seed=1))
+        parsed = [parse_row(row) for row in csv.reader(lines)]
+        valid = [p for p in parsed if p is not None]
+        self.assertGreater(len(valid), 1800)
+        self.assertLess(len(valid), 2000)
+        self.assertTrue(any("service_name" in labels or "pod" in labels for labels, _ in valid))
+        hosts = {labels["host"] for labels, _ in valid}
+        self.assertEqual(hosts, {f"host_{i}" for i in range(5)})
+
+class TestLogPipeline(unittest.TestCase):
+    def test_rate_limit_collapses_repeated_messages(self):
+        log_filter = RateLimitFilter(interval=0.2, burst=2)
+        records = [
+            logging.LogRecord("exporter", logging.WARNING, "exporter.py", 10, f"attempt {i} failed", None, None)
+            for i in range(5)
+        ]
+        self.assertEqual([log_filter.filter(record) for record in records], [True, True, False, False, False])
+        # 其他呼叫位置不受影響
+        other = logging.LogRecord("exporter", logging.WARNING, "exporter.py", 20, "other", None, None)
+        self.assertTrue(log_filter.filter(other))
+        threading.Event().wait(0.25)
+        record = logging.LogRecord("exporter", logging.WARNING, "exporter.py", 10, "attempt 5 failed", None, None)
+        self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.getMessage(), "attempt 5 failed (suppressed 3 similar messages)")
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        for i in range(3):
+            handler.handle(logging.LogRecord("exporter", logging.INFO, "exporter.py", 1, f"row {i}", None, None))
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.queue.get_nowait().getMessage(), "row 0")
+
+    def test_errors_are_not_rate_limited(self):
+        log_filter = RateLimitFilter(interval=60, burst=1)
+        records = [
+            logging.LogRecord("exporter", logging.ERROR, "exporter.py", 10, f"read failed {i}", None, None)
+            for i in range(3)
+        ]
+        self.assertEqual([log_filter.filter(record) for record in records], [True, True, True])
+
+    def test_queue_handlers_keeps_configured_handlers(self):
+        parent = logging.getLogger("eex7_queue_parent")
+        child = logging.getLogger("eex7_queue_parent.child")
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        parent.addHandler(handler)
+        parent.setLevel(logging.INFO)
+        self.addCleanup(parent.handlers.clear)
+        # 子 logger 沒有 handler 時改寫實際輸出的上層 logger
+        listener = queue_handlers(child)
+        self.assertEqual([type(h) for h in parent.handlers], [DroppingQueueHandler])
+        child.info("copied")
+        listener.stop()
+        self.assertEqual(stream.getvalue(), "INFO copied\n")
+
+    def test_setup_logging_writes_stderr_and_optional_file(self):
+        root = logging.getLogger()
+        saved_handlers, saved_level, saved_stderr = root.handlers[:], root.level, sys.stderr
+        self.addCleanup(setattr, root, "handlers", saved_handlers)
+        self.addCleanup(root.setLevel, saved_level)
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        log_file = os.path.join(path, "exporter.log")
+        for file_path in (None, log_file):
+            sys.stderr = io.StringIO()
+            try:
+                listener = setup_logging(file_path)
+            finally:
+                stderr, sys.stderr = sys.stderr, saved_stderr
+            logging.getLogger("exporter").warning(f"to {file_path}")
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+            # 容器的 log 收集讀 stderr，有沒有指定檔案都要寫到 stderr
+            self.assertIn(f"WARNING - to {file_path}", stderr.getvalue())
+        with open(log_file, encoding="utf-8") as f:
+            self.assertEqual(f.read().count("WARNING - to"), 1)
+
+class TestBackfill(unittest.TestCase):
+    def test_buckets_and_import_lines(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        for name in ("tmp_log_20240101120030.csv", "tmp_log_20240101120150.csv"):
+            with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+                f.write("host_1,job_A,2\nhost_1,job_A,3\nhost_2,job_B, {module_name=”m”}\n")
+        files = sorted(os.path.join(path, name) for name in os.listdir(path))
+        buckets = backfill.aggregate(files, bucket_seconds=80, processes=1)
+        lines = [json.loads(line) for line in backfill.iter_import_lines(buckets)]
+        by_host = {line["metric"]["host"]: line for line in lines}
+        self.assertEqual(by_host["host_1"]["values"], [5, 5])
+        first, second = by_host["host_1"]["timestamps"]
+        self.assertEqual((first % 80000, second - first), (0, 80000))
+        self.assertEqual(by_host["host_2"]["metric"]["module_name"], "m")
+
+    def test_buckets_are_emitted_in_time_order_and_windowed(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        # 檔名順序與時間順序不同，同一個 bucket 有兩個檔案
+        names = ("b_20240101120300.csv", "a_20240101120010.csv", "c_20240101120150.csv", "d_20240101120020.csv")
+        for name in names:
+            with open(os.path.join(path, name), "w", encoding="utf-8") as f:
+                f.write("host_1,job_A,1\n")
+        files = [os.path.join(path, name) for name in names]
+        buckets = list(backfill.aggregate(files, bucket_seconds=80, processes=1))
+        starts = [bucket for bucket, _ in buckets]
+        self.assertEqual(starts, sorted(starts))
+        self.assertEqual(len(starts), len(set(starts)))
+        self.assertEqual(sum(counts[(("host", "host_1"), ("job_name", "job_A"))] for _, counts in buckets), 4)
+        # 每個時間窗各自輸出一行，記憶體只保留 window_buckets 個 bucket
+        lines = [json.loads(line) for line in backfill.iter_import_lines(buckets, window_buckets=1)]
+        self.assertEqual([line["timestamps"] for line in lines], [[start * 1000] for start in starts])
+
 class TestLogExporter(unittest.TestCase):
     def setUp(self):
         # 建立暫存 CSV 檔案
@@ -45,16 +293,950 @@ class TestLogExporter(unittest.TestCase):
         )
         self.assertTrue(found)
 
-    def test_scraper_limit(self):
-        self.exporter.set_scraper_id("UA-TEST")
-        self.exporter.set_scraper_ip("127.0.0.1")
+    def test_iter_exposition_matches_generate_latest(self):
+        metric = CustomGauge("test_metric", "test\nhelp")
+        for labels, value in self.exporter._count_host_job(self.tmpfile.name):
+            metric.set(labels, value)
+        metric.set({"host": "ddd", "job_name": 'q"\\x'}, 1.5)
+        chunks = list(metric.iter_exposition(chunk_series=1))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), generate_latest(metric))
+
+    def test_repeat_scrape_keeps_series(self):
         self.exporter.update_metrics()
         collected = list(self.exporter.collect())
         self.assertGreater(len(collected), 0)
 
-        # 第二次呼叫 collect，應該因為已抓過而不再回傳資料
+        # 第二次呼叫 collect 仍回傳相同資料，避免 Prometheus 判定 series stale
         collected_again = list(self.exporter.collect())
-        self.assertEqual(len(collected_again), 0)
+        self.assertEqual(len(collected_again), len(collected))
+
+    def test_scrape_generation_cursor(self):
+        self.exporter.update_metrics()
+        generation, body, fresh = self.exporter.scrape("127.0.0.1_UA-TEST")
+        self.assertTrue(fresh)
+        self.assertIn(b'host="aaa"', b"".join(body))
+
+        # 同一世代重複抓取：拿到相同的快取 body，但不再視為新資料
+        generation_again, body_again, fresh_again = self.exporter.scrape("127.0.0.1_UA-TEST")
+        self.assertEqual(generation_again, generation)
+        self.assertIs(body_again, body)
+        self.assertFalse(fresh_again)
+
+        self.exporter.update_metrics()
+        generation_next, _, fresh_next = self.exporter.scrape("127.0.0.1_UA-TEST")
+        self.assertEqual(generation_next, generation + 1)
+        self.assertTrue(fresh_next)
+
+    def test_shards_partition_series(self):
+        self.exporter.shard_counts = (3,)
+        self.exporter.update_metrics()
+        series_lines = set()
+        for index in range(3):
+            _, segments, _ = self.exporter.scrape("127.0.0.1_UA-TEST", (index, 3))
+            if segments:
+                self.assertTrue(segments[0].startswith(b"# HELP"))
+            lines = {line for line in b"".join(segments).splitlines() if not line.startswith(b"#")}
+            self.assertFalse(lines & series_lines)
+            series_lines |= lines
+        full = {line for line in b"".join(self.exporter.scrape("x")[1]).splitlines() if not line.startswith(b"#")}
+        self.assertEqual(series_lines, full)
+
+    def test_scrapers_never_see_half_built_snapshot(self):
+        # 每個世代所有 series 的值相同；Scraper 若讀到更新到一半的快照會看到混合的值或缺少 series
+        hosts = 300
+        exporter = LogExporter(log_file="not_used.csv", tmp_log_file=self.tmpfile.name, series_ttl=2, shard_counts=(2,))
+        stop = threading.Event()
+        errors = []
+
+        def values(segments):
+            lines = [line for line in b"".join(segments).splitlines() if not line.startswith(b"#")]
+            return [line.rsplit(b" ", 1)[1] for line in lines]
+
+        def update():
+            for generation in range(1, 40):
+                with open(self.tmpfile.name, "w", encoding="utf-8") as f:
+                    f.writelines(f"host_{i},job,{generation % 7 + 1}\n" for i in range(hosts))
+                exporter.update_metrics()
+            stop.set()
+
+        def scrape():
+            while not stop.is_set():
+                try:
+                    generation, segments, _ = exporter.scrape("s")
+                    full = values(segments)
+                    if generation and (len(full) != hosts or len(set(full)) != 1):
+                        errors.append((generation, len(full), set(full)))
+                    selected = values(exporter.scrape("s", None, [parse_selector('{job_name="job"}')])[1])
+                    if generation and (len(selected) != hosts or len(set(selected)) != 1):
+                        errors.append(("match[]", len(selected), set(selected)))
+                    for shard in ((0, 2), (1, 2), (0, 3), (2, 3)):
+                        if len(set(values(exporter.scrape("s", shard)[1]))) > 1:
+                            errors.append(("shard", shard))
+                except Exception as exc:  # pylint: disable=broad-except
+                    errors.append(exc)
+
+        # 縮短 thread 切換間隔，讓 Scraper 更容易落在更新途中
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-5)
+        threads = [threading.Thread(target=scrape) for _ in range(4)] + [threading.Thread(target=update)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(errors, [])
+        self.assertEqual(exporter.generation, 39)
+        # 延遲 render 的分片記在 exporter 的快取，不寫回已發佈的快照
+        self.assertEqual(set(exporter._snapshot.shards), {(0, 2), (1, 2)})
+
+    def test_select_uses_label_index(self):
+        self.exporter.update_metrics()
+        metric = self.exporter.metric
+        self.assertEqual(metric.index["k1"]["v1"], {k for k in metric.metrics if ("k1", "v1") in k})
+        _, matchers = parse_selector('{k1="v1",host=~"a.*"}')
+        keys = metric.select(matchers)
+        self.assertEqual([dict(k)["host"] for k in keys], ["aaa"])
+        _, matchers = parse_selector('{job_name=~"job.*",k2!="v2"}')
+        self.assertEqual(sorted(dict(k)["host"] for k in metric.select(matchers)), ["bbb", "ccc"])
+
+    def test_match_by_metric_name_keeps_exposition_order(self):
+        for series_ttl in (0, 2):
+            exporter = LogExporter(log_file="not_used.csv", tmp_log_file=self.tmpfile.name, series_ttl=series_ttl)
+            exporter.update_metrics()
+            full = [line for line in b"".join(exporter.scrape("s")[1]).splitlines() if not line.startswith(b"#")]
+            for selector, expected in (
+                ('{__name__="log_host_job_count"}', full),
+                ('{__name__=~"log_host_.*",job_name!="job2"}', [line for line in full if b'job_name="job2"' not in line]),
+                ('log_host_job_count{__name__="other"}', []),
+            ):
+                with self.subTest(series_ttl=series_ttl, selector=selector):
+                    for _ in range(3):
+                        body = b"".join(exporter.scrape("s", None, [parse_selector(selector)])[1])
+                        self.assertEqual([line for line in body.splitlines() if not line.startswith(b"#")], expected)
+
+class TestNumpyEngine(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "data_collect.csv")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.writelines(generate_rows(5000, hosts=7, jobs=3, malformed_ratio=0.01, seed=3))
+            f.write("host_1,job_0")  # 最後一列沒有換行
+
+    def totals(self, engine):
+        exporter = LogExporter(log_file=f"engine_{engine}.csv", engine=engine)
+        exporter.update_metrics([self.path])
+        return {key: value for key, (_, value) in exporter.metric.metrics.items()}
+
+    def test_matches_python_engine(self):
+        original = exporter_module.NUMPY_CHUNK_BYTES
+        exporter_module.NUMPY_CHUNK_BYTES = 4096  # 讓區塊邊界切在列中間
+        self.addCleanup(setattr, exporter_module, "NUMPY_CHUNK_BYTES", original)
+        self.assertEqual(self.totals("numpy"), self.totals("python"))
+        rows, size, _ = exporter_module.count_rows_distinct(self.path)
+        self.assertEqual((rows, size), exporter_module.count_rows(self.path)[:2])
+
+    @unittest.skipIf(exporter_module.np is None, "numpy is not installed")
+    def test_numpy_unique_counts_in_first_seen_order(self):
+        rows, counts = exporter_module._count_lines(b"b,j\na,j\nb,j\n\na,j\nb,j\nc,k")
+        self.assertEqual(rows, 7)
+        self.assertEqual(list(counts.items()), [(b"b,j", 3), (b"a,j", 2), (b"", 1), (b"c,k", 1)])
+
+    def test_long_line_is_not_padded(self):
+        original = exporter_module.NUMPY_FACTORIZE_BYTES
+        exporter_module.NUMPY_FACTORIZE_BYTES = 1024  # 同長度的列分批展開
+        self.addCleanup(setattr, exporter_module, "NUMPY_FACTORIZE_BYTES", original)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n" + "x" * 100_000 + "\n" + "host_1,job_0\n" * 20000)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self.assertEqual(self.totals("numpy"), self.totals("python"))
+        # 不會把每列補齊到最長列的長度 (20000 列 x 100 KB)
+        self.assertLess(tracemalloc.get_traced_memory()[1], 256 << 20)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            LogExporter(log_file="bad.csv", engine="polars")
+
+    @unittest.skipIf(exporter_module.pa is None, "pyarrow is not installed")
+    def test_arrow_matches_count_host_job(self):
+        python_exporter = LogExporter(log_file="engine_python.csv")
+        arrow_exporter = LogExporter(log_file="engine_arrow.csv", engine="arrow")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n\nhost_2,job_1,3,\"{'service_name': 'svc', module_name=m}\"\n")
+        def summed(results):
+            totals = {}
+            for labels, value in results:
+                key = tuple(sorted(labels.items()))
+                totals[key] = totals.get(key, 0) + value
+            return totals
+
+        self.assertEqual(
+            summed(arrow_exporter._count_host_job(self.path)), summed(python_exporter._count_host_job(self.path))
+        )
+        self.assertEqual(self.totals("arrow"), self.totals("python"))
+
+        # 空檔案 (copy 模式的空週期) 與 pyarrow 讀不了的 \x1f 列不能中斷更新
+        empty = os.path.join(self.dir, "empty.csv")
+        open(empty, "w").close()
+        self.assertEqual(exporter_module.count_rows_arrow(empty), (0, 0, []))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("host_3,job_2\x1fx\n")
+        self.assertEqual(self.totals("arrow"), self.totals("python"))
+        arrow_exporter.update_metrics([empty, self.path])
+        self.assertEqual(arrow_exporter.generation, 1)
+
+    def test_arrow_requires_pyarrow(self):
+        if exporter_module.pa is not None:
+            self.skipTest("pyarrow is installed")
+        with self.assertRaises(RuntimeError):
+            LogExporter(log_file="arrow.csv", engine="arrow")
+
+class TestSeriesTTL(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.exporter = LogExporter(log_file="ttl.csv", series_ttl=2)
+
+    def cycle(self, text):
+        path = os.path.join(self.dir, "cycle.csv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.exporter.update_metrics([path])
+        return {labels["host"]: value for labels, value in self.exporter.metric.metrics.values()}
+
+    def test_unseen_series_report_zero_until_expired(self):
+        self.assertEqual(self.cycle("host_1,job_A,2\nhost_2,job_B, {module_name=”m”}\n"), {"host_1": 2, "host_2": 1})
+        published = self.exporter._snapshot
+        self.assertEqual(self.cycle("host_1,job_A,3\n"), {"host_1": 3, "host_2": 0})
+        # 已發佈的快照不受之後的更新影響
+        self.assertEqual({labels["host"]: value for labels, value in published.metric.metrics.values()}, {"host_1": 2, "host_2": 1})
+        self.assertEqual(self.cycle("host_1,job_A,3\n"), {"host_1": 3, "host_2": 0})
+        self.assertEqual(self.cycle("host_1,job_A,3\n"), {"host_1": 3})
+        self.assertEqual(self.exporter._last_seen, {(0, (("host", "host_1"), ("job_name", "job_A"))): 4})
+        self.assertEqual(self.cycle("host_2,job_B, {module_name=”m”}\n"), {"host_1": 0, "host_2": 1})
+
+    def test_only_changed_groups_are_rendered(self):
+        self.cycle("host_1,job_A,2\nhost_2,job_B, {module_name=”m”}\n")
+        before = self.exporter._snapshot.segments
+        self.cycle("host_1,job_A,2\nhost_2,job_B,5, {module_name=”m”}\n")
+        after = self.exporter._snapshot.segments
+        # host/job_name 分組未變，沿用同一個 bytes 物件；module_name 分組重新 render
+        self.assertIs(after[0], before[0])
+        self.assertIsNot(after[1], before[1])
+        self.assertEqual(b"".join(after), generate_latest(self.exporter))
+
+class TestSQLiteSeriesStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.paths = []
+        for cycle, rows in enumerate((3000, 1000)):
+            path = os.path.join(self.dir, f"cycle{cycle}.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(generate_rows(rows, hosts=20, jobs=4, label_ratio=0.5, seed=cycle))
+            self.paths.append(path)
+
+    def exporters(self, router=None):
+        memory = LogExporter(log_file="store_memory.csv", router=router)
+        store = LogExporter(log_file="store_sqlite.csv", router=router, store_path=os.path.join(self.dir, "series.db"))
+        self.addCleanup(store.series_store.close)
+        return memory, store
+
+    def lines(self, segments):
+        return sorted(b"".join(segments).decode("utf-8").splitlines())
+
+    def test_matches_dict_store(self):
+        for router in (None, routing.load_routes(os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes.yml"))):
+            memory, store = self.exporters(router)
+            for path in self.paths:
+                with self.subTest(router=router is not None, path=path):
+                    memory.update_metrics([path])
+                    store.update_metrics([path])
+                    self.assertEqual(b"".join(store.scrape("s")[1]), b"".join(memory.scrape("m")[1]))
+                    self.assertEqual(store.series_store.series_count, sum(len(m.metrics) for m in memory._snapshot.families))
+                    self.assertEqual(self.lines(store.scrape("s", (1, 3))[1]), self.lines(memory.scrape("m", (1, 3))[1]))
+                    for selector in (
+                        '{host="host_3"}', '{host="host_3",job_name!="job_1"}', '{job_name=~"job_[02]"}',
+                        '{__name__=~"log_host_job_(count|basic)",host="host_3"}',
+                    ):
+                        selectors = [parse_selector(selector)]
+                        self.assertEqual(
+                            self.lines(store.scrape("s", None, selectors)[1]), self.lines(memory.scrape("m", None, selectors)[1])
+                        )
+                    self.assertEqual(generate_latest(store), generate_latest(memory))
+
+    def test_scrape_reads_committed_generation(self):
+        _, store = self.exporters()
+        store.update_metrics([self.paths[0]])
+        expected = b"".join(store.scrape("s")[1])
+        segments = iter(store.scrape("s")[1])
+        first = next(segments)
+        # 讀取中的 scrape 不受之後 commit 的世代影響，更新也不會被讀取阻塞
+        store.update_metrics([self.paths[1]])
+        self.assertEqual(first + b"".join(segments), expected)
+        self.assertNotEqual(b"".join(store.scrape("s")[1]), expected)
+        conn = sqlite3.connect(store.series_store.path)
+        self.addCleanup(conn.close)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_store_memory_is_flat_in_row_count(self):
+        # store 模式下解析結果逐列 / 逐區塊寫入 SQLite，peak 不隨列數 (label set 數) 成長
+        original_chunk = exporter_module.NUMPY_CHUNK_BYTES
+        exporter_module.NUMPY_CHUNK_BYTES = 256 << 10
+        self.addCleanup(setattr, exporter_module, "NUMPY_CHUNK_BYTES", original_chunk)
+        reference = None
+        for engine in ("python", "numpy"):
+            peaks = []
+            for rows in (8000, 32000):
+                path = os.path.join(self.dir, f"flat{rows}.csv")
+                with open(path, "w", encoding="utf-8") as f:
+                    # 每個 label set 出現兩次，前後相隔半個檔案 (落在不同區塊)
+                    half = rows // 2
+                    f.writelines(f"host_{i % half},job_{i % half % 7},2,{{pod=p{i % half}}}\n" for i in range(rows))
+                store = LogExporter(
+                    log_file=f"store_flat_{engine}.csv", tmp_log_file=path, engine=engine,
+                    store_path=os.path.join(self.dir, f"flat_{engine}_{rows}.db"),
+                )
+                self.addCleanup(store.series_store.close)
+                tracemalloc.start()
+                store.update_metrics()
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                self.assertEqual(store.series_store.series_count, rows // 2)
+            with self.subTest(engine=engine):
+                self.assertLess(peaks[1], peaks[0] * 1.5 + (1 << 20))
+            # 跨區塊重複出現的 label set 在 store 中相加，輸出與逐列解析相同
+            body = b"".join(store.scrape("s")[1])
+            reference = reference or body
+            self.assertEqual(body, reference)
+
+    def test_exposition_order_uses_index(self):
+        _, store = self.exporters()
+        store.update_metrics([self.paths[0]])
+        conn = sqlite3.connect(store.series_store.path)
+        self.addCleanup(conn.close)
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT family, labels, value FROM series" + series_store._ORDER).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        self.assertIn("series_order", details)
+        self.assertNotIn("TEMP B-TREE", details)
+
+    def test_rejects_ttl_and_series_limit(self):
+        with self.assertRaises(ValueError):
+            LogExporter(log_file="store_ttl.csv", series_ttl=2, store_path=os.path.join(self.dir, "ttl.db"))
+
+class TestHandoff(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.log_file = os.path.join(self.dir, "data_collect.csv")
+        self.exporter = LogExporter(log_file=self.log_file)
+
+    def append(self, line):
+        with open(self.log_file, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def test_segment_parsed_after_grace_cycle(self):
+        self.append("host_1,job_A,2\n")
+        held = open(self.log_file, "a", encoding="utf-8")
+        exporter_module.handoff_and_update(self.exporter)
+        # 第一輪只改名，尚未解析
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertEqual(len(exporter_module.pending_segments(self.log_file)), 1)
+        self.assertEqual(self.exporter.metric.metrics, {})
+
+        # 改名後仍握著舊 fd 的 writer 寫進 segment，新的 writer 建立新的 log_file
+        held.write("host_2,job_B,3\n")
+        held.close()
+        self.append("host_3,job_C,4\n")
+        exporter_module.handoff_and_update(self.exporter)
+        hosts = {labels["host"]: value for labels, value in self.exporter.metric.metrics.values()}
+        self.assertEqual(hosts, {"host_1": 2, "host_2": 3})
+        self.assertEqual(len(exporter_module.pending_segments(self.log_file)), 1)
+
+        exporter_module.handoff_and_update(self.exporter)
+        hosts = {labels["host"]: value for labels, value in self.exporter.metric.metrics.values()}
+        self.assertEqual(hosts, {"host_3": 4})
+        self.assertEqual(exporter_module.pending_segments(self.log_file), [])
+
+    def test_locked_log_is_handed_off_next_cycle(self):
+        self.append("host_1,job_A,2\n")
+        writer = AdvisoryLock(f"{self.log_file}.lock", shared=True)
+        self.assertTrue(writer.acquire(blocking=False))
+        exporter_module.handoff_and_update(self.exporter)
+        self.assertTrue(os.path.exists(self.log_file))
+        writer.release()
+        exporter_module.handoff_and_update(self.exporter)
+        self.assertFalse(os.path.exists(self.log_file))
+
+class TestLogProducer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.log_file = os.path.join(self.dir, "data_collect.csv")
+
+    def test_aggregates_and_flushes_on_size(self):
+        producer = LogProducer(self.log_file, max_rows=2, background=False)
+        for _ in range(3):
+            producer.emit("host_1", "job_A", {"service_name": "aaa"})
+        self.assertFalse(os.path.exists(self.log_file))
+        producer.emit("host_2", "job_B")
+        with open(self.log_file, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        producer.emit("host_2", "job_B", count=4)
+        producer.close()
+
+        exporter = LogExporter(log_file=self.log_file)
+        exporter.update_metrics([self.log_file])
+        values = {tuple(sorted(labels.items())): value for labels, value in exporter.metric.metrics.values()}
+        self.assertEqual(values, {
+            (("host", "host_1"), ("job_name", "job_A"), ("service_name", "aaa")): 3,
+            (("host", "host_2"), ("job_name", "job_B")): 5,
+        })
+
+    def test_special_characters_round_trip(self):
+        producer = LogProducer(self.log_file, background=False)
+        producer.emit("host,1", "job\nA", {
+            "msg": "a,b", "quote": "it's \"q\"", "braces": "{x}", "sep": "k=v: w", "lang": "中文 “x”",
+        })
+        with self.assertRaises(ValueError):
+            producer.emit("host_1", "job_A", {"bad-name": "x"})
+        producer.close()
+        with open(self.log_file, encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(len(rows), 1)
+        # 寫出的列能被 parse_row 讀回，無法原樣表示的字元換成 `_`，不會整列被丟棄
+        self.assertEqual(parse_row(rows[0]), ({
+            "host": "host_1", "job_name": "job_A", "msg": "a_b", "quote": "it_s _q_",
+            "braces": "_x_", "sep": "k=v: w", "lang": "中文 _x_",
+        }, 1))
+
+    def test_background_flush_to_spool(self):
+        with LogProducer(spool_dir=self.dir, flush_interval=0.05) as producer:
+            producer.emit("host_1", "job_A")
+            threading.Event().wait(0.3)
+            self.assertEqual(len(os.listdir(os.path.join(self.dir, spool.INCOMING))), 1)
+
+class TestAdvisoryLock(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "data_collect.csv.lock")
+
+    def test_shared_and_exclusive(self):
+        first, second = AdvisoryLock(self.path, shared=True), AdvisoryLock(self.path, shared=True)
+        self.assertTrue(first.acquire(blocking=False))
+        self.assertTrue(second.acquire(blocking=False))
+        exclusive = AdvisoryLock(self.path)
+        self.assertFalse(exclusive.acquire(blocking=False))
+        first.release()
+        second.release()
+        self.assertTrue(exclusive.acquire(timeout=1))
+        exclusive.release()
+
+    def test_lock_released_when_holder_dies(self):
+        code = f"from file_lock import AdvisoryLock; AdvisoryLock({self.path!r}).acquire(); import os; os._exit(0)"
+        subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertTrue(AdvisoryLock(self.path).acquire(blocking=False))
+
+    def test_fallback_takes_over_stale_lock_file(self):
+        dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(dead.stdout.strip())
+        lock = AdvisoryLock(self.path, backend="pidfile")
+        self.assertTrue(lock.acquire(timeout=1))
+        self.assertFalse(AdvisoryLock(self.path, backend="pidfile").acquire(blocking=False))
+        self.assertEqual(file_lock._read_pid(self.path), os.getpid())
+        lock.release()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fallback_takeover_is_serialized(self):
+        dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(dead.stdout.strip())
+        # 另一個接手者持有 guard 時不接手，也不動鎖檔
+        with open(f"{self.path}.takeover", "w", encoding="utf-8"):
+            pass
+        self.assertFalse(AdvisoryLock(self.path, backend="pidfile").acquire(blocking=False))
+        self.assertEqual(file_lock._read_pid(self.path), int(dead.stdout))
+        os.remove(f"{self.path}.takeover")
+        self.assertTrue(file_lock._pid_alive(os.getpid()))
+        self.assertFalse(file_lock._pid_alive(int(dead.stdout)))
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.exporter = LogExporter(log_file="spool")
+
+    def hosts(self):
+        return {labels["host"]: value for labels, value in self.exporter.metric.metrics.values()}
+
+    def test_claim_parse_and_commit(self):
+        consumer = spool.SpoolConsumer(self.dir)
+        spool.publish(self.dir, b"host_1,job_A,2\nhost_2,job_B\n")
+        spool.publish(self.dir, b"host_1,job_A,3\n")
+        with Pool(2) as pool:
+            exporter_module.spool_and_update(self.exporter, consumer, pool)
+        # 不同 segment 中相同 label set 的數值相加
+        self.assertEqual(self.hosts(), {"host_1": 5, "host_2": 1})
+        self.assertEqual(os.listdir(consumer.incoming_dir), [])
+        self.assertEqual(os.listdir(consumer.processing_dir), [])
+
+        exporter_module.spool_and_update(self.exporter, consumer)
+        self.assertEqual(self.hosts(), {})
+
+    def test_restart_never_double_counts(self):
+        consumer = spool.SpoolConsumer(self.dir, keep_done=True)
+        spool.publish(self.dir, b"host_1,job_A,2\n", name="a.csv")
+        spool.publish(self.dir, b"host_2,job_B,4\n", name="b.csv")
+        paths = consumer.claim()
+        # 發佈後、收尾前崩潰：a.csv 已寫進 checkpoint，b.csv 尚未
+        consumer._save_checkpoint(["a.csv"])
+
+        restarted = spool.SpoolConsumer(self.dir, keep_done=True)
+        self.assertEqual(os.listdir(restarted.done_dir), ["a.csv"])
+        paths = restarted.claim()
+        self.assertEqual([os.path.basename(path) for path in paths], ["b.csv"])
+        self.exporter.update_metrics(paths)
+        restarted.commit(paths)
+        self.assertEqual(self.hosts(), {"host_2": 4})
+        self.assertEqual(sorted(os.listdir(restarted.done_dir)), ["a.csv", "b.csv"])
+
+class TestRouting(unittest.TestCase):
+    def test_routes_yaml_matches_exporter08_metrics(self):
+        router = routing.load_routes(os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes.yml"))
+        tmpfile = tempfile.NamedTemporaryFile(mode="w", suffix=".csv", delete=False, encoding="utf-8")
+        tmpfile.write(
+            "host_1,job_A, {service_name=”aaa”, container_name=”bbbb”}\n"
+            "host_1,job_A\n"
+            "host_3,job_B, {module_name=”cbbb”}\n"
+            "host_3,job_B\n"
+        )
+        tmpfile.close()
+        self.addCleanup(os.unlink, tmpfile.name)
+        exporter = LogExporter(log_file="routed.csv", router=router, shard_counts=(2,))
+        exporter.update_metrics([tmpfile.name])
+        families = {metric.name: metric for metric in exporter._snapshot.families}
+
+        def values(name):
+            return sorted((tuple(sorted(labels.items())), v) for labels, v in families[name].metrics.values())
+
+        self.assertEqual(values("log_host_job_basic"), [
+            ((("host", "host_1"), ("job_name", "job_A")), 2),
+            ((("host", "host_3"), ("job_name", "job_B")), 2),
+        ])
+        self.assertEqual(values("log_host_job_service"), [
+            ((("container_name", "bbbb"), ("host", "host_1"), ("job_name", "job_A"), ("service_name", "aaa")), 1),
+        ])
+        self.assertEqual(values("log_host_job_module"), [
+            ((("host", "host_3"), ("job_name", "job_B"), ("module_name", "cbbb")), 1),
+        ])
+        self.assertEqual(len(families["log_host_job_count"].metrics), 4)
+        # 快取的 segments 與分片都包含所有 family
+        self.assertEqual(b"".join(exporter._snapshot.segments), generate_latest(exporter))
+        shard_body = b"".join(b"".join(exporter.scrape("s", (i, 2))[1]) for i in range(2))
+        self.assertEqual(shard_body.count(b"\nlog_host_job_"), b"".join(exporter._snapshot.segments).count(b"\nlog_host_job_"))
+        _, segments, _ = exporter.scrape("s", selectors=[parse_selector('log_host_job_module{host="host_3"}')])
+        self.assertIn(b'log_host_job_module{host="host_3"', b"".join(segments))
+        self.assertNotIn(b"log_host_job_basic{", b"".join(segments))
+
+    def test_match_absent_and_stop(self):
+        router = routing.compile_routes({"routes": [
+            {"metric": "prod", "match": {"job_name": "prod_.*"}, "absent": ["debug"], "stop": True},
+            {"metric": "other"},
+        ]})
+        self.assertEqual(router.route({"host": "h", "job_name": "prod_api"}), [(0, {"host": "h", "job_name": "prod_api"})])
+        self.assertEqual([i for i, _ in router.route({"host": "h", "job_name": "dev"})], [1])
+        self.assertEqual([i for i, _ in router.route({"host": "h", "job_name": "prod_x", "debug": "1"})], [1])
+        with self.assertRaises(ValueError):
+            routing.compile_routes({"routes": [{"metric": "bad name"}]})
+
+class TestCustomMetricsHandler(unittest.TestCase):
+    def setUp(self):
+        self.tmpfile = tempfile.NamedTemporaryFile(mode='w+', delete=False)
+        self.tmpfile.write('aaa,job1,2,"{\'k1\': \'v1\'}"\n')
+        self.tmpfile.close()
+        self.exporter = LogExporter(log_file="not_used.csv")
+        self.exporter.tmp_log_file = self.tmpfile.name
+        self.exporter.update_metrics()
+        exporter_module.exporter = self.exporter
+        self.server = HTTPServer(("127.0.0.1", 0), CustomMetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/metrics"
+        self.tenant = LogExporter(log_file="tenant_not_used.csv", tmp_log_file=self.tmpfile.name)
+        self.tenant.update_metrics()
+        exporter_module.tenants["self"] = self.tenant
+        self.addCleanup(exporter_module.tenants.pop, "self", None)
+        self.tenant_url = f"http://127.0.0.1:{self.server.server_port}/tenant/self/metrics"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(self.tmpfile.name)
+
+    def test_etag_not_modified(self):
+        with urllib.request.urlopen(self.tenant_url) as resp:
+            etag = resp.headers["ETag"]
+            self.assertEqual(resp.headers["Transfer-Encoding"], "chunked")
+            self.assertEqual(resp.headers["X-Exporter-Fresh"], "true")
+            self.assertIn(b'host="aaa"', resp.read())
+
+        request = urllib.request.Request(self.tenant_url, headers={"If-None-Match": etag})
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(request)
+        self.assertEqual(ctx.exception.code, 304)
+        self.assertEqual(ctx.exception.headers["X-Exporter-Fresh"], "false")
+
+        # 新世代後 ETag 失效，回完整 body
+        self.tenant.update_metrics()
+        with urllib.request.urlopen(request) as resp:
+            self.assertNotEqual(resp.headers["ETag"], etag)
+            self.assertIn(b'host="aaa"', resp.read())
+
+        # 預設端點不附帶自身指標，同一世代的重複抓取同樣回 304
+        with urllib.request.urlopen(self.url) as resp:
+            etag = resp.headers["ETag"]
+            self.assertNotIn(b"python_info", resp.read())
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(urllib.request.Request(self.url, headers={"If-None-Match": etag}))
+        self.assertEqual(ctx.exception.code, 304)
+
+        # 重啟後世代從頭計數，但 BOOT_ID 不同，重啟前的 ETag 不會誤中 304
+        self.addCleanup(setattr, exporter_module, "BOOT_ID", exporter_module.BOOT_ID)
+        exporter_module.BOOT_ID = "restarted"
+        with urllib.request.urlopen(urllib.request.Request(self.url, headers={"If-None-Match": etag})) as resp:
+            self.assertEqual(resp.status, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_scraper_records_are_pruned(self):
+        self.exporter.scrape("old-scraper")
+        self.exporter.update_metrics()
+        self.exporter.scrape("new-scraper")
+        self.assertIn("old-scraper", self.exporter.scraper_access_record)
+        self.exporter.update_metrics()
+        self.assertEqual(set(self.exporter.scraper_access_record), {"new-scraper"})
+
+    def test_load_harness_scrapers(self):
+        deadline = time.monotonic() + 0.3
+        stats = [load_harness.ScraperStats() for _ in range(2)]
+        threads = [
+            threading.Thread(target=load_harness.run_scraper, args=(self.tenant_url, i, deadline, 0.01, True, b"log_host_job_count", stats[i]))
+            for i in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = load_harness.summarize(stats, 0.3, {}, 0)
+        # 每個 scraper 第一次拿到完整 body，之後帶 ETag 只收到 304
+        self.assertEqual(summary["outcomes"]["ok"], 2)
+        self.assertGreater(summary["outcomes"]["not_modified"], 0)
+        self.assertGreater(summary["latency_ms"]["p99"], 0)
+
+    def test_self_metrics(self):
+        from prometheus_client import REGISTRY
+        parsed_before = REGISTRY.get_sample_value("log_exporter_parse_rows_total", {"log_file": "not_used.csv"})
+        self.exporter.update_metrics()
+        parsed_after = REGISTRY.get_sample_value("log_exporter_parse_rows_total", {"log_file": "not_used.csv"})
+        self.assertEqual(parsed_after - parsed_before, 1)
+        self.assertEqual(REGISTRY.get_sample_value("log_exporter_series", {"log_file": "not_used.csv"}), 1)
+
+        request = urllib.request.Request(self.url, headers={"User-Agent": "Prometheus/2.53.0", "X-Forwarded-For": "10.0.0.9"})
+        with urllib.request.urlopen(request) as resp:
+            body = resp.read()
+        self.assertNotIn(b"log_exporter_parse_duration_seconds_bucket", body)
+        with urllib.request.urlopen(self.url + "/self") as resp:
+            self.assertIsNone(resp.headers["ETag"])
+            body = resp.read()
+        self.assertIn(b"log_exporter_parse_duration_seconds_bucket", body)
+        self.assertIn(b"python_info", body)
+        # handler 在寫完 response 後才記錄，稍等一下
+        for _ in range(50):
+            written = REGISTRY.get_sample_value("log_exporter_scrape_response_bytes_total", {"scraper": "Prometheus"})
+            if written:
+                break
+            threading.Event().wait(0.01)
+        self.assertGreater(written, 0)
+        # 任意 User-Agent 都歸到 "other"，不會產生新的 label 值
+        self.assertEqual(exporter_module.scraper_label("curl/8.0 (random-1234)"), "other")
+        self.assertEqual(exporter_module.scraper_label("vm_promscrape"), "vm_promscrape")
+
+    def test_tenant_routes(self):
+        tenant = LogExporter(log_file="not_used.csv", tmp_log_file=self.tmpfile.name, max_series=1)
+        with open(self.tmpfile.name, "a", encoding="utf-8") as f:
+            f.write("bbb,job2,1\n")
+        tenant.update_metrics()
+        self.assertEqual((len(tenant.metric.metrics), tenant.dropped_series), (1, 1))
+        self.assertEqual(REGISTRY.get_sample_value("log_exporter_dropped_series", {"log_file": "not_used.csv"}), 1)
+        exporter_module.tenants["team_a"] = tenant
+        self.addCleanup(exporter_module.tenants.clear)
+
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        with urllib.request.urlopen(base + "/tenant/team_a/metrics") as resp:
+            body = resp.read()
+        self.assertIn(b'host="aaa"', body)
+        self.assertNotIn(b'host="bbb"', body)
+        self.assertNotIn(b"python_info", body)
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(base + "/tenant/unknown/metrics")
+        self.assertEqual(ctx.exception.code, 404)
+
+    def test_load_tenants(self):
+        self.assertEqual(exporter_module.load_tenants('{"team_a": "logs/a.csv"}'), {"team_a": "logs/a.csv"})
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"team_b": "logs/b.csv"}, f)
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(exporter_module.load_tenants(f.name), {"team_b": "logs/b.csv"})
+        for invalid in ('{"team_a": ""}', '{"a/b": "logs/a.csv"}', '{"team_a": {"log_file": "x"}}'):
+            with self.assertRaises(ValueError):
+                exporter_module.load_tenants(invalid)
+        self.assertEqual(exporter_module.tenant_store_path("data/series.db", "team_a"), "data/series_team_a.db")
+
+    def test_debug_endpoints(self):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(base + "/debug/heap?seconds=0")
+        self.assertEqual(ctx.exception.code, 404)
+
+        CustomMetricsHandler.debug_token = "secret"
+        self.addCleanup(setattr, CustomMetricsHandler, "debug_token", "")
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(base + "/debug/heap?seconds=0")
+        self.assertEqual(ctx.exception.code, 401)
+
+        auth = {"Authorization": "Bearer secret"}
+        request = urllib.request.Request(base + "/debug/profile?seconds=0.05&format=top", headers=auth)
+        with urllib.request.urlopen(request) as resp:
+            self.assertIn(b"samples", resp.read())
+        request = urllib.request.Request(base + "/debug/heap?seconds=0&top=5", headers=auth)
+        with urllib.request.urlopen(request) as resp:
+            self.assertIn(b"KiB", resp.read())
+
+    def test_shard_parameters(self):
+        with urllib.request.urlopen(self.url + "?shard=1&of=2") as resp:
+            self.assertEqual(resp.status, 200)
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(self.url + "?shard=2&of=2")
+        self.assertEqual(ctx.exception.code, 400)
+
+    def test_match_filter(self):
+        query = urllib.parse.urlencode({"match[]": '{host="aaa",job_name=~"job.*"}'})
+        with urllib.request.urlopen(f"{self.url}?{query}") as resp:
+            body = resp.read()
+        self.assertIn(b'host="aaa"', body)
+        self.assertNotIn(b"python_info", body)
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            urllib.request.urlopen(f"{self.url}?" + urllib.parse.urlencode({"match[]": "{}"}))
+        self.assertEqual(ctx.exception.code, 400)
+
+class StubReceiverHandler(BaseHTTPRequestHandler):
+    """本機 remote-write receiver：依序回應 statuses 中的狀態碼，收到的 series 存在 received。"""
+    statuses = []
+    received = []
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        status = self.statuses.pop(0) if self.statuses else 204
+        if status == 204:
+            self.received.extend(unmarshal_write_request(snappy_decompress(data)))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class TestRemoteWrite(unittest.TestCase):
+    def setUp(self):
+        StubReceiverHandler.statuses = []
+        StubReceiverHandler.received = []
+        self.server = HTTPServer(("127.0.0.1", 0), StubReceiverHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_encoding_round_trip(self):
+        series = [TimeSeries({"__name__": "m", "host": "h" * 300}, [(2.5, 1700000000000)])]
+        data = snappy_compress(marshal_write_request(series))
+        self.assertEqual(unmarshal_write_request(snappy_decompress(data)), series)
+
+    def test_retry_then_deliver(self):
+        StubReceiverHandler.statuses = [503]
+        client = RemoteWriteClient(self.url, max_batch_size=2, flush_interval=0.05, retry_min_interval=0.01)
+        for i in range(3):
+            client.push(TimeSeries({"__name__": "m", "i": str(i)}, [(float(i), 1000)]))
+        client.close()
+        self.assertEqual(sorted(ts.labels["i"] for ts in StubReceiverHandler.received), ["0", "1", "2"])
+
+    def test_non_retriable_status_drops_batch(self):
+        StubReceiverHandler.statuses = [400]
+        client = RemoteWriteClient(self.url, flush_interval=10, retry_min_interval=0.01)
+        self.assertFalse(client.flush([TimeSeries({"__name__": "m"}, [(1.0, 1000)])]))
+        self.assertEqual(StubReceiverHandler.statuses, [])
+        client.close()
+
+    def test_spill_to_disk_and_replay_in_order(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        StubReceiverHandler.statuses = [503] * 4
+        client = RemoteWriteClient(self.url, flush_interval=0.05, retry_min_interval=0.01, retry_max_time=0.02,
+                                   persistent_queue=PersistentQueue(path))
+        self.assertFalse(client.flush([TimeSeries({"__name__": "m", "i": "0"}, [(0.0, 1000)])]))
+        # 積壓未清空前，新批次排在磁碟佇列後面
+        self.assertFalse(client.flush([TimeSeries({"__name__": "m", "i": "1"}, [(1.0, 1000)])]))
+        for _ in range(200):
+            if len(StubReceiverHandler.received) == 2:
+                break
+            threading.Event().wait(0.02)
+        client.close()
+        self.assertEqual([ts.labels["i"] for ts in StubReceiverHandler.received], ["0", "1"])
+
+    def test_exporter_push_mode(self):
+        with tempfile.NamedTemporaryFile(mode='w', suffix=".csv", delete=False) as f:
+            f.write('aaa,job1,2,"{\'k1\': \'v1\'}"\n')
+        client = RemoteWriteClient(self.url, flush_interval=0.05)
+        exporter = LogExporter(log_file="not_used.csv", remote_write=client)
+        exporter.tmp_log_file = f.name
+        exporter.update_metrics()
+        client.close()
+        os.unlink(f.name)
+        self.assertEqual(StubReceiverHandler.received[0].labels,
+                         {"__name__": "log_host_job_count", "host": "aaa", "job_name": "job1", "k1": "v1"})
+        self.assertEqual(StubReceiverHandler.received[0].samples[0][0], 2.0)
+
+    def test_push_snapshot_continues_after_errors(self):
+        class FlakyClient:
+            def __init__(self):
+                self.pushed = []
+                self.timeouts = []
+
+            def push(self, ts, timeout=None):
+                self.timeouts.append(timeout)
+                if len(self.timeouts) % 2:
+                    raise RemoteWriteError("queue is full")
+                self.pushed.append(ts.labels["host"])
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix=".csv", delete=False) as f:
+            f.writelines(f"host_{i},job1,1\n" for i in range(6))
+        self.addCleanup(os.unlink, f.name)
+        client = FlakyClient()
+        exporter = LogExporter(log_file="not_used.csv", tmp_log_file=f.name)
+        exporter.update_metrics()
+        exporter.remote_write = client
+        # 失敗的 series 計數後繼續推送，不會丟掉整個世代
+        self.assertEqual(exporter.push_snapshot(exporter._snapshot, timeout=5), 3)
+        self.assertEqual(client.pushed, ["host_1", "host_3", "host_5"])
+        self.assertTrue(all(0 < timeout <= 5 for timeout in client.timeouts))
+
+    def test_push_waits_for_queue_space(self):
+        # 只 listen 不回應的接收端：worker 送出第一筆後卡在 send_timeout，第二筆佔滿佇列
+        hanging = socket.socket()
+        hanging.bind(("127.0.0.1", 0))
+        hanging.listen(5)
+        self.addCleanup(hanging.close)
+        client = RemoteWriteClient(
+            f"http://127.0.0.1:{hanging.getsockname()[1]}", max_batch_size=1, max_queue_size=1,
+            send_timeout=0.5, retry_min_interval=0.01, retry_max_time=0.01,
+        )
+        self.addCleanup(client.close)
+        client.push(TimeSeries({"__name__": "m", "i": "0"}, [(1.0, 0)]))
+        threading.Event().wait(0.1)
+        client.push(TimeSeries({"__name__": "m", "i": "1"}, [(1.0, 0)]))
+        with self.assertRaises(RemoteWriteError):
+            client.push(TimeSeries({"__name__": "m", "i": "2"}, [(1.0, 0)]), timeout=0.05)
+        # 等到 worker 放棄第一筆、取走第二筆後就有空位
+        client.push(TimeSeries({"__name__": "m", "i": "2"}, [(1.0, 0)]), timeout=5)
+
+class TestPersistentQueue(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def drain(self, pq):
+        blocks = []
+        while (block := pq.peek()) is not None:
+            blocks.append(block)
+            pq.ack()
+        return blocks
+
+    def test_replay_in_order_across_restart(self):
+        pq = PersistentQueue(self.path, segment_size=20, fsync="always")
+        for i in range(5):
+            pq.append(b"block-%d" % i)
+        self.assertEqual(pq.peek(), b"block-0")
+        pq.ack()
+        pq.close()
+
+        pq = PersistentQueue(self.path, segment_size=20)
+        self.assertEqual(self.drain(pq), [b"block-%d" % i for i in range(1, 5)])
+        self.assertEqual(len(pq), 0)
+        pq.close()
+
+    def test_size_cap_drops_oldest(self):
+        pq = PersistentQueue(self.path, max_bytes=60, segment_size=20)
+        for i in range(10):
+            pq.append(b"block-%d" % i)
+        blocks = self.drain(pq)
+        self.assertLessEqual(len(blocks), 4)
+        self.assertEqual(blocks[-1], b"block-9")
+        pq.close()
+
+    def test_torn_tail_is_truncated(self):
+        pq = PersistentQueue(self.path)
+        pq.append(b"complete")
+        pq.close()
+        with open(os.path.join(self.path, "0000000000000000.seg"), "ab") as f:
+            f.write(b"\x00\x00\x00\x10half")
+        pq = PersistentQueue(self.path)
+        pq.append(b"after")
+        self.assertEqual(self.drain(pq), [b"complete", b"after"])
+        pq.close()
+
+    def test_corrupt_record_in_active_segment_is_skipped(self):
+        pq = PersistentQueue(self.path)
+        pq.append(b"good")
+        pq.append(b"corrupted")
+        with open(os.path.join(self.path, "0000000000000000.seg"), "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b"X")
+        before = REGISTRY.get_sample_value("log_exporter_disk_queue_corrupted_records_total")
+        self.assertEqual(pq.peek(), b"good")
+        pq.ack()
+        # 損毀的紀錄被丟棄並計數，之後寫入的 block 照常送出
+        self.assertIsNone(pq.peek())
+        self.assertEqual(REGISTRY.get_sample_value("log_exporter_disk_queue_corrupted_records_total"), before + 1)
+        pq.append(b"after")
+        self.assertEqual(self.drain(pq), [b"after"])
+        self.assertEqual(len(pq), 0)
+        pq.close()
+
+    def test_interval_fsync_runs_in_background(self):
+        synced = []
+        original = os.fsync
+        os.fsync = lambda fd: synced.append(fd) or original(fd)
+        try:
+            pq = PersistentQueue(self.path, fsync="interval", fsync_interval=0.05)
+            pq.append(b"block")
+            self.assertEqual(pq.peek(), b"block")
+            pq.ack()
+            # append / ack 都沒有到 fsync 間隔，由背景執行緒補上 segment 與 checkpoint 的 fsync
+            deadline = time.monotonic() + 2
+            while (pq._dirty or pq._checkpoint_dirty) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(pq._dirty)
+            self.assertFalse(pq._checkpoint_dirty)
+            self.assertGreaterEqual(len(synced), 2)
+            pq.close()
+        finally:
+            os.fsync = original
+        with open(os.path.join(self.path, "checkpoint.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"segment": 0, "offset": 8 + len(b"block")})
 
 if __name__ == '__main__':
     unittest.main()
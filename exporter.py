@@ -0,0 +1,1465 @@
+# 將 CustomGauge 整合進 LogExporter 類別中，讓其支援動態 label 並自動忽略空值。
+# Scraper 以資料世代 (generation) 的 ETag 判斷是否有新資料，重複抓取不再回傳空集合；ETag 含每次啟動不同的 BOOT_ID。
+# exporter 自身指標 (REGISTRY 的 process/python 與 log_exporter_*) 由 /metrics/self 另外輸出，/metrics 可以 304。
+# 更新端在旁邊建好不可變的 MetricSnapshot 後以單一參考替換發佈，Scraper 讀取時不需加鎖。
+# exposition 預先 render 成多個小段 (segments)，HTTP 以 chunked 逐段寫出，不組成單一大 bytes。
+# /metrics?shard=i&of=n 只回傳 label-set hash 落在第 i 個分片的 series；shard_counts 的分片在更新時就 render 好，其他分片數第一次請求時才 render。
+# /metrics?match[]={host="host_1"} 透過寫入時維護的 label 反向索引篩選 series。
+# 設定 remote_write 時，每次更新後也直接推送到 remote-write URL (見 remote_write.py)。
+# 多租戶：/tenant/<id>/metrics 對應各自獨立的 LogExporter (series、cardinality 上限與快取皆分開)，租戶清單由 TENANTS 載入。
+# 設定 DEBUG_TOKEN 後開放 /debug/profile 與 /debug/heap (Bearer token 驗證，見 profiling.py)。
+# log 經由 QueueHandler 非同步寫檔並限流 (見 log_pipeline.py)；逐列 debug log 只取樣。
+# 交接模式 (ROTATE_MODE=rename)：live log 以 os.rename 改名成 segment，不複製也不截斷，寬限一個週期後才解析。
+# spool 模式：producer 把完成的 segment 放進 incoming/，exporter 以 rename 認領後平行解析 (見 spool.py)。
+# 設定路由表時，每列依 label 分派到多個 metric family (見 routing.py)，否則只輸出 log_host_job_count。
+# series_ttl > 0 時 series 保留在更新端自有的 store 中：本輪未出現回報 0，連續 TTL 個世代未出現才移除。
+# engine="numpy" 時整批讀入後以 np.unique 計算每種列的次數，只解析不重複的列 (沒有 NumPy 時改用 Counter)。
+# engine="arrow" 時由 pyarrow.csv 多執行緒讀檔、group_by 計數，同樣只解析不重複的列 (需要 pyarrow)。
+# 設定 store_path 時 series 存在 SQLite (WAL) 而不是記憶體，exposition 從 cursor 串流輸出 (見 series_store.py)。
+
+import csv
+import io
+import os
+import hashlib
+import hmac
+import re
+import time
+import logging
+import shutil
+import json
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Set, Tuple, Iterable, Iterator, NamedTuple
+from urllib.parse import urlparse, parse_qs
+from threading import Lock, Thread
+from multiprocessing import Pool
+from http.server import ThreadingHTTPServer
+from prometheus_client import Counter, Gauge, Histogram
+try:
+    import numpy as np
+except ImportError:  # NumPy 為選用套件
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow 為選用套件，只有 engine="arrow" 需要
+    pa = pa_csv = None
+try:
+    import yaml
+except ImportError:  # PyYAML 為選用套件，只有 .yml/.yaml 的租戶設定檔需要
+    yaml = None
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from prometheus_client.registry import Collector
+from prometheus_client.exposition import MetricsHandler, generate_latest
+from prometheus_client.utils import floatToGoString
+from remote_write import RemoteWriteClient, RemoteWriteError, TimeSeries
+from persistent_queue import PersistentQueue
+import profiling
+from collections import Counter as LineCounter
+from log_pipeline import setup_logging
+from spool import SpoolConsumer
+from file_lock import AdvisoryLock
+from routing import Router, load_routes
+from series_store import SQLiteSeriesStore
+
+# === 自身指標 (parse / update / scrape 熱路徑) ===
+parse_rows = Counter("log_exporter_parse_rows", "Number of CSV rows parsed", ["log_file"])
+parse_bytes = Counter("log_exporter_parse_bytes", "Number of CSV bytes read", ["log_file"])
+parse_duration = Histogram("log_exporter_parse_duration_seconds", "Duration of _count_host_job", ["log_file"])
+update_duration = Histogram("log_exporter_update_duration_seconds", "Duration of update_metrics", ["log_file"])
+update_lock_wait = Histogram(
+    "log_exporter_update_lock_wait_seconds", "Time spent waiting for update_lock", ["log_file"],
+    buckets=(0.0001, 0.001, 0.01, 0.1, 1.0, 10.0),
+)
+series_count = Gauge("log_exporter_series", "Number of series in the published snapshot", ["log_file"])
+dropped_series = Gauge("log_exporter_dropped_series", "Series dropped by the max_series limit in the last update", ["log_file"])
+snapshot_age = Gauge("log_exporter_snapshot_age_seconds", "Seconds since the published snapshot was built", ["log_file"])
+scrape_duration = Histogram("log_exporter_scrape_duration_seconds", "Duration of /metrics requests", ["scraper"])
+scrape_bytes = Counter("log_exporter_scrape_response_bytes", "Bytes written in /metrics responses", ["scraper"])
+
+# debug 等級時每 N 列記錄一列 CSV 內容，而不是每列都寫 log
+ROW_DEBUG_SAMPLE = int(os.environ.get("ROW_DEBUG_SAMPLE", "1000"))
+
+# 每個 exposition 段落最多的 series 數
+CHUNK_SERIES = 1000
+
+# 每個 LogExporter 最多記錄的 Scraper 數 (per-scraper cursor)
+MAX_SCRAPER_RECORDS = 10000
+
+# 推送一個世代到 remote-write 時，佇列已滿最多等待的總秒數；超過後其餘 series 計入丟棄
+REMOTE_WRITE_PUSH_TIMEOUT = 10.0
+
+# scrape 自身指標的 scraper label 只取這些 User-Agent 產品名 (不分大小寫)，其餘歸為 "other"，
+# 避免 client 以任意 header 產生無限多個 Histogram child
+SCRAPER_ALLOWLIST = tuple(
+    name.strip()
+    for name in os.environ.get("SCRAPER_ALLOWLIST", "Prometheus,vm_promscrape,vmagent,VictoriaMetrics,Grafana-Agent,Alloy").split(",")
+    if name.strip()
+)
+
+def scraper_label(user_agent: str, allowlist: Iterable[str] = SCRAPER_ALLOWLIST) -> str:
+    """User-Agent 的產品名 (第一個 `/` 或空白之前) 在 allowlist 中時回傳該名稱，否則回傳 "other"。"""
+    product = re.split(r"[/\s]", user_agent.strip(), 1)[0].lower()
+    for name in allowlist:
+        if product == name.lower():
+            return name
+    return "other"
+
+# === 自定義 CustomGauge 類別 ===
+class CustomGauge:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.metrics = {}
+        # label 反向索引：label name -> label value -> series key 集合
+        self.index: Dict[str, Dict[str, Set[tuple]]] = {}
+        # 依 label 名稱組合分組的 series key (寫入時維護，保留加入順序)，collect 不需重新分組
+        self.groups: Dict[Tuple[str, ...], Dict[tuple, None]] = {}
+        # collect() 產生的 GaugeMetricFamily，寫入後才失效
+        self._families: Optional[List[GaugeMetricFamily]] = None
+        # 各分組 render 好的 exposition 段落，該分組有寫入時才失效
+        self._rendered: Dict[Tuple[str, ...], Tuple[bytes, ...]] = {}
+        # freeze() 發佈過的各分組 (keys, samples)，與 _rendered 同時失效，未變動的分組直接共用
+        self._frozen_groups: Dict[Tuple[str, ...], Tuple[tuple, tuple]] = {}
+        # freeze() 發佈過的 (反向索引, key -> (分組, 位置))，只在新增、移除或換分組時失效
+        self._frozen_index: Optional[Tuple[dict, dict]] = None
+
+    def _invalidate(self, label_keys: Tuple[str, ...]) -> None:
+        self._rendered.pop(label_keys, None)
+        self._frozen_groups.pop(label_keys, None)
+        self._families = None
+
+    def set(self, labels, value):
+        filtered_labels = {k: v for k, v in labels.items() if v}
+        self._put(tuple(sorted(filtered_labels.items())), filtered_labels, value)
+
+    def _put(self, key: tuple, labels: Dict[str, str], value) -> None:
+        label_keys = tuple(labels)
+        old = self.metrics.get(key)
+        if old is None:
+            for k, v in key:
+                self.index.setdefault(k, {}).setdefault(v, set()).add(key)
+            self._frozen_index = None
+        elif tuple(old[0]) != label_keys:
+            # 同一個 label set 換了 label 順序，移到對應的分組
+            old_keys = tuple(old[0])
+            del self.groups[old_keys][key]
+            if not self.groups[old_keys]:
+                del self.groups[old_keys]
+            self._invalidate(old_keys)
+            self._frozen_index = None
+        self.metrics[key] = (labels, value)
+        self.groups.setdefault(label_keys, {})[key] = None
+        self._invalidate(label_keys)
+
+    def remove(self, key: tuple) -> None:
+        """移除一個 series，並清掉因此變空的索引與分組，長期執行時記憶體不會累積。"""
+        labels, _ = self.metrics.pop(key)
+        for k, v in key:
+            values = self.index[k]
+            values[v].discard(key)
+            if not values[v]:
+                del values[v]
+                if not values:
+                    del self.index[k]
+        label_keys = tuple(labels)
+        del self.groups[label_keys][key]
+        if not self.groups[label_keys]:
+            del self.groups[label_keys]
+        self._invalidate(label_keys)
+        self._frozen_index = None
+
+    def inc(self, labels, value):
+        """相同 label set 的數值累加 (同一列重複出現或來自多個 segment)。"""
+        filtered_labels = {k: v for k, v in labels.items() if v}
+        key = tuple(sorted(filtered_labels.items()))
+        if key in self.metrics:
+            labels, current = self.metrics[key]
+            self.metrics[key] = (labels, current + value)
+            self._invalidate(tuple(labels))
+        else:
+            self._put(key, filtered_labels, value)
+
+    def select(self, matchers: List[Tuple[str, str, str]]) -> Set[tuple]:
+        """回傳符合所有 matcher 的 series key；先用反向索引縮小範圍，其餘條件再逐筆過濾。"""
+        candidates: Optional[Set[tuple]] = None
+        remaining = []
+        for name, op, value in matchers:
+            if op == "=" and value:
+                keys = self.index.get(name, {}).get(value, set())
+            elif op == "=~" and not re.fullmatch(value, ""):
+                pattern = re.compile(value)
+                keys = set()
+                for label_value, value_keys in self.index.get(name, {}).items():
+                    if pattern.fullmatch(label_value):
+                        keys |= value_keys
+            else:
+                remaining.append((name, op, value))
+                continue
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return set()
+        if candidates is None:
+            candidates = set(self.metrics)
+        return {key for key in candidates if _matches_all(dict(key), remaining)}
+
+    def subset(self, keys: Iterable[tuple]) -> "CustomGauge":
+        """只含 keys 的 CustomGauge，分組與組內順序與完整 exposition 相同 (只走訪有命中的分組)。"""
+        keys = set(keys)
+        metrics = self.metrics
+        touched = {tuple(metrics[key][0]) for key in keys}
+        selected = CustomGauge(self.name, self.documentation)
+        for label_keys, group in self.groups.items():
+            if label_keys in touched:
+                for key in group:
+                    if key in keys:
+                        selected._put(key, *metrics[key])
+        return selected
+
+    def shard_exposition(self, shard_count: int, chunk_series: int = CHUNK_SERIES) -> List[Tuple[bytes, ...]]:
+        """依 label-set hash 把已 render 的 sample 列分到 shard_count 片 (同 hashmod relabel 的切法)。
+
+        直接切分各分組快取的 exposition bytes (跳脫後每個 series 恰為一列，順序與分組內的 key 相同)，
+        不建立新的 CustomGauge，也不重新 render。
+        """
+        shards: List[List[bytes]] = [[] for _ in range(shard_count)]
+        for label_keys, keys in self.groups.items():
+            rendered = self._rendered.get(label_keys) or tuple(self._render_group(label_keys, CHUNK_SERIES))
+            lines = b"".join(rendered).split(b"\n")
+            header = lines[0] + b"\n" + lines[1] + b"\n"
+            buckets: List[List[bytes]] = [[] for _ in range(shard_count)]
+            for key, line in zip(keys, lines[2:]):
+                buckets[series_shard(key, shard_count)].append(line)
+            for index, bucket in enumerate(buckets):
+                for start in range(0, len(bucket), chunk_series):
+                    body = b"\n".join(bucket[start:start + chunk_series]) + b"\n"
+                    shards[index].append(header + body if start == 0 else body)
+        return [tuple(segments) for segments in shards]
+
+    def collect(self):
+        if self._families is None:
+            families = []
+            for label_keys, keys in self.groups.items():
+                gauge = GaugeMetricFamily(self.name, self.documentation, labels=label_keys)
+                for key in keys:
+                    labels, value = self.metrics[key]
+                    gauge.add_metric([labels[k] for k in label_keys], value)
+                families.append(gauge)
+            self._families = families
+        return iter(self._families)
+
+    def iter_exposition(self, chunk_series: int = CHUNK_SERIES) -> Iterable[bytes]:
+        """逐段產生與 generate_latest 相同的 text format，每段最多 chunk_series 筆 series。
+
+        預設段落大小時每個分組 render 的結果會快取，之後只重新 render 有寫入過的分組。
+        """
+        for label_keys in self.groups:
+            if chunk_series != CHUNK_SERIES:
+                yield from self._render_group(label_keys, chunk_series)
+                continue
+            rendered = self._rendered.get(label_keys)
+            if rendered is None:
+                rendered = self._rendered[label_keys] = tuple(self._render_group(label_keys, chunk_series))
+            yield from rendered
+
+    def _render_group(self, label_keys: Tuple[str, ...], chunk_series: int) -> Iterable[bytes]:
+        header = f"# HELP {self.name} {_escape_help(self.documentation)}\n# TYPE {self.name} gauge\n"
+        lines = [header]
+        for key in self.groups[label_keys]:
+            labels, value = self.metrics[key]
+            lines.append(_sample_line(self.name, labels, value))
+            if len(lines) >= chunk_series:
+                yield "".join(lines).encode("utf-8")
+                lines = []
+        if lines:
+            yield "".join(lines).encode("utf-8")
+
+    def freeze(self) -> "FrozenGauge":
+        """回傳之後不受原物件寫入影響的唯讀 FrozenGauge。
+
+        沒有寫入過的分組沿用上一次發佈的 tuple 與 render 結果，反向索引只在新增或移除 series 後重建，
+        series 只有數值變動時成本與變動的分組大小成正比，而不是與全部 series 數成正比。
+        """
+        groups: Dict[Tuple[str, ...], tuple] = {}
+        samples: Dict[Tuple[str, ...], tuple] = {}
+        rendered: Dict[Tuple[str, ...], Tuple[bytes, ...]] = {}
+        metrics = self.metrics
+        for label_keys, keys in self.groups.items():
+            frozen = self._frozen_groups.get(label_keys)
+            if frozen is None:
+                group_keys = tuple(keys)
+                frozen = self._frozen_groups[label_keys] = (group_keys, tuple(metrics[key] for key in group_keys))
+            groups[label_keys], samples[label_keys] = frozen
+            if label_keys not in self._rendered:
+                self._rendered[label_keys] = tuple(self._render_group(label_keys, CHUNK_SERIES))
+            rendered[label_keys] = self._rendered[label_keys]
+        if self._frozen_index is None:
+            index = {k: {v: frozenset(keys) for v, keys in values.items()} for k, values in self.index.items()}
+            locations = {key: (label_keys, position) for label_keys, keys in groups.items() for position, key in enumerate(keys)}
+            self._frozen_index = (index, locations)
+        index, locations = self._frozen_index
+        return FrozenGauge(self.name, self.documentation, groups, samples, rendered, index, locations)
+
+class _FrozenSeries(Mapping):
+    """FrozenGauge.metrics：key -> (labels, value) 的唯讀檢視，資料存在各分組的 samples tuple 中。"""
+
+    def __init__(self, locations: Dict[tuple, Tuple[Tuple[str, ...], int]], samples: Dict[Tuple[str, ...], tuple]) -> None:
+        self._locations = locations
+        self._samples = samples
+
+    def __getitem__(self, key):
+        label_keys, position = self._locations[key]
+        return self._samples[label_keys][position]
+
+    def __iter__(self):
+        return iter(self._locations)
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+class FrozenGauge(CustomGauge):
+    """CustomGauge.freeze() 發佈到快照的唯讀版本；select / subset / collect / exposition 與 CustomGauge 相同。"""
+
+    def __init__(self, name, documentation, groups, samples, rendered, index, locations):
+        super().__init__(name, documentation)
+        self.groups = groups
+        self.metrics = _FrozenSeries(locations, samples)
+        self.index = index
+        self._rendered = rendered
+
+    def subset(self, keys: Iterable[tuple]) -> CustomGauge:
+        """依凍結時的 (分組, 位置) 排序，成本與命中的 series 數成正比。"""
+        rank = {label_keys: index for index, label_keys in enumerate(self.groups)}
+        locations = self.metrics._locations
+        selected = CustomGauge(self.name, self.documentation)
+        for key in sorted(keys, key=lambda key: (rank[locations[key][0]], locations[key][1])):
+            selected._put(key, *self.metrics[key])
+        return selected
+
+    def _put(self, key, labels, value):
+        raise TypeError(f"{self.name}: published snapshot is read-only")
+
+    def remove(self, key):
+        raise TypeError(f"{self.name}: published snapshot is read-only")
+
+    def freeze(self) -> "FrozenGauge":
+        return self
+
+class DynamicGauge(CustomGauge):
+    """只註冊一次的動態 label metric family：label 名稱可在執行期任意增加，series 原地更新。
+
+    取代每個週期重新建立 Gauge(labels=...) 並清空 _metrics 的做法 (exporters/exporter09.py、tmp.py)，
+    不會重複註冊 collector，也不會每輪重建所有 series 物件。
+    """
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        # update 與 collect 可能在不同 thread
+        self._lock = Lock()
+
+    def update(self, counts: Iterable[Tuple[Dict[str, str], float]]) -> None:
+        """以這一輪的 (labels, value) 取代目前內容：相同 label set 相加，值未變的 series 不動，消失的移除。"""
+        totals: Dict[tuple, Tuple[Dict[str, str], float]] = {}
+        for labels, value in counts:
+            filtered_labels = {k: v for k, v in labels.items() if v}
+            key = tuple(sorted(filtered_labels.items()))
+            if key in totals:
+                totals[key] = (totals[key][0], totals[key][1] + value)
+            else:
+                totals[key] = (filtered_labels, value)
+        with self._lock:
+            for key in [key for key in self.metrics if key not in totals]:
+                self.remove(key)
+            for key, (labels, value) in totals.items():
+                current = self.metrics.get(key)
+                if current is None or current[1] != value or tuple(current[0]) != tuple(labels):
+                    self._put(key, labels, value)
+
+    def collect(self):
+        with self._lock:
+            return super().collect()
+
+def _matches_all(labels: Dict[str, str], matchers: List[Tuple[str, str, str]]) -> bool:
+    for name, op, value in matchers:
+        actual = labels.get(name, "")
+        if op == "=" and actual != value:
+            return False
+        if op == "!=" and actual == value:
+            return False
+        if op == "=~" and not re.fullmatch(value, actual):
+            return False
+        if op == "!~" and re.fullmatch(value, actual):
+            return False
+    return True
+
+_SELECTOR_RE = re.compile(r'^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)?\s*\{(.*)\}\s*$|^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)\s*$', re.S)
+_MATCHER_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*(?:,|$)')
+
+def parse_selector(selector: str) -> Tuple[Optional[str], List[Tuple[str, str, str]]]:
+    """解析 PromQL series selector，例如 `{host="host_1",job_name=~"job_.*"}`。"""
+    match = _SELECTOR_RE.match(selector)
+    if not match:
+        raise ValueError(f"invalid selector: {selector}")
+    metric_name = match.group(1) or match.group(3)
+    body = match.group(2) or ""
+    matchers = []
+    pos = 0
+    while body[pos:].strip():
+        m = _MATCHER_RE.match(body, pos)
+        if not m:
+            raise ValueError(f"invalid matcher in selector: {selector}")
+        name, op, value = m.groups()
+        value = re.sub(r'\\(.)', lambda e: "\n" if e.group(1) == "n" else e.group(1), value)
+        if op in ("=~", "!~"):
+            re.compile(value)
+        matchers.append((name, op, value))
+        pos = m.end()
+    # 與 Prometheus 相同，至少要有一個不會匹配空字串的條件，避免一次選到全部 series
+    if not metric_name and all(_matches_all({}, [matcher]) for matcher in matchers):
+        raise ValueError(f"selector must contain at least one non-empty matcher: {selector}")
+    return metric_name, matchers
+
+def selector_matchers(
+    selector: Tuple[Optional[str], List[Tuple[str, str, str]]], metric_name: str
+) -> Optional[List[Tuple[str, str, str]]]:
+    """selector 套用到名為 metric_name 的 family：名稱 (含 `__name__` matcher) 不符時回傳 None，否則回傳只剩 label 的 matchers。
+
+    series 的 labels 中沒有 `__name__`，名稱條件不能交給 label 索引或 _matches_all。
+    """
+    name, matchers = selector
+    if name and name != metric_name:
+        return None
+    if not _matches_all({"__name__": metric_name}, [m for m in matchers if m[0] == "__name__"]):
+        return None
+    return [m for m in matchers if m[0] != "__name__"]
+
+def series_shard(label_tuple: Tuple[Tuple[str, str], ...], shard_count: int) -> int:
+    # 與 Prometheus hashmod 相同：取 md5 後 8 bytes 當 uint64 再取餘數
+    digest = hashlib.md5(",".join(f"{k}={v}" for k, v in label_tuple).encode("utf-8")).digest()
+    return int.from_bytes(digest[8:], "big") % shard_count
+
+# === text exposition 格式化 (與 prometheus_client.generate_latest 相同的跳脫規則) ===
+def _escape_help(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n")
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+def _sample_line(name: str, labels: Dict[str, str], value) -> str:
+    if labels:
+        labelstr = ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in sorted(labels.items()))
+        return f"{name}{{{labelstr}}} {floatToGoString(value)}\n"
+    return f"{name} {floatToGoString(value)}\n"
+
+# === 不可變的 metric 快照 ===
+class MetricSnapshot(NamedTuple):
+    generation: int
+    metric: CustomGauge  # 發佈後不再修改
+    segments: Tuple[bytes, ...]  # 發佈前就 render 好的 exposition 小段
+    timestamp: float
+    # (shard, shard_count) -> shard_counts 預先 render 的分片 exposition 小段；其他分片數見 LogExporter._shard_cache
+    shards: Dict[Tuple[int, int], Tuple[bytes, ...]]
+    # 所有 metric family (第一個即 metric)；使用路由表時每個 metric 一個
+    families: Tuple[CustomGauge, ...]
+    # 使用 SQLite store 時 series 不在 families 中 (families 只提供名稱與說明)，scrape 時才從 store 讀出
+    store: Optional[SQLiteSeriesStore] = None
+
+# === 整合 CustomGauge 的 LogExporter 類別 ===
+class LogExporter(Collector):
+    def __init__(
+        self,
+        log_file: str,
+        shard_counts: Iterable[int] = (),
+        remote_write: Optional[RemoteWriteClient] = None,
+        tmp_log_file: str = "logs/data_collect_tmp.csv",
+        max_series: int = 0,
+        router: Optional[Router] = None,
+        series_ttl: int = 0,
+        engine: str = "python",
+        store_path: str = "",
+    ) -> None:
+        if store_path and (series_ttl or max_series):
+            raise ValueError("store_path does not support series_ttl or max_series")
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {sorted(ENGINES)}, got {engine!r}")
+        if engine == "arrow" and pa is None:
+            raise RuntimeError("pyarrow is required for engine='arrow'; install pyarrow or use another engine")
+        self.log_file = log_file
+        # CSV 解析引擎：python 逐列 csv.reader；numpy 先計算每種列的次數再只解析不重複的列
+        self.engine = engine
+        self._count_rows = ENGINES[engine]
+        self._iter_rows = STREAM_ENGINES[engine]
+        # 路由表：每列分派到哪些 metric family；None 時只有 log_host_job_count
+        self.router = router
+        # series 最後出現後保留的世代數；0 表示每個世代重建 (只有本輪出現的 series)
+        self.series_ttl = series_ttl
+        # 更新端自有、原地修改的 series store (只有 update_lock 持有者會碰)，發佈時以 freeze() 凍結成不可變的快照
+        self._store: Optional[Tuple[CustomGauge, ...]] = None
+        # (family 索引, series key) -> 最後出現的世代，以及世代 -> 該世代最後出現的 series
+        self._last_seen: Dict[Tuple[int, tuple], int] = {}
+        self._seen_in: Dict[int, Set[Tuple[int, tuple]]] = {}
+        # 設定 store_path 時 series 存在 SQLite，記憶體中只剩目前解析中的檔案
+        self.series_store = SQLiteSeriesStore(store_path) if store_path else None
+        self._store_families = self._new_families() if store_path else ()
+        self.tmp_log_file = tmp_log_file
+        # cardinality 上限 (0 表示不限制)；超過時新的 label set 會被丟棄並計入 dropped_series
+        self.max_series = max_series
+        self.dropped_series = 0
+        # 自身指標的 child 先取好，熱路徑上不再查 label
+        self._parse_rows = parse_rows.labels(log_file)
+        self._parse_bytes = parse_bytes.labels(log_file)
+        self._parse_duration = parse_duration.labels(log_file)
+        self._update_duration = update_duration.labels(log_file)
+        self._update_lock_wait = update_lock_wait.labels(log_file)
+        self._series_count = series_count.labels(log_file)
+        self._dropped_series = dropped_series.labels(log_file)
+        snapshot_age.labels(log_file).set_function(lambda: time.time() - self._snapshot.timestamp)
+        # 每次更新時預先 render 的分片數，例如 (2, 4) 對應兩組不同規模的 vmagent
+        self.shard_counts = tuple(shard_counts)
+        # 只用來序列化多個更新者；Scraper 永遠不拿這把鎖
+        self.update_lock = Lock()
+        # 目前發佈中的快照，更新時整個參考替換 (CPython 中屬性賦值是原子操作)
+        self._snapshot = self._build_snapshot(0, [])
+        # (世代, 分片 -> exposition 小段)：不在 shard_counts 中的分片數第一次被請求時才 render 並記在這裡。
+        # 刻意與快照分開，發佈後的快照不會被 Scraper thread 修改；新世代第一次被請求時整個替換
+        self._shard_cache: Tuple[int, Dict[Tuple[int, int], Tuple[bytes, ...]]] = (0, {})
+        # 記錄每個 Scraper 最後抓到的世代 (per-scraper cursor)，以 X-Exporter-Fresh 回應 header 告知；
+        # 每次發佈時移除兩個世代以前的紀錄
+        self.scraper_access_record: Dict[str, int] = {}
+        # push 模式：每個世代發佈後把 series 推送到 remote-write
+        self.remote_write = remote_write
+
+    @property
+    def metric(self) -> CustomGauge:
+        return self._snapshot.metric
+
+    @property
+    def generation(self) -> int:
+        return self._snapshot.generation
+
+    def _new_families(self) -> Tuple[CustomGauge, ...]:
+        if self.router is None:
+            return (CustomGauge("log_host_job_count", "Count of host and job_name with optional labels"),)
+        return tuple(CustomGauge(name, doc) for name, doc in zip(self.router.metric_names, self.router.documentation))
+
+    def _build_snapshot(self, generation: int, counts) -> MetricSnapshot:
+        if self.series_store is not None:
+            return self._update_sqlite(generation, counts)
+        if self.series_ttl > 0:
+            return self._update_store(generation, counts)
+        router = self.router
+        families = self._new_families()
+        dropped = 0
+        total = 0
+        for labels_dict, value in counts:
+            targets = router.route(labels_dict) if router is not None else ((0, labels_dict),)
+            for index, labels in targets:
+                metric = families[index]
+                if self.max_series and total >= self.max_series:
+                    if tuple(sorted((k, v) for k, v in labels.items() if v)) not in metric.metrics:
+                        dropped += 1
+                        continue
+                before = len(metric.metrics)
+                metric.inc(labels, value)
+                total += len(metric.metrics) - before
+        if dropped:
+            logging.warning(f"{self.log_file}: series limit {self.max_series} reached, dropped {dropped} series")
+        self.dropped_series = dropped
+        shards: Dict[Tuple[int, int], Tuple[bytes, ...]] = {}
+        for shard_count in self.shard_counts:
+            shards.update(_render_shards(families, shard_count))
+        segments = tuple(segment for metric in families for segment in metric.iter_exposition())
+        return MetricSnapshot(generation, families[0], segments, time.time(), shards, families)
+
+    def _update_store(self, generation: int, counts) -> MetricSnapshot:
+        """只修改這一輪有變化的 series，只重新 render 有變化的分組，再凍結成快照發佈。"""
+        if self._store is None:
+            self._store = self._new_families()
+        families = self._store
+        router = self.router
+        cycle: Dict[Tuple[int, tuple], Tuple[Dict[str, str], float]] = {}
+        for labels_dict, value in counts:
+            targets = router.route(labels_dict) if router is not None else ((0, labels_dict),)
+            for index, labels in targets:
+                filtered_labels = {k: v for k, v in labels.items() if v}
+                series = (index, tuple(sorted(filtered_labels.items())))
+                if series in cycle:
+                    cycle[series] = (cycle[series][0], cycle[series][1] + value)
+                else:
+                    cycle[series] = (filtered_labels, value)
+
+        dropped = 0
+        total = sum(len(metric.metrics) for metric in families)
+        seen_now = self._seen_in.setdefault(generation, set())
+        for series, (labels, value) in cycle.items():
+            index, key = series
+            metric = families[index]
+            current = metric.metrics.get(key)
+            if current is None:
+                if self.max_series and total >= self.max_series:
+                    dropped += 1
+                    continue
+                total += 1
+                metric._put(key, labels, value)
+            elif current[1] != value:
+                metric._put(key, current[0], value)
+            last = self._last_seen.get(series)
+            if last is not None and last != generation:
+                self._seen_in[last].discard(series)
+            self._last_seen[series] = generation
+            seen_now.add(series)
+
+        # 上一輪出現、這一輪沒出現的 series 回報 0；超過 TTL 個世代未出現的移除
+        for series in self._seen_in.get(generation - 1, ()):
+            index, key = series
+            labels, value = families[index].metrics[key]
+            if value != 0:
+                families[index]._put(key, labels, 0)
+        expired = 0
+        for seen in [seen for seen in self._seen_in if seen < generation - self.series_ttl]:
+            for series in self._seen_in.pop(seen):
+                index, key = series
+                families[index].remove(key)
+                del self._last_seen[series]
+                expired += 1
+        if dropped:
+            logging.warning(f"{self.log_file}: series limit {self.max_series} reached, dropped {dropped} series")
+        if expired:
+            logging.info(f"{self.log_file}: {expired} series expired after {self.series_ttl} generations")
+        self.dropped_series = dropped
+
+        segments = tuple(segment for metric in families for segment in metric.iter_exposition())
+        published = tuple(metric.freeze() for metric in families)
+        shards: Dict[Tuple[int, int], Tuple[bytes, ...]] = {}
+        for shard_count in self.shard_counts:
+            shards.update(_render_shards(published, shard_count))
+        return MetricSnapshot(generation, published[0], segments, time.time(), shards, published)
+
+    def _update_sqlite(self, generation: int, counts) -> MetricSnapshot:
+        """逐列路由後直接 upsert 進 SQLite，commit 後發佈只帶 family 名稱的快照。"""
+        router = self.router
+
+        def routed():
+            for labels_dict, value in counts:
+                targets = router.route(labels_dict) if router is not None else ((0, labels_dict),)
+                for index, labels in targets:
+                    yield index, labels, value
+
+        self.series_store.update(generation, routed())
+        self.dropped_series = 0
+        families = self._store_families
+        return MetricSnapshot(generation, families[0], (), time.time(), {}, families, self.series_store)
+
+    def collect(self) -> Iterable[GaugeMetricFamily]:
+        snapshot = self._snapshot
+        if snapshot.store is not None:
+            yield from _collect_rows(snapshot.families, snapshot.store.iter_rows())
+            return
+        for metric in snapshot.families:
+            yield from metric.collect()
+
+    def scrape(
+        self,
+        scraper_version: str,
+        shard: Optional[Tuple[int, int]] = None,
+        selectors: Optional[List[Tuple[Optional[str], List[Tuple[str, str, str]]]]] = None,
+    ) -> Tuple[int, Iterable[bytes], bool]:
+        """回傳 (世代, 快取的 exposition 小段, 此 Scraper 是否第一次看到這個世代)。
+
+        使用 SQLite store 時 exposition 小段是讀取 store 的 generator，只能走訪一次。
+        """
+        snapshot = self._snapshot
+        segments = snapshot.segments
+        if snapshot.store is not None:
+            # SQLite store：exposition 在寫出時才從 cursor 逐段讀出
+            segments = _render_rows(snapshot.families, snapshot.store.iter_rows(*_store_filter(snapshot.families, shard, selectors)))
+        elif selectors:
+            # match[] 篩選的成本只與命中的 series 數量成正比，結果不快取
+            segments = ()
+            for metric in snapshot.families:
+                keys: Set[tuple] = set()
+                for selector in selectors:
+                    matchers = selector_matchers(selector, metric.name)
+                    if matchers is not None:
+                        keys |= metric.select(matchers)
+                if shard is not None:
+                    keys = {key for key in keys if series_shard(key, shard[1]) == shard[0]}
+                segments += tuple(metric.subset(keys).iter_exposition())
+        elif shard is not None:
+            segments = snapshot.shards.get(shard)
+            if segments is None:
+                segments = self._lazy_shard(snapshot, shard)
+        if shard is not None:
+            scraper_version = f"{scraper_version}#{shard[0]}/{shard[1]}"
+        fresh = self.scraper_access_record.get(scraper_version) != snapshot.generation
+        if fresh and len(self.scraper_access_record) >= MAX_SCRAPER_RECORDS:
+            # key 來自 client header；超過上限時不再記錄新的 Scraper (仍視為第一次看到)
+            return snapshot.generation, segments, fresh
+        self.scraper_access_record[scraper_version] = snapshot.generation
+        return snapshot.generation, segments, fresh
+
+    def _lazy_shard(self, snapshot: MetricSnapshot, shard: Tuple[int, int]) -> Tuple[bytes, ...]:
+        """render 未預先設定的分片數並記在 _shard_cache；同一世代重複 render 的結果相同，併發時誰先寫入都無妨。"""
+        generation, cache = self._shard_cache
+        segments = cache.get(shard) if generation == snapshot.generation else None
+        if segments is not None:
+            return segments
+        rendered = _render_shards(snapshot.families, shard[1])
+        if generation < snapshot.generation:
+            cache = {}
+            self._shard_cache = (snapshot.generation, cache)
+        if self._shard_cache[0] == snapshot.generation:
+            # 拿著舊快照的 Scraper 不會把舊世代的分片寫進新世代的快取
+            cache.update(rendered)
+        return rendered[shard]
+
+    def update_metrics(self, paths: Optional[List[str]] = None, pool=None):
+        """解析 paths (預設為 tmp_log_file) 並發佈新世代；paths 為空 list 時發佈空快照。
+
+        給定 multiprocessing pool 時各檔案由不同 worker process 平行解析。
+        """
+        if paths is None:
+            if not os.path.exists(self.tmp_log_file):
+                return
+            paths = [self.tmp_log_file]
+        started = time.perf_counter()
+        counts = self._iter_counts(paths, pool)
+        if self.series_store is None:
+            counts = list(counts)
+        # SQLite store 時在持有 update_lock 期間邊解析邊寫入，解析結果不會整份留在記憶體中 (pool 平行解析時為一個檔案)
+        lock_started = time.perf_counter()
+        with self.update_lock:
+            self._update_lock_wait.observe(time.perf_counter() - lock_started)
+            self._snapshot = self._build_snapshot(self._snapshot.generation + 1, counts)
+        self._prune_scrapers(self._snapshot.generation)
+        if self.series_store is not None:
+            self._series_count.set(self.series_store.series_count)
+        else:
+            self._series_count.set(sum(len(metric.metrics) for metric in self._snapshot.families))
+        self._dropped_series.set(self.dropped_series)
+        self._update_duration.observe(time.perf_counter() - started)
+        if self.remote_write is not None:
+            self.push_snapshot(self._snapshot)
+
+    def _prune_scrapers(self, generation: int) -> None:
+        """移除兩個世代以前就沒再抓取的 Scraper 紀錄 (以複本過濾後整個替換，不與 scrape 搶鎖)。"""
+        records = dict(self.scraper_access_record)
+        self.scraper_access_record = {key: seen for key, seen in records.items() if seen >= generation - 1}
+
+    def _iter_counts(self, paths: List[str], pool=None) -> Iterable[Tuple[Dict[str, str], int]]:
+        if pool is not None and len(paths) > 1:
+            with self._parse_duration.time():
+                for rows, size, results in pool.imap(self._count_rows, paths):
+                    self._parse_rows.inc(rows)
+                    self._parse_bytes.inc(size)
+                    yield from results
+        elif self.series_store is not None:
+            for path in paths:
+                yield from self._stream_host_job(path)
+        else:
+            for path in paths:
+                yield from self._count_host_job(path)
+
+    def push_snapshot(self, snapshot: MetricSnapshot, timeout: float = REMOTE_WRITE_PUSH_TIMEOUT) -> int:
+        """把整個世代推送到 remote-write，回傳被丟棄的 series 數。
+
+        佇列已滿時等待 worker 消化，整個世代最多共等 timeout 秒；單筆失敗只計數並繼續推送其餘 series，
+        不會因為第一次失敗就丟掉整個世代。丟棄的筆數同時計入 log_exporter_remotewrite_dropped_rows。
+        """
+        timestamp_ms = int(snapshot.timestamp * 1000)
+        if snapshot.store is not None:
+            series = ((snapshot.families[index].name, labels, value) for index, labels, value in snapshot.store.iter_rows())
+        else:
+            series = ((metric.name, labels, value) for metric in snapshot.families for labels, value in metric.metrics.values())
+        deadline = time.monotonic() + timeout
+        total = dropped = 0
+        error: Optional[RemoteWriteError] = None
+        for name, labels, value in series:
+            total += 1
+            try:
+                self.remote_write.push(
+                    TimeSeries({"__name__": name, **labels}, [(float(value), timestamp_ms)]),
+                    timeout=deadline - time.monotonic(),
+                )
+            except RemoteWriteError as e:
+                dropped += 1
+                error = e
+        if dropped:
+            logging.warning(f"Remote write push dropped {dropped} of {total} series in generation {snapshot.generation}: {error}")
+        return dropped
+
+    def _count_host_job(self, file_path: str):
+        with self._parse_duration.time():
+            rows, size, results = self._count_rows(file_path)
+        self._parse_bytes.inc(size)
+        self._parse_rows.inc(rows)
+        return results
+
+    def _stream_host_job(self, file_path: str) -> Iterator[Tuple[Dict[str, str], int]]:
+        """SQLite store 用：解析結果逐列 (numpy / arrow 為逐區塊) 交給 upsert，不組成整個檔案的 list。
+
+        parse_duration 包含與 upsert 交錯的時間；列數與 bytes 在檔案讀完後才計入。
+        """
+        stats: Dict[str, int] = {}
+        started = time.perf_counter()
+        yield from self._iter_rows(file_path, stats)
+        self._parse_duration.observe(time.perf_counter() - started)
+        self._parse_bytes.inc(stats["size"])
+        self._parse_rows.inc(stats["rows"])
+
+# === CSV 解析 (exporter 與 backfill.py 共用) ===
+def count_rows(file_path: str) -> Tuple[int, int, List[Tuple[Dict[str, str], int]]]:
+    """解析整個檔案，回傳 (列數, bytes, 每列的 (labels, count))；也作為 pool worker 使用。"""
+    stats: Dict[str, int] = {}
+    results = list(iter_count_rows(file_path, stats))
+    return stats["rows"], stats["size"], results
+
+def iter_count_rows(file_path: str, stats: Dict[str, int]) -> Iterator[Tuple[Dict[str, str], int]]:
+    """count_rows 的串流版本：逐列 yield (labels, count)，讀完後把列數與 bytes 寫入 stats["rows"] / stats["size"]。"""
+    rows = 0
+    sample = ROW_DEBUG_SAMPLE if logging.getLogger().isEnabledFor(logging.DEBUG) else 0
+    with open(file_path, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            rows += 1
+            if sample and rows % sample == 0:
+                logging.debug(f"{file_path} row {rows}: {row}")
+            parsed = parse_row(row)
+            if parsed is not None:
+                yield parsed
+        stats["size"] = os.fstat(f.fileno()).st_size
+    stats["rows"] = rows
+
+_QUOTES = "'\"“”"
+
+NUMPY_CHUNK_BYTES = 64 << 20  # 每次讀入並計數的區塊大小
+# 同長度的列每次最多展開成這麼多 bytes 的 2D 陣列 (位置索引陣列另佔 8 倍)
+NUMPY_FACTORIZE_BYTES = 4 << 20
+
+def _count_lines(block: bytes) -> Tuple[int, Dict[bytes, int]]:
+    """block (以換行分隔的完整列) 的列數，與每種列出現的次數 (依第一次出現的順序)。"""
+    if not block:
+        return 0, {}
+    if not block.endswith(b"\n"):
+        block += b"\n"
+    if np is None:
+        lines = block.split(b"\n")
+        lines.pop()
+        return len(lines), LineCounter(lines)
+    # 直接在原始 bytes 上找出每列的起訖，依長度分組後把同長度的列展開成 (列數, 長度) 的 uint8 陣列，
+    # factorize 成整數代碼後計數 (見 _unique_rows)；不會把每列補齊到最長列的長度
+    data = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(data == ord("\n"))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+    order = np.argsort(lengths, kind="stable")
+    firsts, counts = [], []
+    for group in np.split(order, np.flatnonzero(np.diff(lengths[order])) + 1):
+        length = int(lengths[group[0]])
+        step = max(1, NUMPY_FACTORIZE_BYTES // max(length, 1))
+        for offset in range(0, len(group), step):
+            lines = group[offset:offset + step]
+            if length == 0:
+                first, count = np.zeros(1, dtype=np.intp), np.array([len(lines)])
+            else:
+                first, count = _unique_rows(data[starts[lines, None] + np.arange(length)])
+            firsts.append(lines[first])
+            counts.append(count)
+    firsts, counts = np.concatenate(firsts), np.concatenate(counts)
+    order = np.argsort(firsts, kind="stable")
+    # 依第一次出現的順序建立 dict；同長度分批時同一種列可能在多批出現，次數相加
+    distinct: Dict[bytes, int] = {}
+    for start, end, count in zip(starts[firsts[order]].tolist(), ends[firsts[order]].tolist(), counts[order].tolist()):
+        key = block[start:end]
+        distinct[key] = distinct.get(key, 0) + count
+    return len(ends), distinct
+
+def _unique_rows(rows) -> Tuple["np.ndarray", "np.ndarray"]:
+    """同長度的列 (uint8 2D 陣列) 中每種列第一次出現的位置與次數。
+
+    每列以 64-bit 多項式 hash 成一個整數代碼後以 np.unique 計數，再逐 byte 比對每列與其代碼的代表列；
+    有 hash 碰撞時改用較慢但精確的 np.unique(axis=0)。
+    """
+    weights = np.cumprod(np.full(rows.shape[1], 1099511628211, dtype=np.uint64))
+    codes = (rows.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+    _, first, inverse, counts = np.unique(codes, return_index=True, return_inverse=True, return_counts=True)
+    if not (rows == rows[first[inverse]]).all():
+        _, first, counts = np.unique(rows, axis=0, return_index=True, return_counts=True)
+    return first, counts
+
+def count_rows_distinct(file_path: str) -> Tuple[int, int, List[Tuple[Dict[str, str], int]]]:
+    """與 count_rows 相同的結果 (相同 label set 加總後)，但每種列只解析一次。
+
+    NumPy 可用時整個區塊在陣列上切列並以 np.unique 計數，否則以 bytes.split 切列後用 collections.Counter；
+    大量重複的 `host,job_name` 列只剩不重複的少數幾列需要 csv / parse_row。
+    引號內含換行的欄位不在支援範圍內 (data_collect.csv 不會出現)。
+    """
+    distinct: Dict[bytes, int] = {}
+    rows = 0
+    stats: Dict[str, int] = {}
+    for block in _iter_blocks(file_path, stats):
+        block_rows, counts = _count_lines(block)
+        rows += block_rows
+        for line, count in counts.items():
+            distinct[line] = distinct.get(line, 0) + count
+    return rows, stats["size"], _parse_distinct((line.decode("utf-8"), count) for line, count in distinct.items())
+
+def _iter_blocks(file_path: str, stats: Dict[str, int]) -> Iterator[bytes]:
+    """每次讀入約 NUMPY_CHUNK_BYTES 並切在換行處，逐一 yield 只含完整列的區塊；讀完後 bytes 寫入 stats["size"]。"""
+    size = 0
+    tail = b""
+    with open(file_path, "rb") as f:
+        eof = False
+        while not eof:
+            block = f.read(NUMPY_CHUNK_BYTES)
+            eof = not block
+            size += len(block)
+            block = tail + block
+            if not eof:
+                # 區塊結尾不完整的一列留到下一個區塊
+                cut = block.rfind(b"\n") + 1
+                block, tail = block[:cut], block[cut:]
+            if block:
+                yield block
+    stats["size"] = size
+
+def iter_count_rows_distinct(file_path: str, stats: Dict[str, int]) -> Iterator[Tuple[Dict[str, str], int]]:
+    """count_rows_distinct 的串流版本：每個區塊各自計數後 yield，同時只有一個區塊的不重複列在記憶體中。
+
+    跨區塊重複的 label set 會出現多次 (SQLite store 在同一世代內相加)；列數與 bytes 讀完後寫入 stats。
+    """
+    rows = 0
+    for block in _iter_blocks(file_path, stats):
+        block_rows, counts = _count_lines(block)
+        rows += block_rows
+        yield from _iter_parsed((line.decode("utf-8"), count) for line, count in counts.items())
+    stats["rows"] = rows
+
+# 每列只當成一個欄位讀入；分隔字元選用 data_collect.csv 不會出現的 unit separator
+_ARROW_DELIMITER = "\x1f"
+
+def count_rows_arrow(file_path: str) -> Tuple[int, int, List[Tuple[Dict[str, str], int]]]:
+    """與 count_rows 相同的結果，由 pyarrow 在 C++ 中多執行緒讀檔並 group_by 計數。
+
+    整列作為單一字串欄位讀入 (不處理引號)，以整列分組等同以 host、job_name 與 labels 欄分組；
+    之後只有不重複的列交給 csv / parse_row。空檔案直接回傳；pyarrow 無法讀取的檔案 (例如含 \\x1f 的列)
+    整個改用 count_rows 解析，結果不變。引號內含換行的欄位不在支援範圍內。
+    """
+    size = os.path.getsize(file_path)
+    if size == 0:
+        # copy 模式沒有新資料的週期、空的交接 / spool segment；pyarrow 會丟出 "Empty CSV file"
+        return 0, 0, []
+    try:
+        table = _read_arrow_lines(file_path)
+    except pa.ArrowInvalid as e:
+        logging.warning(f"pyarrow cannot read {file_path}, falling back to the python engine: {e}")
+        return count_rows(file_path)
+    return table.num_rows, size, _parse_distinct(_arrow_distinct(table))
+
+def _read_arrow_lines(source) -> "pa.Table":
+    return pa_csv.read_csv(
+        source,
+        read_options=pa_csv.ReadOptions(column_names=["line"], use_threads=True),
+        parse_options=pa_csv.ParseOptions(delimiter=_ARROW_DELIMITER, quote_char=False, ignore_empty_lines=False),
+        convert_options=pa_csv.ConvertOptions(column_types={"line": pa.string()}, strings_can_be_null=False),
+    )
+
+def _arrow_distinct(table: "pa.Table") -> Iterable[Tuple[str, int]]:
+    grouped = table.group_by("line").aggregate([("line", "count")])
+    return zip(grouped.column("line").to_pylist(), grouped.column("line_count").to_pylist())
+
+def iter_count_rows_arrow(file_path: str, stats: Dict[str, int]) -> Iterator[Tuple[Dict[str, str], int]]:
+    """count_rows_arrow 的串流版本：每個區塊各自由 pyarrow 讀入並 group_by 後 yield。
+
+    pyarrow 無法讀取的區塊只有該區塊改用 csv 逐列解析，已 yield 的區塊不會重複計算；列數與 bytes 讀完後寫入 stats。
+    """
+    rows = 0
+    for block in _iter_blocks(file_path, stats):
+        try:
+            table = _read_arrow_lines(pa.BufferReader(block))
+        except pa.ArrowInvalid as e:
+            logging.warning(f"pyarrow cannot read a block of {file_path}, parsing it with the python engine: {e}")
+            for row in csv.reader(io.StringIO(block.decode("utf-8"), newline="")):
+                rows += 1
+                parsed = parse_row(row)
+                if parsed is not None:
+                    yield parsed
+            continue
+        rows += table.num_rows
+        yield from _iter_parsed(_arrow_distinct(table))
+    stats["rows"] = rows
+
+def _parse_distinct(distinct: Iterable[Tuple[str, int]]) -> List[Tuple[Dict[str, str], int]]:
+    """解析不重複的列，count 乘上該列出現的次數。"""
+    return list(_iter_parsed(distinct))
+
+def _iter_parsed(distinct: Iterable[Tuple[str, int]]) -> Iterator[Tuple[Dict[str, str], int]]:
+    for line, count in distinct:
+        parsed = parse_row(next(csv.reader([line]), []))
+        if parsed is not None:
+            labels, value = parsed
+            yield labels, value * count
+
+def parse_row(row: List[str]) -> Optional[Tuple[Dict[str, str], int]]:
+    """解析一列 `host,job_name[,count][,{labels}]`，回傳 (labels, count)；無效列回傳 None。
+
+    labels 同時接受 `{k=v, ...}` 與 `{'k': 'v', ...}` 兩種寫法；沒有 count 欄位時視為 1。
+    host 或 job_name 為空、count 不是數字、labels 沒有以 `{...}` 包住或有缺少 key / 值的項目都視為無效，
+    不產生缺 label 的 series 也不把數值當成 1；值為空引號 (`k=""`) 的 label 照舊忽略。
+    """
+    if len(row) < 2:
+        return None
+    host = row[0].strip()
+    job_name = row[1].strip()
+    if not host or not job_name:
+        return None
+    log_count = 1
+    label_cols = [col for col in row[2:] if col.strip()]
+    if label_cols and label_cols[0].strip().isdigit():
+        log_count = int(label_cols[0].strip())
+        label_cols = label_cols[1:]
+    # 未加引號的 `{k=v, k2=v2}` 會被 csv 拆成多欄，合併後檢查整體括號
+    joined = ",".join(label_cols).strip()
+    if joined and not (joined.startswith('{') and joined.endswith('}')):
+        return None
+    extra_labels = {}
+    for col in label_cols:
+        col = col.strip().strip('{}')
+        for pair in col.split(','):
+            if not pair.strip():
+                continue
+            eq, colon = pair.find('='), pair.find(':')
+            if eq < 0 and colon < 0:
+                return None
+            sep = '=' if colon < 0 or 0 <= eq < colon else ':'
+            k, v = map(str.strip, pair.split(sep, 1))
+            k = k.strip('{}').strip(_QUOTES).strip()
+            if not k or not v:
+                return None
+            v = v.strip(_QUOTES).strip()
+            if v:
+                extra_labels[k] = v
+    return {**extra_labels, "host": host, "job_name": job_name}, log_count
+
+def _render_rows(families: Tuple[CustomGauge, ...], rows: Iterable[Tuple[int, Dict[str, str], float]], chunk_series: int = CHUNK_SERIES) -> Iterable[bytes]:
+    """把依分組排序的 (family 索引, labels, value) 逐段 render 成 exposition，格式與 CustomGauge.iter_exposition 相同。"""
+    lines = []
+    group = None
+    for index, labels, value in rows:
+        metric = families[index]
+        if (index, tuple(labels)) != group:
+            group = (index, tuple(labels))
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}\n# TYPE {metric.name} gauge\n")
+        lines.append(_sample_line(metric.name, labels, value))
+        if len(lines) >= chunk_series:
+            yield "".join(lines).encode("utf-8")
+            lines = []
+    if lines:
+        yield "".join(lines).encode("utf-8")
+
+def _collect_rows(families: Tuple[CustomGauge, ...], rows: Iterable[Tuple[int, Dict[str, str], float]]) -> Iterable[GaugeMetricFamily]:
+    """與 CustomGauge.collect 相同，每個 label 名稱組合一個 GaugeMetricFamily，一次只保留一個分組。"""
+    gauge = None
+    group = None
+    for index, labels, value in rows:
+        if (index, tuple(labels)) != group:
+            if gauge is not None:
+                yield gauge
+            group = (index, tuple(labels))
+            gauge = GaugeMetricFamily(families[index].name, families[index].documentation, labels=group[1])
+        gauge.add_metric(list(labels.values()), value)
+    if gauge is not None:
+        yield gauge
+
+def _store_filter(
+    families: Tuple[CustomGauge, ...],
+    shard: Optional[Tuple[int, int]],
+    selectors: Optional[List[Tuple[Optional[str], List[Tuple[str, str, str]]]]],
+):
+    """把分片與 match[] 轉成 SQLiteSeriesStore.iter_rows 的 (等值條件, predicate)。
+
+    只有一個 selector 時其等值條件交給 SQL 的 label 索引；其餘條件與分片在讀出後過濾。
+    """
+    equal = ()
+    if selectors and len(selectors) == 1:
+        equal = tuple((name, value) for name, op, value in selectors[0][1] if op == "=" and value and name != "__name__")
+    if not selectors and shard is None:
+        return equal, None
+
+    def predicate(index: int, labels: Dict[str, str]) -> bool:
+        if shard is not None and series_shard(tuple(sorted(labels.items())), shard[1]) != shard[0]:
+            return False
+        if not selectors:
+            return True
+        for selector in selectors:
+            matchers = selector_matchers(selector, families[index].name)
+            if matchers is not None and _matches_all(labels, matchers):
+                return True
+        return False
+
+    return equal, predicate
+
+def _render_shards(families: Iterable[CustomGauge], shard_count: int) -> Dict[Tuple[int, int], Tuple[bytes, ...]]:
+    shards: Dict[Tuple[int, int], Tuple[bytes, ...]] = {(index, shard_count): () for index in range(shard_count)}
+    for metric in families:
+        for index, segments in enumerate(metric.shard_exposition(shard_count)):
+            shards[(index, shard_count)] += segments
+    return shards
+
+def parse_shard(query: Dict[str, List[str]]) -> Optional[Tuple[int, int]]:
+    """解析 ?shard=i&of=n；未帶參數回傳 None，格式錯誤丟出 ValueError。"""
+    if "shard" not in query and "of" not in query:
+        return None
+    index = int(query["shard"][0])
+    shard_count = int(query["of"][0])
+    if shard_count < 1 or not 0 <= index < shard_count:
+        raise ValueError(f"shard {index} out of range for of={shard_count}")
+    return index, shard_count
+
+# 每次啟動不同的識別碼：世代在重啟後從 0 重新計數，ETag 帶上它才不會讓重啟前的 ETag 誤中 304
+BOOT_ID = os.urandom(4).hex()
+
+# exporter 自身的 process / python / 熱路徑指標 (REGISTRY) 另外由這個路徑輸出，每次請求都重新產生
+SELF_METRICS_PATH = "/metrics/self"
+
+def generation_etag(generation: int) -> str:
+    """資料世代的 ETag (本次啟動的 BOOT_ID + 世代)。"""
+    return f'"{BOOT_ID}-gen-{generation}"'
+
+# 租戶 id -> 該租戶的 LogExporter；預設端點仍使用全域 exporter
+tenants: Dict[str, LogExporter] = {}
+
+def load_tenants(source: str) -> Dict[str, str]:
+    """讀取租戶 id -> log 檔的對應：YAML (.yml/.yaml，需要 PyYAML) 或 JSON 檔案，或直接是 JSON 字串。"""
+    if source.lstrip().startswith("{"):
+        config = json.loads(source)
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            if os.path.splitext(source)[1] in (".yml", ".yaml"):
+                if yaml is None:
+                    raise RuntimeError(f"PyYAML is required to read {source}; install pyyaml or use a .json tenants file")
+                config = yaml.safe_load(f) or {}
+            else:
+                config = json.load(f)
+    if not isinstance(config, dict) or not all(isinstance(v, str) and v for v in config.values()):
+        raise ValueError(f"{source}: tenants must map tenant id to a log file path")
+    for tenant_id in config:
+        if not re.fullmatch(r"[^/]+", str(tenant_id)):
+            raise ValueError(f"{source}: invalid tenant id {tenant_id!r}")
+    return {str(tenant_id): log_file for tenant_id, log_file in config.items()}
+
+def tenant_store_path(store_path: str, tenant_id: str) -> str:
+    """租戶各自的 SQLite 檔，例如 series.db -> series_team_a.db。"""
+    root, ext = os.path.splitext(store_path)
+    return f"{root}_{tenant_id}{ext}"
+
+_TENANT_PATH_RE = re.compile(r"^/tenant/([^/]+)/metrics/?$")
+
+def route_exporter(path: str) -> Optional[LogExporter]:
+    """`/tenant/<id>/metrics` 回傳該租戶的 exporter，其他路徑回傳預設 exporter。"""
+    match = _TENANT_PATH_RE.match(path)
+    if match:
+        return tenants.get(match.group(1))
+    return exporter
+
+def rotate_and_update(target: LogExporter) -> None:
+    """複製 log_file 到 tmp_log_file、更新指標，再清空 log_file。"""
+    try:
+        shutil.copyfile(target.log_file, target.tmp_log_file)
+        logging.info(f"Copied {target.log_file} to {target.tmp_log_file}")
+    except Exception as e:
+        logging.error(f"Copy failed: {e}")
+
+    target.update_metrics()
+
+    try:
+        with open(target.log_file, 'w', encoding='utf-8') as f:
+            f.truncate(0)
+        logging.info(f"Cleared contents of {target.log_file}")
+    except Exception as e:
+        logging.error(f"File clear failed: {e}")
+
+def segment_path(log_file: str, now: Optional[float] = None) -> str:
+    """log_file 交接用的 segment 檔名，例如 data_collect.20240101120030.123456.csv (依時間排序)。"""
+    now = time.time() if now is None else now
+    root, ext = os.path.splitext(log_file)
+    return f"{root}.{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}.{int(now % 1 * 1e6):06d}{ext}"
+
+def pending_segments(log_file: str) -> List[str]:
+    """log_file 目錄中尚未解析的 segment，由舊到新。"""
+    root, ext = os.path.splitext(log_file)
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"\.\d{14}\.\d{6}" + re.escape(ext) + "$")
+    directory = os.path.dirname(log_file) or "."
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if pattern.match(name)]
+
+def handoff_and_update(target: LogExporter) -> None:
+    """把 log_file rename 成 segment，解析上一輪 (或上次執行遺留) 的 segment 後刪除。
+
+    rename 不複製任何 bytes；producer 每次以路徑重新開檔 append，下一筆就寫進新的 log_file。
+    仍握著舊 fd 的 writer 會繼續寫進剛改名的 segment，因此 segment 要等一個週期後才解析。
+    producer 寫入時若持有 `<log_file>.lock` 的共享鎖，rename 前以非阻塞方式嘗試獨佔鎖，
+    拿不到就留到下一輪交接，更新與 scrape 都不等待檔案鎖。
+    """
+    ready = pending_segments(target.log_file)
+    lock = AdvisoryLock(f"{target.log_file}.lock")
+    if lock.acquire(blocking=False):
+        try:
+            os.rename(target.log_file, segment_path(target.log_file))
+        except FileNotFoundError:
+            logging.debug(f"{target.log_file} does not exist, no new rows this cycle")
+        except OSError as e:
+            logging.error(f"Rename of {target.log_file} failed: {e}")
+        finally:
+            lock.release()
+    else:
+        logging.info(f"{target.log_file} is locked by a writer, handing it off next cycle")
+
+    target.update_metrics(ready)
+
+    for path in ready:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Removing segment {path} failed: {e}")
+
+def spool_and_update(target: LogExporter, consumer: SpoolConsumer, pool=None) -> None:
+    """spool 模式：認領 incoming/ 的 segment 並發佈，發佈後才 commit (刪除或移到 done/)。"""
+    paths = consumer.claim()
+    target.update_metrics(paths, pool=pool)
+    consumer.commit(paths)
+
+# 解析引擎名稱 -> 解析整個檔案的函式 (也作為 pool worker)
+ENGINES = {"python": count_rows, "numpy": count_rows_distinct, "arrow": count_rows_arrow}
+# 各引擎的串流版本，SQLite store 時直接餵給 upsert
+STREAM_ENGINES = {"python": iter_count_rows, "numpy": iter_count_rows_distinct, "arrow": iter_count_rows_arrow}
+
+# === 自訂 Metrics Handler，支援 IP 與 UA 辨識 ===
+class CustomMetricsHandler(MetricsHandler):
+    # HTTP/1.1 才能使用 Transfer-Encoding: chunked
+    protocol_version = "HTTP/1.1"
+
+    # 未設定時 /debug/* 一律回 404
+    debug_token = os.environ.get("DEBUG_TOKEN", "")
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/debug/"):
+            self.serve_debug()
+            return
+        if urlparse(self.path).path.rstrip("/") == SELF_METRICS_PATH:
+            self.serve_self_metrics()
+            return
+        scraper_ip = self.headers.get("X-Forwarded-For") or self.client_address[0]
+        scraper_ip = scraper_ip.split(',')[0].strip()
+        scraper_user_agent = self.headers.get("User-Agent", "unknown")
+        scraper_version = f"{scraper_ip}_{scraper_user_agent}"
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Scraper headers: {dict(self.headers)}")
+        # 自身指標的 label 只用有限的產品名，不使用 X-Forwarded-For 與完整 User-Agent
+        label = scraper_label(scraper_user_agent)
+        with scrape_duration.labels(label).time():
+            written = self.serve_metrics(scraper_version)
+        scrape_bytes.labels(label).inc(written)
+
+    def serve_metrics(self, scraper_version: str) -> int:
+        """處理一次 /metrics 請求，回傳寫出的 body bytes 數。"""
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            shard = parse_shard(query)
+            selectors = [parse_selector(selector) for selector in query.get("match[]", [])]
+        except (KeyError, ValueError, re.error) as e:
+            self.send_error(400, f"Invalid query parameters: {e}")
+            return 0
+
+        target = route_exporter(url.path)
+        if target is None:
+            self.send_error(404, "Unknown tenant")
+            return 0
+
+        generation, segments, fresh = target.scrape(scraper_version, shard, selectors)
+        if not fresh:
+            logging.debug(f"Scraper {scraper_version} re-read generation {generation}")
+
+        # body 只有該世代的 series (自身指標在 SELF_METRICS_PATH)，ETag 只隨世代與重啟改變
+        etag = generation_etag(generation)
+        headers = {"ETag": etag, "X-Exporter-Generation": str(generation), "X-Exporter-Fresh": "true" if fresh else "false"}
+
+        # 資料世代未變且 Scraper 帶了相同 ETag，直接回 304，不傳 body
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return 0
+
+        return self.write_segments(segments, headers)
+
+    def serve_self_metrics(self) -> None:
+        """輸出 REGISTRY (process / python 與 log_exporter_* 自身指標)；每次都不同，不帶 ETag。"""
+        body = generate_latest(REGISTRY)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_debug(self) -> None:
+        url = urlparse(self.path)
+        authorization = self.headers.get("Authorization", "")
+        if not self.debug_token or url.path not in ("/debug/profile", "/debug/heap"):
+            self.send_error(404)
+            return
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {self.debug_token}".encode()):
+            self.send_error(401)
+            return
+        query = parse_qs(url.query)
+        try:
+            seconds = float(query.get("seconds", ["10"])[0])
+            top = int(query.get("top", ["25"])[0])
+        except ValueError as e:
+            self.send_error(400, f"Invalid query parameters: {e}")
+            return
+        if not profiling.profile_lock.acquire(blocking=False):
+            self.send_error(409, "Another profile is running")
+            return
+        try:
+            logging.warning(f"Debug capture {url.path} for {seconds}s requested by {self.client_address[0]}")
+            if url.path == "/debug/heap":
+                text = profiling.heap_top(top, seconds)
+            else:
+                samples = profiling.sample_stacks(seconds)
+                fmt = query.get("format", ["collapsed"])[0]
+                text = profiling.format_top(samples, top) if fmt == "top" else profiling.format_collapsed(samples)
+        finally:
+            profiling.profile_lock.release()
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_segments(self, segments: Iterable[bytes], headers: Dict[str, str]) -> int:
+        """逐段寫出 exposition；HTTP/1.0 的 client 退回 Content-Length (需先取得全部段落)。"""
+        chunked = self.request_version != "HTTP/1.0"
+        if not chunked:
+            segments = tuple(segments)
+        written = 0
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(sum(len(segment) for segment in segments)))
+        self.end_headers()
+        for segment in segments:
+            if not segment:
+                continue
+            written += len(segment)
+            if chunked:
+                self.wfile.write(b"%x\r\n" % len(segment))
+                self.wfile.write(segment)
+                self.wfile.write(b"\r\n")
+            else:
+                self.wfile.write(segment)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        return written
+
+# === HTTP Server 啟動函式 ===
+def start_custom_http_server(port: int) -> None:
+    # 讀取快照不需加鎖，多個 Scraper 可以並行處理
+    server = ThreadingHTTPServer(('0.0.0.0', port), CustomMetricsHandler)
+    server.serve_forever()
+
+# === 主程式 ===
+if __name__ == "__main__":
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_FILE = os.environ.get("LOG_FILE", "")  # 除了 stderr 之外另外寫入的 log 檔，例如 exporter.log
+    # 寫出在背景 thread 進行，update / scrape 只把 record 放進佇列
+    log_listener = setup_logging(LOG_FILE or None, level=getattr(logging, LOG_LEVEL.upper(), logging.INFO))
+
+    LOGFILE = "logs/data_collect.csv"
+    TMPLOGFILE = "logs/data_collect_tmp.csv"
+    PORT = 6379
+    FREQUENCY = 80
+    # 預先 render 的分片數，與 vmagent 的 hashmod modulus 一致，例如 SHARD_COUNTS=2,4；未設定時分片在第一次請求時才 render
+    SHARD_COUNTS = tuple(int(count) for count in os.environ.get("SHARD_COUNTS", "").split(",") if count.strip())
+    # copy：copyfile + truncate (預設)；rename：零複製交接，producer 必須每次以路徑重新開檔 append
+    ROTATE_MODE = os.environ.get("ROTATE_MODE", "copy")
+    SPOOL_DIR = os.environ.get("SPOOL_DIR", "")  # 設定後預設 exporter 改讀 spool 目錄，例如 logs/spool
+    SPOOL_WORKERS = int(os.environ.get("SPOOL_WORKERS", "0"))  # 平行解析的 process 數 (0 表示不開 pool)
+    SPOOL_KEEP_DONE = os.environ.get("SPOOL_KEEP_DONE", "") == "1"  # 解析完的 segment 移到 done/ 而不刪除
+    ROUTES_FILE = os.environ.get("ROUTES_FILE", "")  # metric 路由表，例如 routes.yml
+    SERIES_TTL = int(os.environ.get("SERIES_TTL", "0"))  # series 未出現後保留的世代數 (0 表示每輪重建)
+    ENGINE = os.environ.get("ENGINE", "python")  # CSV 解析引擎，見 ENGINES
+    SERIES_STORE = os.environ.get("SERIES_STORE", "")  # 設定時 series 存在這個 SQLite 檔 (不可與 SERIES_TTL 併用)
+    REMOTE_WRITE_URL = os.environ.get("REMOTE_WRITE_URL", "")  # 例如 http://vminsert:8480/insert/0/prometheus
+    REMOTE_WRITE_QUEUE_PATH = os.environ.get("REMOTE_WRITE_QUEUE_PATH", "")  # 例如 logs/remote_write_queue
+
+    remote_write = None
+    if REMOTE_WRITE_URL:
+        persistent_queue = PersistentQueue(REMOTE_WRITE_QUEUE_PATH) if REMOTE_WRITE_QUEUE_PATH else None
+        remote_write = RemoteWriteClient(REMOTE_WRITE_URL, persistent_queue=persistent_queue)
+
+    # 每個租戶一組 log 檔與 series 上限；TENANTS 為租戶設定檔 (tenants.yml / tenants.json) 或 JSON 字串，
+    # 例如 TENANTS='{"team_a": "logs/team_a/data_collect.csv"}'
+    TENANTS = load_tenants(os.environ["TENANTS"]) if os.environ.get("TENANTS") else {}
+    TENANT_MAX_SERIES = int(os.environ.get("TENANT_MAX_SERIES", "50000"))
+
+    # exporter 不註冊進 REGISTRY，由 CustomMetricsHandler 直接輸出世代快取
+    router = load_routes(ROUTES_FILE) if ROUTES_FILE else None
+    exporter = LogExporter(
+        LOGFILE,
+        shard_counts=SHARD_COUNTS,
+        remote_write=remote_write,
+        tmp_log_file=TMPLOGFILE,
+        router=router,
+        series_ttl=SERIES_TTL,
+        engine=ENGINE,
+        store_path=SERIES_STORE,
+    )
+    for tenant_id, tenant_log_file in TENANTS.items():
+        # 租戶與預設 exporter 使用相同的解析引擎、路由表與 series 保存方式；SQLite store 各租戶一個檔案，
+        # 且不支援 max_series (series 不在記憶體中)
+        tenants[tenant_id] = LogExporter(
+            tenant_log_file,
+            shard_counts=SHARD_COUNTS,
+            tmp_log_file=f"{os.path.splitext(tenant_log_file)[0]}_tmp.csv",
+            max_series=0 if SERIES_STORE else TENANT_MAX_SERIES,
+            router=router,
+            series_ttl=SERIES_TTL,
+            engine=ENGINE,
+            store_path=tenant_store_path(SERIES_STORE, tenant_id) if SERIES_STORE else "",
+        )
+
+    spool_consumer = SpoolConsumer(SPOOL_DIR, keep_done=SPOOL_KEEP_DONE) if SPOOL_DIR else None
+    spool_pool = Pool(SPOOL_WORKERS) if spool_consumer and SPOOL_WORKERS > 1 else None
+
+    Thread(target=start_custom_http_server, args=(PORT,), daemon=True).start()
+    logging.info(f"Prometheus exporter running on http://localhost:{PORT}/metrics")
+    logging.info(f"Exporter self metrics on http://localhost:{PORT}{SELF_METRICS_PATH}")
+    for tenant_id in tenants:
+        logging.info(f"Tenant {tenant_id} metrics on http://localhost:{PORT}/tenant/{tenant_id}/metrics")
+
+    try:
+        while True:
+            for target in [exporter, *tenants.values()]:
+                if target is exporter and spool_consumer is not None:
+                    spool_and_update(target, spool_consumer, spool_pool)
+                elif ROTATE_MODE == "copy":
+                    rotate_and_update(target)
+                else:
+                    handoff_and_update(target)
+
+            time.sleep(FREQUENCY)
+    finally:
+        if spool_pool is not None:
+            spool_pool.close()
+        log_listener.stop()
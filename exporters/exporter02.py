@@ -5,7 +5,11 @@ from datetime import datetime
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
 from prometheus_client import start_http_server
 import logging
-from filelock import FileLock, Timeout
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，改用 msvcrt.locking
+    fcntl = None
+    import msvcrt
 from logging.handlers import RotatingFileHandler
 
 # 设置日志轮换
@@ -18,6 +22,17 @@ logging.basicConfig(
     handlers=[log_handler]
 )
 
+def try_lock(fd):
+    """非阻塞取得独占锁；持有进程退出时由内核释放，关闭 fd 即解锁。"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
 class LogExporter:
     def __init__(self, log_file):
         self.log_file = log_file
@@ -28,11 +43,14 @@ class LogExporter:
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         tmp_log_file = f"tmp_log_{timestamp}.csv"
 
-        # 检查并清理过期的锁文件
-        self._cleanup_lock()
+        # fcntl / msvcrt 咨询锁：持有者退出时由内核自动释放，不会留下过期锁文件；
+        # 非阻塞尝试，拿不到锁就跳过本次 scrape，不在 collect() 中等待
+        lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not try_lock(lock_fd):
+                logging.info(f"{self.log_file} is locked by a writer, skip this scrape.")
+                return
 
-        # 使用文件锁确保安全操作
-        with FileLock(self.lock_file, timeout=5):  # 锁超时时间 5 秒
             if not os.path.exists(self.log_file):
                 logging.warning(f"Log file {self.log_file} does not exist.")
                 return
@@ -44,6 +62,8 @@ class LogExporter:
             except Exception as e:
                 logging.error(f"Error renaming file: {e}")
                 return
+        finally:
+            os.close(lock_fd)  # 关闭文件描述符即释放锁
 
         # 定义 GaugeMetricFamily 指标
         metric = GaugeMetricFamily(
@@ -97,20 +117,6 @@ class LogExporter:
             logging.error(f"Error clearing or removing file {file_path}: {e}")
             raise e
 
-    def _cleanup_lock(self):
-        """检查并清理过期的锁文件"""
-        if os.path.exists(self.lock_file):
-            try:
-                with FileLock(self.lock_file, timeout=1):  # 尝试获取锁
-                    logging.info("Lock file is valid, no need to clean up.")
-            except Timeout:
-                # 如果超时，说明锁文件是过期的，可以删除
-                try:
-                    os.remove(self.lock_file)
-                    logging.warning(f"Removed stale lock file {self.lock_file}")
-                except Exception as e:
-                    logging.error(f"Error removing stale lock file {self.lock_file}: {e}")
-
 if __name__ == "__main__":
     # 指定 log.csv 文件路径
     log_file = "log.csv"
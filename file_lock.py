@@ -0,0 +1,184 @@
+# log 檔交接用的 advisory lock，取代 filelock.FileLock + 過期鎖檔輪詢。
+# fcntl.flock 的鎖跟著 open file description 走，持有的 process 結束 (含崩潰) 時 kernel 自動釋放，
+# 因此不會有過期的鎖檔，也不需要逾時等待。Windows 沒有 fcntl，改用 msvcrt.locking 鎖住鎖檔的第一個 byte，
+# 同樣由 kernel 在 process 結束時釋放 (不支援共享鎖，一律獨佔)。
+# 兩者皆沒有的平台才退回以 O_EXCL 建立鎖檔，鎖檔內記錄 pid，持有者已不存在時視為過期並接手。
+
+import os
+import time
+import logging
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.01
+BACKENDS = ("fcntl", "msvcrt", "pidfile")
+DEFAULT_BACKEND = "fcntl" if fcntl is not None else "msvcrt" if msvcrt is not None else "pidfile"
+# 接手過期鎖檔的 guard 檔存在超過這個秒數，視為接手者中途崩潰留下的
+TAKEOVER_TIMEOUT = 10.0
+
+_STILL_ACTIVE = 259
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        # Windows 的 os.kill(pid, 0) 會呼叫 TerminateProcess 把對方殺掉，不能拿來探測
+        import ctypes
+        from ctypes import wintypes
+
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            # ERROR_ACCESS_DENIED 表示 process 存在但屬於其他使用者
+            return ctypes.get_last_error() == 5
+        try:
+            code = wintypes.DWORD()
+            if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+                return True
+            return code.value == _STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_pid(path: str) -> Optional[int]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class AdvisoryLock:
+    """`path` 上的 advisory lock；shared=True 為共享鎖 (多個 producer 同時 append)，否則為獨佔鎖。
+
+    fcntl / msvcrt 的鎖檔本身不會被刪除，刪除後重建會讓兩個 process 各自鎖住不同的 inode。
+    """
+
+    def __init__(self, path: str, shared: bool = False, backend: str = DEFAULT_BACKEND) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {BACKENDS}, got {backend!r}")
+        self.path = path
+        self.shared = shared
+        self.backend = backend
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """取得鎖；blocking=False 時立即回傳是否成功，timeout 為最多等待的秒數。"""
+        if self._fd is not None:
+            raise RuntimeError(f"{self.path} is already locked by this object")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._try_acquire():
+                return True
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(POLL_INTERVAL)
+
+    def _try_acquire(self) -> bool:
+        if self.backend == "fcntl":
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+
+        if self.backend == "msvcrt":
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+
+        # 退回鎖檔：不支援共享鎖，一律獨佔
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return self._take_over_if_stale()
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def _take_over_if_stale(self) -> bool:
+        """持有者已不存在時，以 os.replace 把寫好自己 pid 的檔案原子地蓋過過期鎖檔。
+
+        鎖檔在接手期間一直存在，其他 process 的 O_EXCL 不會成功；多個接手者之間再以 O_EXCL 的
+        guard 檔序列化，並在取得 guard 後重新確認鎖檔仍是同一個過期 pid，不會兩個都接手成功。
+        """
+        pid = _read_pid(self.path)
+        if not pid or _pid_alive(pid):
+            return False
+        guard = f"{self.path}.takeover"
+        try:
+            guard_fd = os.open(guard, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(guard).st_mtime > TAKEOVER_TIMEOUT:
+                    logger.warning(f"Removing takeover guard {guard} abandoned by a crashed process")
+                    os.remove(guard)
+            except FileNotFoundError:
+                pass
+            return False
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            if _read_pid(self.path) != pid:
+                return False
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.write(fd, str(os.getpid()).encode())
+            os.replace(tmp_path, self.path)
+            logger.warning(f"Took over stale lock file {self.path} left by pid {pid}")
+            self._fd = fd
+            return True
+        finally:
+            os.close(guard_fd)
+            os.remove(guard)
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        if self.backend == "fcntl":
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        elif self.backend == "msvcrt":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+        else:
+            os.close(fd)
+            if _read_pid(self.path) == os.getpid():
+                os.remove(self.path)
+
+    def __enter__(self) -> "AdvisoryLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
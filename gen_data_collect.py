@@ -0,0 +1,99 @@
+# 產生擬真的 data_collect.csv 供 benchmark 與壓力測試使用。
+# 可調整列數、host/job cardinality、額外 label 比例、`{k=v}` 與 `{'k':'v'}` 兩種寫法的比例，
+# 以及 count 欄位與格式錯誤列的比例。
+#
+# 用法：python gen_data_collect.py --rows 1000000 --hosts 200 --jobs 50 logs/data_collect.csv
+
+import argparse
+import random
+from typing import Iterator, List, Optional
+
+LABEL_KEYS = ["service_name", "container_name", "module_name", "namespace", "pod"]
+
+# 實際 log 中出現過的格式錯誤
+MALFORMED = [
+    "",
+    "host_only",
+    "host_x,job_x,{service_name=",
+    "host_x,job_x,\"{'k1': }\"",
+    ",,,",
+    "host_x,job_x,abc,{module_name=”m”}",
+]
+
+
+def generate_rows(
+    rows: int,
+    hosts: int = 100,
+    jobs: int = 20,
+    label_ratio: float = 0.3,
+    label_values: int = 10,
+    max_labels: int = 2,
+    dict_syntax_ratio: float = 0.5,
+    count_ratio: float = 0.5,
+    malformed_ratio: float = 0.001,
+    seed: Optional[int] = 0,
+) -> Iterator[str]:
+    """逐列產生 CSV 文字 (含換行)。"""
+    rng = random.Random(seed)
+    host_names = [f"host_{i}" for i in range(hosts)]
+    job_names = [f"job_{i}" for i in range(jobs)]
+    for _ in range(rows):
+        if rng.random() < malformed_ratio:
+            yield rng.choice(MALFORMED) + "\n"
+            continue
+        fields: List[str] = [rng.choice(host_names), rng.choice(job_names)]
+        if rng.random() < count_ratio:
+            fields.append(str(rng.randint(1, 9)))
+        if rng.random() < label_ratio:
+            keys = rng.sample(LABEL_KEYS, rng.randint(1, max_labels))
+            labels = {k: f"{k[:3]}_{rng.randrange(label_values)}" for k in keys}
+            if rng.random() < dict_syntax_ratio:
+                body = ", ".join(f"'{k}': '{v}'" for k, v in labels.items())
+                fields.append(f"\"{{{body}}}\"")
+            else:
+                fields.append(" {" + ", ".join(f"{k}=”{v}”" for k, v in labels.items()) + "}")
+        yield ",".join(fields) + "\n"
+
+
+def write_csv(path: str, rows: int, **kwargs) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        batch: List[str] = []
+        for line in generate_rows(rows, **kwargs):
+            batch.append(line)
+            if len(batch) >= 10000:
+                f.write("".join(batch))
+                batch = []
+        f.write("".join(batch))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic data_collect.csv")
+    parser.add_argument("output")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--label-ratio", type=float, default=0.3)
+    parser.add_argument("--label-values", type=int, default=10)
+    parser.add_argument("--max-labels", type=int, default=2)
+    parser.add_argument("--dict-syntax-ratio", type=float, default=0.5)
+    parser.add_argument("--count-ratio", type=float, default=0.5)
+    parser.add_argument("--malformed-ratio", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_csv(
+        args.output,
+        args.rows,
+        hosts=args.hosts,
+        jobs=args.jobs,
+        label_ratio=args.label_ratio,
+        label_values=args.label_values,
+        max_labels=args.max_labels,
+        dict_syntax_ratio=args.dict_syntax_ratio,
+        count_ratio=args.count_ratio,
+        malformed_ratio=args.malformed_ratio,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# CustomMetricsHandler 的併發壓測：模擬多個 vmagent / Prometheus HA replica
+# (各自不同的 X-Forwarded-For 與 User-Agent) 同時抓取，同時背景持續執行 update_metrics。
+# 回報延遲百分位數、吞吐量、304 / 空回應 / 連線被拒次數，以及 server 的 RSS。
+#
+# 用法：
+#   python load_harness.py --scrapers 8 --duration 30 --rows 200000
+#   python load_harness.py --url http://exporter:6379/metrics --pid 1234 --scrapers 16
+
+import argparse
+import http.client
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+import exporter as exporter_module
+from exporter import CustomMetricsHandler, LogExporter
+from gen_data_collect import write_csv
+
+USER_AGENTS = [
+    "vmagent/v1.93.4",
+    "Prometheus/2.47.0",
+    "Prometheus/2.53.1",
+    "vmagent/v1.101.0",
+]
+
+
+def rss_bytes(pid: Optional[int] = None) -> int:
+    """讀取 /proc/<pid>/status 的 VmRSS；沒有 /proc 時退回本 process 的 ru_maxrss。"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class ScraperStats:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.statuses: Dict[str, int] = {}
+
+    def count(self, outcome: str) -> None:
+        self.statuses[outcome] = self.statuses.get(outcome, 0) + 1
+
+
+def run_scraper(
+    url: str, index: int, deadline: float, interval: float, use_etag: bool, metric_name: bytes, stats: ScraperStats
+) -> None:
+    """單一 scraper：保持 keep-alive 連線反覆 GET，連線失敗時重連。"""
+    target = urlparse(url)
+    headers = {
+        "X-Forwarded-For": f"10.0.{index // 256}.{index % 256}",
+        "User-Agent": USER_AGENTS[index % len(USER_AGENTS)],
+    }
+    path = target.path + (f"?{target.query}" if target.query else "")
+    etag = None
+    conn = None
+    while time.monotonic() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+        request_headers = dict(headers)
+        if use_etag and etag:
+            request_headers["If-None-Match"] = etag
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=request_headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (ConnectionRefusedError, ConnectionResetError, BrokenPipeError, http.client.RemoteDisconnected):
+            stats.count("refused")
+            conn.close()
+            conn = None
+            time.sleep(interval)
+            continue
+        except (OSError, http.client.HTTPException):
+            stats.count("error")
+            conn.close()
+            conn = None
+            time.sleep(interval)
+            continue
+        stats.latencies.append(time.perf_counter() - started)
+        stats.bytes += len(body)
+        if response.status == 304:
+            stats.count("not_modified")
+        elif response.status != 200:
+            stats.count(f"http_{response.status}")
+        elif metric_name not in body:
+            stats.count("empty")
+        else:
+            stats.count("ok")
+        etag = response.getheader("ETag") or etag
+        if interval:
+            time.sleep(interval)
+    if conn is not None:
+        conn.close()
+
+
+def run_updater(target: LogExporter, deadline: float, interval: float, stop: threading.Event, counter: List[int]) -> None:
+    while time.monotonic() < deadline and not stop.is_set():
+        target.update_metrics()
+        counter[0] += 1
+        stop.wait(interval)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def summarize(stats: List[ScraperStats], elapsed: float, rss: Dict[str, int], updates: int) -> Dict[str, object]:
+    latencies = [latency for s in stats for latency in s.latencies]
+    statuses: Dict[str, int] = {}
+    for s in stats:
+        for outcome, count in s.statuses.items():
+            statuses[outcome] = statuses.get(outcome, 0) + count
+    total_bytes = sum(s.bytes for s in stats)
+    return {
+        "scrapers": len(stats),
+        "elapsed_s": elapsed,
+        "requests": len(latencies),
+        "requests_per_s": len(latencies) / elapsed,
+        "mib_per_s": total_bytes / elapsed / (1 << 20),
+        "latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p90": percentile(latencies, 90) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+            "max": max(latencies, default=0.0) * 1000,
+            "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        },
+        "outcomes": statuses,
+        "updates": updates,
+        "rss_bytes": rss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent scraper load harness for CustomMetricsHandler")
+    parser.add_argument("--scrapers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=0.0, help="sleep between scrapes per scraper")
+    parser.add_argument("--etag", action="store_true", help="send If-None-Match like a caching scraper")
+    parser.add_argument("--url", help="scrape an already running exporter instead of an in-process one")
+    parser.add_argument("--pid", type=int, help="pid of the exporter given by --url, for RSS")
+    parser.add_argument("--rows", type=int, default=100000, help="rows of the synthetic CSV (in-process mode)")
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--update-interval", type=float, default=1.0, help="seconds between update_metrics")
+    parser.add_argument("--output", help="also write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    server = None
+    updater = None
+    stop = threading.Event()
+    updates = [0]
+    tmpdir = tempfile.TemporaryDirectory()
+    url = args.url
+    if url is None:
+        path = os.path.join(tmpdir.name, "data_collect_tmp.csv")
+        write_csv(path, args.rows, hosts=args.hosts, jobs=args.jobs)
+        target = LogExporter("load_harness", tmp_log_file=path)
+        target.update_metrics()
+        exporter_module.exporter = target
+        server = ThreadingHTTPServer(("127.0.0.1", 0), CustomMetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+    rss = {"before": rss_bytes(args.pid)}
+    deadline = time.monotonic() + args.duration
+    if server is not None:
+        updater = threading.Thread(target=run_updater, args=(target, deadline, args.update_interval, stop, updates))
+        updater.start()
+
+    stats = [ScraperStats() for _ in range(args.scrapers)]
+    threads = [
+        threading.Thread(
+            target=run_scraper,
+            args=(url, i, deadline, args.interval, args.etag, b"log_host_job_count", stats[i]),
+        )
+        for i in range(args.scrapers)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    peak = rss["before"]
+    while any(thread.is_alive() for thread in threads):
+        peak = max(peak, rss_bytes(args.pid))
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+    stop.set()
+    if updater is not None:
+        updater.join()
+    rss.update(peak=peak, after=rss_bytes(args.pid))
+
+    summary = summarize(stats, elapsed, rss, updates[0])
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    tmpdir.cleanup()
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# exporter 的非同步 log 管線：熱路徑上的 logger 只把 record 放進記憶體佇列 (QueueHandler)，
+# 由背景的 QueueListener thread 寫到 stderr (給容器的 log 收集)，指定檔案時另外寫入 RotatingFileHandler (5 MB x 3)，
+# 磁碟卡住時只會讓佇列變長或丟棄 record，不會拖慢 update / scrape。
+# 同一個呼叫位置在時間窗內的 record 會限流，重複的訊息合併成一筆 "suppressed N" 摘要；ERROR 以上不限流。
+# 已經由設定檔 (例如 eapp.py 的 logging.yaml) 設好 handler 的 logger 以 queue_handlers 改成同樣的非同步寫法。
+
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
+from prometheus_client import Counter
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+DEFAULT_QUEUE_SIZE = 10000
+
+# === 自身指標 ===
+log_dropped = Counter("log_exporter_log_dropped_records", "Log records dropped because the log queue was full")
+log_suppressed = Counter("log_exporter_log_suppressed_records", "Log records suppressed by the rate limit filter")
+
+
+class RateLimitFilter(logging.Filter):
+    """每個呼叫位置 (logger, level, 檔案, 行號) 在 interval 秒內最多放行 burst 筆。
+
+    被擋下的筆數會附加在該位置下一筆放行的訊息後面，因此 f-string 組出的不同內容
+    (例如每次重試的次數) 也會被視為同一類訊息。level >= exempt_level (預設 ERROR) 的 record 一律放行。
+    """
+
+    def __init__(self, interval: float = 60.0, burst: int = 5, exempt_level: int = logging.ERROR) -> None:
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.exempt_level = exempt_level
+        self._lock = threading.Lock()
+        # 呼叫位置 -> (時間窗起點, 時間窗內已放行筆數, 尚未回報的被擋筆數)
+        self._sites: Dict[Tuple[str, int, str, int], Tuple[float, int, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.exempt_level:
+            return True
+        site = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, passed, suppressed = self._sites.get(site, (now, 0, 0))
+            if now - started >= self.interval:
+                started, passed = now, 0
+            if passed >= self.burst:
+                self._sites[site] = (started, passed, suppressed + 1)
+                log_suppressed.inc()
+                return False
+            self._sites[site] = (started, passed + 1, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} (suppressed {suppressed} similar messages)"
+            record.args = None
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """佇列滿時直接丟棄 record 並計數，絕不阻塞呼叫端。"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_dropped.inc()
+
+
+def setup_logging(
+    path: Optional[str] = None,
+    level: int = logging.INFO,
+    max_bytes: int = 5 * 1024 * 1024,
+    backup_count: int = 3,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    rate_interval: float = 60.0,
+    rate_burst: int = 5,
+    handler: Optional[logging.Handler] = None,
+) -> QueueListener:
+    """把 root logger 換成 QueueHandler，回傳已啟動的 QueueListener (結束時呼叫 stop() 清空佇列)。
+
+    預設寫到 stderr；給 path 時同時寫入該檔案，給 handler 時只寫到該 handler。
+    """
+    if handler is not None:
+        handlers = [handler]
+    else:
+        handlers = [logging.StreamHandler()]
+        if path:
+            handlers.append(RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"))
+    for target in handlers:
+        target.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    return _attach_queue(root, handlers, queue_size, rate_interval, rate_burst)
+
+
+def queue_handlers(
+    logger: logging.Logger,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    rate_interval: float = 60.0,
+    rate_burst: int = 5,
+) -> QueueListener:
+    """保留 logger 既有的 handler 與格式 (沒有 handler 時往上找實際輸出的 logger)，改由 QueueListener 在背景寫出。"""
+    target: Optional[logging.Logger] = logger
+    while target is not None and not target.handlers and target.propagate:
+        target = target.parent
+    target = target if target is not None and target.handlers else logging.getLogger()
+    return _attach_queue(target, target.handlers[:], queue_size, rate_interval, rate_burst)
+
+
+def _attach_queue(
+    logger: logging.Logger,
+    handlers: List[logging.Handler],
+    queue_size: int,
+    rate_interval: float,
+    rate_burst: int,
+) -> QueueListener:
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(RateLimitFilter(rate_interval, rate_burst))
+
+    for existing in logger.handlers[:]:
+        logger.removeHandler(existing)
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
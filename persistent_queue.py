@@ -0,0 +1,273 @@
+# remote-write 的磁碟佇列 (write-ahead queue)：receiver 無法使用 (例如 vminsert 回 503) 時，
+# 壓縮好的批次依序寫入 segment 檔，receiver 恢復後再按原順序重送。
+# 每筆紀錄格式為 [長度 4 bytes][crc32 4 bytes][payload]，讀取進度存在 checkpoint 檔。
+# fsync="interval" 時由背景執行緒每 fsync_interval 秒把 segment 與 checkpoint 落盤 (flush / close 時也會)，
+# 崩潰最多遺失最後一個間隔內的寫入與確認。
+
+import os
+import json
+import zlib
+import struct
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+from prometheus_client import Counter, Gauge
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+DEFAULT_SEGMENT_SIZE = 32 << 20  # 32 MiB
+FSYNC_POLICIES = ("always", "interval", "never")
+
+_HEADER = struct.Struct(">II")
+_CHECKPOINT = "checkpoint.json"
+
+# === 自身指標 ===
+queue_bytes = Gauge("log_exporter_disk_queue_bytes", "Bytes of unsent blocks in the on-disk remote-write queue")
+queue_segments = Gauge("log_exporter_disk_queue_segments", "Number of segment files in the on-disk remote-write queue")
+appended_blocks = Counter("log_exporter_disk_queue_appended_blocks", "Number of blocks spilled to the on-disk remote-write queue")
+replayed_blocks = Counter("log_exporter_disk_queue_replayed_blocks", "Number of blocks replayed from the on-disk remote-write queue")
+replayed_bytes = Counter("log_exporter_disk_queue_replayed_bytes", "Bytes replayed from the on-disk remote-write queue")
+dropped_bytes = Counter("log_exporter_disk_queue_dropped_bytes", "Bytes dropped from the on-disk queue because of the size cap or corruption")
+corrupted_records = Counter("log_exporter_disk_queue_corrupted_records", "Number of corrupted records skipped in the on-disk remote-write queue")
+
+
+class PersistentQueue:
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        fsync: str = "interval",
+        fsync_interval: float = 1.0,
+    ) -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+        # 尚未 fsync 的 segment 寫入 / checkpoint
+        self._dirty = False
+        self._checkpoint_dirty = False
+        self._peeked = 0
+        self._reader = None
+
+        os.makedirs(path, exist_ok=True)
+        self._read_seq, self._read_offset = self._load_checkpoint()
+        self._segments: List[int] = sorted(
+            int(name[:-4]) for name in os.listdir(path) if name.endswith(".seg")
+        )
+        # checkpoint 之前的 segment 已經全部送出
+        while self._segments and self._segments[0] < self._read_seq:
+            os.remove(self._segment_path(self._segments.pop(0)))
+        if not self._segments:
+            self._segments.append(self._read_seq)
+        if self._segments[0] != self._read_seq:
+            self._read_seq, self._read_offset = self._segments[0], 0
+
+        writer_seq = self._segments[-1]
+        self._repair_tail(writer_seq)
+        self._writer = open(self._segment_path(writer_seq), "ab", buffering=0)
+        self._writer_size = self._writer.tell()
+        self._bytes = sum(os.path.getsize(self._segment_path(seq)) for seq in self._segments) - self._read_offset
+        self._update_gauges()
+
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if fsync == "interval" and fsync_interval > 0:
+            self._flusher = threading.Thread(target=self._run, name="disk-queue-fsync", daemon=True)
+            self._flusher.start()
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{seq:016d}.seg")
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, _CHECKPOINT), "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            return int(checkpoint["segment"]), int(checkpoint["offset"])
+        except FileNotFoundError:
+            return 0, 0
+        except (ValueError, KeyError) as e:
+            logger.error(f"Invalid disk queue checkpoint in {self.path}, replaying from the start: {e}")
+            return 0, 0
+
+    def _save_checkpoint(self, sync: bool = False) -> None:
+        sync = sync or self.fsync == "always"
+        tmp_path = os.path.join(self.path, _CHECKPOINT + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segment": self._read_seq, "offset": self._read_offset}, f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, _CHECKPOINT))
+        if sync:
+            # rename 本身也要落盤，否則崩潰後可能讀到舊的 checkpoint
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._checkpoint_dirty = not sync
+
+    def _repair_tail(self, seq: int) -> None:
+        """崩潰時最後一筆紀錄可能只寫了一半，截斷到最後一筆完整紀錄。"""
+        path = self._segment_path(seq)
+        if not os.path.exists(path):
+            return
+        valid = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid = f.tell()
+        if valid != os.path.getsize(path):
+            logger.warning(f"Truncating torn record at offset {valid} in {path}")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+
+    def _update_gauges(self) -> None:
+        queue_bytes.set(self._bytes)
+        queue_segments.set(len(self._segments))
+
+    def __len__(self) -> int:
+        """尚未送出的 bytes 數 (含紀錄 header)。"""
+        return self._bytes
+
+    def append(self, block: bytes) -> None:
+        record = _HEADER.pack(len(block), zlib.crc32(block)) + block
+        with self._lock:
+            if self._writer_size >= self.segment_size:
+                self._rotate()
+            self._writer.write(record)
+            self._writer_size += len(record)
+            self._bytes += len(record)
+            self._dirty = True
+            if self.fsync == "always" or (self.fsync == "interval" and time.monotonic() - self._last_fsync >= self.fsync_interval):
+                self._sync()
+            self._enforce_cap()
+            appended_blocks.inc()
+            self._update_gauges()
+
+    def _sync(self) -> None:
+        """把 segment 寫入與 checkpoint 落盤 (呼叫者需持有 _lock)。"""
+        if self._dirty:
+            os.fsync(self._writer.fileno())
+            self._dirty = False
+        if self._checkpoint_dirty:
+            self._save_checkpoint(sync=True)
+        self._last_fsync = time.monotonic()
+
+    def flush(self) -> None:
+        """把尚未 fsync 的寫入與讀取進度落盤；fsync="never" 時也可手動呼叫。"""
+        with self._lock:
+            if not self._writer.closed:
+                self._sync()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.fsync_interval):
+            self.flush()
+
+    def _rotate(self) -> None:
+        if self._dirty and self.fsync != "never":
+            os.fsync(self._writer.fileno())
+        self._dirty = False
+        self._writer.close()
+        seq = self._segments[-1] + 1
+        self._segments.append(seq)
+        self._writer = open(self._segment_path(seq), "ab", buffering=0)
+        self._writer_size = 0
+
+    def _enforce_cap(self) -> None:
+        # 超過容量上限時從最舊的 segment 開始丟棄
+        while self._bytes > self.max_bytes:
+            if len(self._segments) == 1:
+                self._rotate()
+            seq = self._segments[0]
+            size = os.path.getsize(self._segment_path(seq)) - self._read_offset
+            logger.warning(f"Disk queue {self.path} over {self.max_bytes} bytes, dropping segment {seq} ({size} bytes)")
+            dropped_bytes.inc(size)
+            self._bytes -= size
+            self._advance_segment()
+
+    def _advance_segment(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        os.remove(self._segment_path(self._segments.pop(0)))
+        self._read_seq, self._read_offset = self._segments[0], 0
+        self._peeked = 0
+        self._save_checkpoint()
+
+    def peek(self) -> Optional[bytes]:
+        """回傳最舊一筆尚未確認的 block；佇列為空時回傳 None。
+
+        損毀的紀錄 (crc 不符或長度不完整) 無法判斷下一筆從哪裡開始，會丟棄該 segment 剩下的部分；
+        損毀發生在正在寫入的 segment 時先換新的 segment，之後的 append 不受影響。
+        """
+        with self._lock:
+            while True:
+                active = self._read_seq == self._segments[-1]
+                end = self._writer_size if active else os.path.getsize(self._segment_path(self._read_seq))
+                if self._read_offset >= end:
+                    if active:
+                        return None
+                    self._advance_segment()
+                    self._update_gauges()
+                    continue
+                if self._reader is None:
+                    self._reader = open(self._segment_path(self._read_seq), "rb")
+                self._reader.seek(self._read_offset)
+                header = self._reader.read(_HEADER.size)
+                if len(header) == _HEADER.size:
+                    length, crc = _HEADER.unpack(header)
+                    payload = self._reader.read(length)
+                    if len(payload) == length and zlib.crc32(payload) == crc:
+                        self._peeked = _HEADER.size + length
+                        return payload
+                size = end - self._read_offset
+                logger.error(f"Corrupted record in segment {self._read_seq} at offset {self._read_offset}, skipping {size} bytes")
+                corrupted_records.inc()
+                dropped_bytes.inc(size)
+                self._bytes -= size
+                if active:
+                    self._rotate()
+                self._advance_segment()
+                self._update_gauges()
+
+    def ack(self) -> None:
+        """確認 peek 回傳的 block 已送達，讀取進度往前推。"""
+        with self._lock:
+            if not self._peeked:
+                return
+            self._read_offset += self._peeked
+            self._bytes -= self._peeked
+            replayed_bytes.inc(self._peeked)
+            replayed_blocks.inc()
+            self._peeked = 0
+            self._save_checkpoint()
+            self._update_gauges()
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            if self._writer.closed:
+                return
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            if self.fsync != "never":
+                self._sync()
+            self._writer.close()
@@ -0,0 +1,163 @@
+# 寫入 data_collect.csv 的 producer 函式庫：取代每個事件各自 open / write / close。
+# 事件先在記憶體中依 (host, job_name, labels) 預先加總，flush 時輸出成
+# `host,job_name,count,"{'k': 'v'}"` 列 (exporter 的 parse_row 可直接讀取)，
+# label 值中 parse_row 無法讀回的字元 (`,`、引號、大括號、換行) 在 emit 時換成 `_`，
+# 整批以單一 os.write (O_APPEND) 寫入；spool 模式則整批發佈成一個 segment (見 spool.py)。
+#
+# 用法：
+#   producer = LogProducer("logs/data_collect.csv")
+#   producer.emit("host_1", "job_A", {"service_name": "aaa"})
+#   producer.close()
+
+import os
+import re
+import csv
+import io
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from file_lock import AdvisoryLock
+import spool
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+EventKey = Tuple[str, str, Tuple[Tuple[str, str], ...]]
+
+# parse_row 以逗號分隔 label、去掉前後引號與大括號，這些字元 (與換行) 在 label 值中無法原樣讀回
+_UNSAFE_VALUE_RE = re.compile(r"[,'\"“”{}\r\n]")
+_LABEL_NAME_RE = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+
+def sanitize_value(value: str) -> str:
+    """把 label 值 / host / job_name 中 parse_row 無法讀回的字元換成 `_`，並去掉前後空白 (parse_row 也會去掉)。"""
+    return _UNSAFE_VALUE_RE.sub("_", str(value)).strip()
+
+
+def format_rows(counts: Dict[EventKey, int]) -> bytes:
+    """把加總後的事件轉成 CSV bytes；labels 欄以 csv 引號包住 (label 之間以逗號分隔)。"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for (host, job_name, labels), count in counts.items():
+        row = [host, job_name, count]
+        if labels:
+            row.append("{" + ", ".join(f"'{k}': '{v}'" for k, v in labels) + "}")
+        writer.writerow(row)
+    return buffer.getvalue().encode("utf-8")
+
+
+class LogProducer:
+    """緩衝並預先加總事件，累積 max_rows 種 label set 或經過 flush_interval 秒時寫出。"""
+
+    def __init__(
+        self,
+        log_file: str = "",
+        spool_dir: str = "",
+        max_rows: int = DEFAULT_MAX_ROWS,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        background: bool = True,
+        lock: bool = True,
+    ) -> None:
+        if bool(log_file) == bool(spool_dir):
+            raise ValueError("exactly one of log_file and spool_dir must be given")
+        self.log_file = log_file
+        self.spool_dir = spool_dir
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        # append 時持有共享鎖，exporter 交接 (rename) 前會嘗試獨佔鎖
+        self.lock = lock
+        self._counts: Dict[EventKey, int] = {}
+        self._buffer_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if background and flush_interval > 0:
+            self._flusher = threading.Thread(target=self._run, name="log-producer-flush", daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
+
+    def emit(self, host: str, job_name: str, labels: Optional[Dict[str, str]] = None, count: int = 1) -> None:
+        """記錄一個事件。
+
+        label 值、host 與 job_name 中的 `,`、引號、大括號與換行會換成 `_`，寫出的列一定能被 parse_row 讀回
+        (否則整列會被當成格式錯誤丟棄)；label 名稱不合 Prometheus 規則或 host / job_name 為空時丟出 ValueError。
+        """
+        host, job_name = sanitize_value(host), sanitize_value(job_name)
+        if not host or not job_name:
+            raise ValueError("host and job_name must not be empty")
+        for name in labels or {}:
+            if not _LABEL_NAME_RE.fullmatch(name):
+                raise ValueError(f"invalid label name {name!r}")
+        cleaned = {k: sanitize_value(v) for k, v in (labels or {}).items()}
+        key = (host, job_name, tuple(sorted((k, v) for k, v in cleaned.items() if v)))
+        with self._buffer_lock:
+            if self._closed.is_set():
+                raise ValueError("emit on a closed LogProducer")
+            self._counts[key] = self._counts.get(key, 0) + count
+            full = len(self._counts) >= self.max_rows
+        if full or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> int:
+        """寫出目前緩衝的事件，回傳寫出的 bytes 數。"""
+        with self._buffer_lock:
+            counts, self._counts = self._counts, {}
+            self._last_flush = time.monotonic()
+        if not counts:
+            return 0
+        data = format_rows(counts)
+        try:
+            if self.spool_dir:
+                spool.publish(self.spool_dir, data)
+            else:
+                self._append(data)
+        except OSError as e:
+            # 寫入失敗時放回緩衝，下次 flush 再試
+            logger.error(f"Flushing {len(counts)} rows failed: {e}")
+            with self._buffer_lock:
+                for key, count in counts.items():
+                    self._counts[key] = self._counts.get(key, 0) + count
+            return 0
+        return len(data)
+
+    def _append(self, data: bytes) -> None:
+        lock = AdvisoryLock(f"{self.log_file}.lock", shared=True) if self.lock else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            # O_APPEND 的單次 write 不會與其他 producer 的資料交錯
+            fd = os.open(self.log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = os.write(fd, data)
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+            finally:
+                os.close(fd)
+        finally:
+            if lock is not None:
+                lock.release()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+
+    def close(self) -> None:
+        with self._buffer_lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        atexit.unregister(self.close)
+
+    def __enter__(self) -> "LogProducer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
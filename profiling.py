@@ -0,0 +1,86 @@
+# exporter 的即時 profiling：/debug/profile 與 /debug/heap 使用的工具函式。
+# 只在請求進來時才取樣 / 啟動 tracemalloc，平常不增加任何成本。
+#
+# cProfile 只會量測呼叫 enable() 的那個 thread，量不到 updater 與其他 scrape thread，
+# 因此整個 process 的 CPU profile 改以 sys._current_frames() 定時取樣所有 thread 的 stack。
+
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Dict, Tuple
+
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 60.0
+
+Stack = Tuple[str, ...]
+
+# 同一時間只允許一個 profile，避免重複取樣拖慢 process
+profile_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = DEFAULT_INTERVAL) -> Dict[Stack, int]:
+    """每 interval 秒取樣一次所有 thread (不含自己) 的 stack，回傳 stack -> 取樣次數。"""
+    seconds = min(max(seconds, 0.0), MAX_SECONDS)
+    me = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    samples: Dict[Stack, int] = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            samples[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+def format_collapsed(samples: Dict[Stack, int]) -> str:
+    """flamegraph.pl / speedscope 可讀的 collapsed stack 格式。"""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(samples.items()))
+
+
+def format_top(samples: Dict[Stack, int], limit: int = 40) -> str:
+    """類似 pstats 的排行：每個函式的 self / cumulative 取樣數。"""
+    total = sum(samples.values()) or 1
+    self_counts: Dict[str, int] = Counter()
+    cum_counts: Dict[str, int] = Counter()
+    for stack, count in samples.items():
+        self_counts[stack[-1]] += count
+        for name in set(stack[1:]):
+            cum_counts[name] += count
+    lines = [f"{total} samples\n", f"{'self%':>7} {'cum%':>7}  function\n"]
+    for name, count in sorted(cum_counts.items(), key=lambda item: -self_counts[item[0]])[:limit]:
+        lines.append(f"{100.0 * self_counts[name] / total:7.2f} {100.0 * count / total:7.2f}  {name}\n")
+    return "".join(lines)
+
+
+def heap_top(top: int = 25, seconds: float = 10.0) -> str:
+    """tracemalloc 的 top-N 配置位置；若尚未啟用則只在 seconds 秒內追蹤後關閉。"""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start()
+        time.sleep(min(max(seconds, 0.0), MAX_SECONDS))
+    try:
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+    stats = snapshot.statistics("lineno")
+    total = sum(stat.size for stat in stats)
+    lines = [f"total {total / 1024:.1f} KiB in {len(stats)} locations\n"]
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n")
+    return "".join(lines)
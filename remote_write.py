@@ -0,0 +1,389 @@
+# Python 版 remote-write client，行為比照 client.go (vmalert remotewrite)：
+# 有上限的輸入佇列、maxBatchSize、flushInterval、snappy 壓縮，以及指數退避重試直到 retryMaxTime。
+# 讓小型站點可以由 exporter 直接推送 series，不需要另外部署 vmagent。
+# 搭配 PersistentQueue 時，重試失敗的批次會寫入磁碟佇列，receiver 恢復後依序重送。
+
+import time
+import queue
+import struct
+import logging
+import threading
+import urllib.request
+import urllib.error
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from prometheus_client import Counter, Gauge, Histogram
+from persistent_queue import PersistentQueue
+
+try:
+    import snappy  # python-snappy，存在時使用 C 實作壓縮
+except ImportError:
+    snappy = None
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_SIZE = 10000
+DEFAULT_MAX_QUEUE_SIZE = 100000
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_SEND_TIMEOUT = 30.0
+DEFAULT_RETRY_MIN_INTERVAL = 1.0
+DEFAULT_RETRY_MAX_TIME = 30.0
+
+# === 自身指標 (對應 client.go 的 vmalert_remotewrite_*) ===
+rw_total = Counter("log_exporter_remotewrite", "Number of series pushed into the remote-write queue")
+rw_errors = Counter("log_exporter_remotewrite_errors", "Number of failed remote-write pushes and flushes")
+sent_rows = Counter("log_exporter_remotewrite_sent_rows", "Number of series sent to the remote-write receiver")
+sent_bytes = Counter("log_exporter_remotewrite_sent_bytes", "Number of compressed bytes sent to the remote-write receiver")
+dropped_rows = Counter("log_exporter_remotewrite_dropped_rows", "Number of series dropped by the remote-write client")
+send_duration = Counter("log_exporter_remotewrite_send_duration_seconds", "Time spent sending remote-write requests, including retries")
+flush_duration = Histogram("log_exporter_remotewrite_flush_duration_seconds", "Duration of a single remote-write batch flush")
+queue_length = Gauge("log_exporter_remotewrite_queue_length", "Number of series waiting in the remote-write input queue")
+
+
+class RemoteWriteError(Exception):
+    """推送失敗 (佇列已滿、client 已關閉或 receiver 回應錯誤)。"""
+
+
+class NonRetriableError(RemoteWriteError):
+    """receiver 回應 4xx (429 以外)，依 remote-write 規範不得重試。"""
+
+
+class TimeSeries(NamedTuple):
+    labels: Dict[str, str]  # 包含 __name__
+    samples: List[Tuple[float, int]]  # (value, timestamp 毫秒)
+
+
+# === protobuf 編碼 (prometheus.WriteRequest) ===
+def _varint(value: int) -> bytes:
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _length_delimited(field: int, data: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+
+def marshal_write_request(series: List[TimeSeries]) -> bytes:
+    out = bytearray()
+    for ts in series:
+        body = bytearray()
+        for name, value in sorted(ts.labels.items()):
+            label = _length_delimited(1, name.encode("utf-8")) + _length_delimited(2, value.encode("utf-8"))
+            body += _length_delimited(1, label)
+        for value, timestamp in ts.samples:
+            sample = b"\x09" + struct.pack("<d", value) + b"\x10" + _varint(timestamp)
+            body += _length_delimited(2, sample)
+        out += _length_delimited(1, bytes(body))
+    return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data: bytes):
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise ValueError(f"unsupported protobuf wire type {wire_type}")
+        yield field, value
+
+
+def unmarshal_write_request(data: bytes) -> List[TimeSeries]:
+    """marshal_write_request 的反向操作，供本機 stub receiver 與測試使用。"""
+    series = []
+    for _, ts_data in _iter_fields(data):
+        labels: Dict[str, str] = {}
+        samples: List[Tuple[float, int]] = []
+        for field, value in _iter_fields(ts_data):
+            if field == 1:
+                label = dict(_iter_fields(value))
+                labels[label.get(1, b"").decode("utf-8")] = label.get(2, b"").decode("utf-8")
+            elif field == 2:
+                sample = dict(_iter_fields(value))
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((struct.unpack("<d", sample.get(1, b"\0" * 8))[0], timestamp))
+        series.append(TimeSeries(labels, samples))
+    return series
+
+
+# === snappy block format ===
+def snappy_compress(data: bytes) -> bytes:
+    if snappy is not None:
+        return snappy.compress(data)
+    # 沒有 python-snappy 時只輸出 literal 區塊：仍是合法的 snappy 格式，只是沒有壓縮效果
+    out = bytearray(_varint(len(data)))
+    for start in range(0, len(data), 65536):
+        chunk = data[start:start + 65536]
+        n = len(chunk) - 1
+        if n < 60:
+            out.append(n << 2)
+        elif n < 256:
+            out += bytes((60 << 2, n))
+        else:
+            out += bytes((61 << 2,)) + n.to_bytes(2, "little")
+        out += chunk
+    return bytes(out)
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    if snappy is not None:
+        return snappy.decompress(data)
+    length, pos = _read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            n = tag >> 2
+            if n >= 60:
+                size = n - 59
+                n = int.from_bytes(data[pos:pos + size], "little")
+                pos += size
+            n += 1
+            out += data[pos:pos + n]
+            pos += n
+            continue
+        if kind == 1:
+            n = 4 + ((tag >> 2) & 7)
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 2], "little")
+            pos += 2
+        else:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+        for _ in range(n):  # copy 可能與輸出重疊，需逐 byte 複製
+            out.append(out[-offset])
+    if len(out) != length:
+        raise ValueError(f"snappy: decoded {len(out)} bytes, expected {length}")
+    return bytes(out)
+
+
+# === 非同步批次 client ===
+_STOP = object()
+
+
+class RemoteWriteClient:
+    def __init__(
+        self,
+        url: str,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        concurrency: int = 1,
+        send_timeout: float = DEFAULT_SEND_TIMEOUT,
+        retry_min_interval: float = DEFAULT_RETRY_MIN_INTERVAL,
+        retry_max_time: float = DEFAULT_RETRY_MAX_TIME,
+        disable_path_append: bool = False,
+        persistent_queue: Optional[PersistentQueue] = None,
+    ) -> None:
+        if not url:
+            raise ValueError("remote-write url can't be empty")
+        url = url.rstrip("/")
+        self.url = url if disable_path_append else f"{url}/api/v1/write"
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.send_timeout = send_timeout
+        self.retry_min_interval = retry_min_interval
+        self.retry_max_time = retry_max_time
+        self._input: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._run, name=f"remote-write-{i}", daemon=True)
+            for i in range(max(concurrency, 1))
+        ]
+        for worker in self._workers:
+            worker.start()
+        # 磁碟佇列由 client 負責重送與關閉
+        self.persistent_queue = persistent_queue
+        self._stop_replay = threading.Event()
+        self._replayer = None
+        if persistent_queue is not None:
+            self._replayer = threading.Thread(target=self._replay, name="remote-write-replay", daemon=True)
+            self._replayer.start()
+
+    def push(self, ts: TimeSeries, timeout: Optional[float] = None) -> None:
+        """將 series 放入佇列；client 已關閉或佇列已滿時丟出 RemoteWriteError。
+
+        給定 timeout 時佇列已滿會等待最多 timeout 秒讓 worker 消化，否則立即失敗。
+        """
+        rw_total.inc()
+        if self._closed:
+            rw_errors.inc()
+            dropped_rows.inc(len(ts.samples))
+            raise RemoteWriteError("client is closed")
+        try:
+            if timeout is None:
+                self._input.put_nowait(ts)
+            else:
+                self._input.put(ts, timeout=max(timeout, 0))
+        except queue.Full:
+            rw_errors.inc()
+            dropped_rows.inc(len(ts.samples))
+            raise RemoteWriteError(
+                f"failed to push timeseries - queue is full ({self.max_queue_size} entries)"
+            ) from None
+        queue_length.set(self._input.qsize())
+
+    def close(self) -> None:
+        """停止 worker 並送出佇列中剩餘的 series。"""
+        if self._closed:
+            raise RemoteWriteError("client is already closed")
+        self._closed = True
+        for _ in self._workers:
+            self._input.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        if self._replayer is not None:
+            self._stop_replay.set()
+            self._replayer.join()
+            self.persistent_queue.close()
+        logger.info("remote write client closed")
+
+    def _run(self) -> None:
+        batch: List[TimeSeries] = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._input.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                logger.info(f"shutting down remote write client and flushing {len(batch)} remained series")
+                self.flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_batch_size:
+                    self.flush(batch)
+                    batch = []
+            if time.monotonic() >= deadline:
+                self.flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+            queue_length.set(self._input.qsize())
+
+    def flush(self, batch: List[TimeSeries]) -> bool:
+        """送出一個批次，失敗時以指數退避重試到 retry_max_time；回傳是否送達。"""
+        if not batch:
+            return True
+        with flush_duration.time():
+            data = snappy_compress(marshal_write_request(batch))
+            if self.persistent_queue is not None and len(self.persistent_queue):
+                # 磁碟佇列仍有積壓時排到後面，確保 receiver 恢復後依原順序送達
+                self.persistent_queue.append(data)
+                return False
+            try:
+                self._send_with_retry(data)
+                sent_rows.inc(len(batch))
+                sent_bytes.inc(len(data))
+                return True
+            except NonRetriableError:
+                pass
+            except (RemoteWriteError, OSError):
+                if self.persistent_queue is not None:
+                    logger.warning(f"spilling {len(batch)} time series to disk queue {self.persistent_queue.path}")
+                    self.persistent_queue.append(data)
+                    return False
+        rw_errors.inc()
+        dropped_rows.inc(sum(len(ts.samples) for ts in batch))
+        logger.error(f"attempts to send remote-write request failed - dropping {len(batch)} time series")
+        return False
+
+    def _send_with_retry(self, data: bytes) -> None:
+        """以指數退避重試送出；放棄時丟出最後一次的錯誤。"""
+        retry_interval = min(self.retry_min_interval, self.retry_max_time)
+        time_start = time.monotonic()
+        attempts = 0
+        try:
+            while True:
+                try:
+                    self._send(data)
+                    return
+                except NonRetriableError as e:
+                    logger.warning(f"attempt {attempts + 1} to send request failed: {e} (retriable: False)")
+                    raise
+                except (RemoteWriteError, OSError) as e:
+                    logger.warning(f"attempt {attempts + 1} to send request failed: {e} (retriable: True)")
+                    attempts += 1
+                    time_left = self.retry_max_time - (time.monotonic() - time_start)
+                    if time_left <= 0:
+                        raise
+                # 退避避免壓垮遠端資料庫
+                time.sleep(min(retry_interval, time_left))
+                retry_interval *= 2
+        finally:
+            send_duration.inc(time.monotonic() - time_start)
+
+    def _replay(self) -> None:
+        """依序重送磁碟佇列中的批次，receiver 仍不可用時以指數退避等待。"""
+        retry_interval = self.retry_min_interval
+        while not self._stop_replay.is_set():
+            data = self.persistent_queue.peek()
+            if data is None:
+                self._stop_replay.wait(self.flush_interval)
+                continue
+            try:
+                self._send(data)
+            except NonRetriableError as e:
+                rw_errors.inc()
+                logger.error(f"dropping block from disk queue, receiver rejected it: {e}")
+            except (RemoteWriteError, OSError) as e:
+                logger.warning(f"replay from disk queue failed: {e}")
+                self._stop_replay.wait(retry_interval)
+                retry_interval = min(retry_interval * 2, self.retry_max_time)
+                continue
+            else:
+                sent_bytes.inc(len(data))
+            self.persistent_queue.ack()
+            retry_interval = self.retry_min_interval
+
+    def _send(self, data: bytes) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=data,
+            method="POST",
+            headers={
+                "Content-Encoding": "snappy",
+                "Content-Type": "application/x-protobuf",
+                "X-Prometheus-Remote-Write-Version": "0.1.0",
+            },
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.send_timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            body = e.read()[:512]
+            message = f"unexpected response code {e.code} for {self.url}. Response body {body!r}"
+            # 依 remote-write 規範，429 以外的 4xx 不得重試
+            if 400 <= e.code < 500 and e.code != 429:
+                raise NonRetriableError(message) from None
+            raise RemoteWriteError(message) from None
@@ -0,0 +1,148 @@
+# 設定檔驅動的 metric 路由：依 label 是否存在與 label 值的 pattern，把每列 CSV 分派到多個 metric family。
+# 取代 exporter08-15-2.py 寫死的 basic / service / module 三個 metric 與各自的 dict 更新。
+# 路由表編譯一次；每列只依 label 名稱組合查一次快取的候選 route，再檢查 pattern，
+# 因此增加 metric 不會讓解析成本倍增。
+#
+# routes.yml 範例：
+#   routes:
+#     - metric: log_host_job_basic
+#       help: Basic count of occurrences of host and job_name in log
+#       labels: [host, job_name]
+#     - metric: log_host_job_service
+#       any_present: [service_name, container_name]
+#       labels: [host, job_name, service_name, container_name]
+#     - metric: log_host_job_module
+#       present: [module_name]
+#       match: {job_name: "job_.*"}
+#       labels: [host, job_name, module_name]
+#
+# labels 省略時保留該列所有 label；stop: true 表示命中後不再檢查後面的 route。
+
+import os
+import re
+import json
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+try:
+    import yaml
+except ImportError:  # PyYAML 為選用套件，沒有時只能讀 JSON 格式的路由表
+    yaml = None
+
+DEFAULT_HELP = "Count of host and job_name with optional labels"
+
+
+class Route(NamedTuple):
+    metric: str
+    documentation: str
+    labels: Optional[Tuple[str, ...]]  # None 表示保留全部 label
+    present: Tuple[str, ...]  # 全部都要存在
+    any_present: Tuple[str, ...]  # 至少一個存在
+    absent: Tuple[str, ...]  # 全部都不能存在
+    match: Tuple[Tuple[str, Pattern], ...]  # label 值需 fullmatch
+    stop: bool
+
+
+def _names(value, field: str, metric: str) -> Tuple[str, ...]:
+    if value is None:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"route {metric}: {field} must be a list of label names")
+    return tuple(value)
+
+
+def compile_route(config: Dict) -> Route:
+    metric = config.get("metric")
+    if not isinstance(metric, str) or not re.fullmatch(r"[a-zA-Z_:][a-zA-Z0-9_:]*", metric):
+        raise ValueError(f"invalid metric name in route: {metric!r}")
+    unknown = set(config) - {"metric", "help", "labels", "present", "any_present", "absent", "match", "stop"}
+    if unknown:
+        raise ValueError(f"route {metric}: unknown keys {sorted(unknown)}")
+    match = config.get("match") or {}
+    if not isinstance(match, dict):
+        raise ValueError(f"route {metric}: match must be a mapping of label name to regex")
+    labels = config.get("labels")
+    return Route(
+        metric=metric,
+        documentation=str(config.get("help", DEFAULT_HELP)),
+        labels=None if labels in (None, "*") else _names(labels, "labels", metric),
+        present=_names(config.get("present"), "present", metric),
+        any_present=_names(config.get("any_present"), "any_present", metric),
+        absent=_names(config.get("absent"), "absent", metric),
+        match=tuple((name, re.compile(pattern)) for name, pattern in match.items()),
+        stop=bool(config.get("stop", False)),
+    )
+
+
+class Router:
+    """編譯後的路由表。route() 回傳 (metric family 索引, 投影後的 labels) 列表。"""
+
+    def __init__(self, routes: List[Route]) -> None:
+        if not routes:
+            raise ValueError("routing table has no routes")
+        self.routes = routes
+        # metric 名稱 -> family 索引；多個 route 可以寫入同一個 metric
+        self.metric_names: List[str] = []
+        self.documentation: List[str] = []
+        self._family: List[int] = []
+        for route in routes:
+            if route.metric not in self.metric_names:
+                self.metric_names.append(route.metric)
+                self.documentation.append(route.documentation)
+            self._family.append(self.metric_names.index(route.metric))
+        # label 名稱組合 -> 通過存在條件的 route 索引；組合的種類很少，每列只查一次
+        self._candidates: Dict[Tuple[str, ...], Tuple[int, ...]] = {}
+
+    def _presence_candidates(self, names: Tuple[str, ...]) -> Tuple[int, ...]:
+        present = set(names)
+        candidates = []
+        for index, route in enumerate(self.routes):
+            if not present.issuperset(route.present):
+                continue
+            if route.any_present and present.isdisjoint(route.any_present):
+                continue
+            if not present.isdisjoint(route.absent):
+                continue
+            if not present.issuperset(name for name, _ in route.match):
+                continue
+            candidates.append(index)
+        return tuple(candidates)
+
+    def route(self, labels: Dict[str, str]) -> List[Tuple[int, Dict[str, str]]]:
+        names = tuple(labels)
+        candidates = self._candidates.get(names)
+        if candidates is None:
+            candidates = self._candidates[names] = self._presence_candidates(names)
+        targets = []
+        for index in candidates:
+            route = self.routes[index]
+            if route.match and not all(pattern.fullmatch(labels[name]) for name, pattern in route.match):
+                continue
+            if route.labels is None:
+                projected = labels
+            else:
+                projected = {name: labels[name] for name in route.labels if name in labels}
+            targets.append((self._family[index], projected))
+            if route.stop:
+                break
+        return targets
+
+
+def compile_routes(config: Dict) -> Router:
+    routes = config.get("routes") if isinstance(config, dict) else None
+    if not isinstance(routes, list):
+        raise ValueError("routing table must be a mapping with a 'routes' list")
+    return Router([compile_route(route) for route in routes])
+
+
+def load_routes(path: str) -> Router:
+    """讀取 YAML (.yml/.yaml，需要 PyYAML) 或 JSON 格式的路由表。"""
+    with open(path, "r", encoding="utf-8") as f:
+        if os.path.splitext(path)[1] in (".yml", ".yaml"):
+            if yaml is None:
+                raise RuntimeError(f"PyYAML is required to read {path}; install pyyaml or use a .json routing table")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    return compile_routes(config)
@@ -0,0 +1,155 @@
+# 以 SQLite 存放 series，給 label set 多到無法全部放進記憶體的 exporter / 租戶使用。
+# 取代記憶體中的 metric dict：每個解析週期在單一 transaction 內以 executemany 逐列 upsert
+# (參數以 generator 餵入，不先組成 list)，同一世代重複出現的 label set 相加，結束時刪除本世代未出現的 series。
+# WAL 模式下 Scraper 以自己的連線讀取，讀取期間看到的是上一個已 commit 的世代，不會被更新阻塞；
+# exposition 依寫入時算好的分組順序 (group_position) 直接從 cursor 逐列讀出並 render，不保留整份結果。
+# series_labels (name, value) 為 label 反向索引，match[] 的等值條件直接在 SQL 中篩選。
+
+import json
+import sqlite3
+import logging
+import itertools
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    id INTEGER PRIMARY KEY,
+    family INTEGER NOT NULL,      -- metric family 索引 (路由表中的順序)
+    key TEXT NOT NULL,            -- 依 label 名稱排序的 labels JSON，識別 series
+    label_keys TEXT NOT NULL,     -- 本世代第一次出現時的 label 名稱順序 (分組依據)
+    labels TEXT NOT NULL,         -- 依 label_keys 順序的 labels JSON
+    value REAL NOT NULL,
+    seen INTEGER NOT NULL,        -- 最後寫入的世代
+    position INTEGER NOT NULL,    -- 本世代第一次出現的順序
+    group_position INTEGER NOT NULL DEFAULT 0,  -- 本世代所屬分組 (family, label_keys) 最小的 position
+    indexed INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (family, key)
+);
+CREATE TABLE IF NOT EXISTS series_labels (
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    series_id INTEGER NOT NULL,
+    PRIMARY KEY (name, value, series_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS series_group ON series (family, label_keys, position);
+CREATE INDEX IF NOT EXISTS series_order ON series (family, group_position, position);
+CREATE INDEX IF NOT EXISTS series_seen ON series (seen);
+CREATE INDEX IF NOT EXISTS series_unindexed ON series (id) WHERE indexed = 0;
+CREATE INDEX IF NOT EXISTS series_labels_series ON series_labels (series_id);
+"""
+
+# 同一世代已寫入過的 series 累加 (與 CustomGauge.inc 相同)，否則以本世代的值與 label 順序取代
+_UPSERT = """
+INSERT INTO series (family, key, label_keys, labels, value, seen, position)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (family, key) DO UPDATE SET
+    value = CASE WHEN seen = excluded.seen THEN value + excluded.value ELSE excluded.value END,
+    label_keys = CASE WHEN seen = excluded.seen THEN label_keys ELSE excluded.label_keys END,
+    labels = CASE WHEN seen = excluded.seen THEN labels ELSE excluded.labels END,
+    position = CASE WHEN seen = excluded.seen THEN position ELSE excluded.position END,
+    seen = excluded.seen
+"""
+
+# 寫入後以 series_group 索引逐組取最小的 position，存成 group_position
+_GROUP_POSITION = """
+UPDATE series SET group_position = (
+    SELECT MIN(g.position) FROM series AS g WHERE g.family = series.family AND g.label_keys = series.label_keys
+)
+"""
+
+# 分組依第一個 series 出現的順序、組內依出現順序，與記憶體中的 CustomGauge 輸出順序相同；
+# 直接依 series_order 索引讀出，不需排序
+_ORDER = " ORDER BY family, group_position, position"
+
+Row = Tuple[int, Dict[str, str], float]
+
+
+class SQLiteSeriesStore:
+    """SQLite 上的 series store；update() 只由持有 update_lock 的更新者呼叫，iter_rows() 可在任意 thread 並行。"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # 更新者的連線；交易由 update() 自行控制
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        mode = self._conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode != "wal":
+            logger.warning(f"{path}: journal_mode is {mode}, scrapes may block updates")
+        # WAL 下 NORMAL 只在 checkpoint 時 fsync；崩潰最多遺失最後一個世代，重啟後本來就會重建
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # 世代從 0 重新開始，上次執行留下的 series 不沿用
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._conn.execute("DELETE FROM series_labels")
+        self._conn.execute("DELETE FROM series")
+        self._conn.execute("COMMIT")
+        self.series_count = 0
+
+    def update(self, generation: int, rows: Iterable[Row]) -> None:
+        """以 (family, labels, value) 取代目前內容並 commit 成新世代；失敗時 rollback，讀者仍看到上一個世代。"""
+        conn = self._conn
+        positions = itertools.count()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_UPSERT, self._params(generation, rows, positions))
+            # 新 series 的 label 寫入反向索引
+            conn.execute(
+                "INSERT OR IGNORE INTO series_labels (name, value, series_id) "
+                "SELECT j.key, j.value, s.id FROM series AS s, json_each(s.labels) AS j WHERE s.indexed = 0"
+            )
+            conn.execute("UPDATE series SET indexed = 1 WHERE indexed = 0")
+            conn.execute(
+                "DELETE FROM series_labels WHERE series_id IN (SELECT id FROM series WHERE seen < ?)", (generation,)
+            )
+            conn.execute("DELETE FROM series WHERE seen < ?", (generation,))
+            conn.execute(_GROUP_POSITION)
+            self.series_count = conn.execute("SELECT COUNT(*) FROM series").fetchone()[0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _params(generation: int, rows: Iterable[Row], positions: Iterator[int]) -> Iterator[tuple]:
+        for family, labels, value in rows:
+            filtered_labels = {k: v for k, v in labels.items() if v}
+            yield (
+                family,
+                json.dumps(filtered_labels, sort_keys=True),
+                json.dumps(list(filtered_labels)),
+                json.dumps(filtered_labels),
+                value,
+                generation,
+                next(positions),
+            )
+
+    def iter_rows(
+        self,
+        equal: Iterable[Tuple[str, str]] = (),
+        predicate: Optional[Callable[[int, Dict[str, str]], bool]] = None,
+    ) -> Iterator[Row]:
+        """依 exposition 順序逐列讀出 (family, labels, value)。
+
+        equal 中的 (label name, value) 以反向索引在 SQL 中篩選，predicate 在讀出後再過濾。
+        整個讀取是單一 statement，看到的是同一個已 commit 的世代。
+        """
+        sql = "SELECT family, labels, value FROM series"
+        params = []
+        conditions = []
+        for name, value in equal:
+            conditions.append("id IN (SELECT series_id FROM series_labels WHERE name = ? AND value = ?)")
+            params += [name, value]
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        conn = sqlite3.connect(self.path)
+        try:
+            for family, labels, value in conn.execute(sql + _ORDER, params):
+                labels = json.loads(labels)
+                if predicate is None or predicate(family, labels):
+                    yield family, labels, value
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        self._conn.close()
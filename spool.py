@@ -0,0 +1,137 @@
+# spool 目錄的 segment 交接協定，取代多個 producer 共用單一 data_collect.csv
+# 再由 exporter 截斷 / FileLock + rename 的做法：
+#
+#   <spool>/tmp/         producer 寫到一半的檔案
+#   <spool>/incoming/    producer 寫完後以 os.rename 原子地放進來 (見 publish)
+#   <spool>/processing/  exporter 以 rename 認領的 segment，解析中
+#   <spool>/done/        keep_done 時解析完的 segment 移到這裡，否則直接刪除
+#
+# 發佈新世代後才 commit：先把這批檔名寫進 checkpoint，再刪除 / 移動檔案，最後清空 checkpoint。
+# 中途崩潰時，checkpoint 中的檔案視為已計數只做收尾；不在 checkpoint 的 processing/ 檔案重新解析。
+
+import os
+import json
+import socket
+import logging
+import itertools
+import time
+from typing import List
+from prometheus_client import Counter, Gauge
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+INCOMING = "incoming"
+PROCESSING = "processing"
+DONE = "done"
+TMP = "tmp"
+_CHECKPOINT = "checkpoint.json"
+
+# === 自身指標 ===
+claimed_segments = Counter("log_exporter_spool_claimed_segments", "Number of spool segments claimed from incoming/")
+committed_segments = Counter("log_exporter_spool_committed_segments", "Number of spool segments committed after publishing")
+processing_segments = Gauge("log_exporter_spool_processing_segments", "Number of claimed spool segments not yet committed")
+
+_sequence = itertools.count()
+
+
+def publish(spool_dir: str, data: bytes, name: str = "") -> str:
+    """producer 端：寫入 tmp/ 並 fsync 後 rename 到 incoming/，回傳最終路徑。
+
+    檔名預設為 <hostname>-<pid>-<time_ns>-<序號>.csv，多個 producer 之間不會重複。
+    """
+    name = name or f"{socket.gethostname()}-{os.getpid()}-{time.time_ns()}-{next(_sequence)}.csv"
+    tmp_dir = os.path.join(spool_dir, TMP)
+    incoming_dir = os.path.join(spool_dir, INCOMING)
+    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(incoming_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, name)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    path = os.path.join(incoming_dir, name)
+    os.rename(tmp_path, path)
+    return path
+
+
+class SpoolConsumer:
+    def __init__(self, spool_dir: str, keep_done: bool = False) -> None:
+        self.spool_dir = spool_dir
+        self.keep_done = keep_done
+        self.incoming_dir = os.path.join(spool_dir, INCOMING)
+        self.processing_dir = os.path.join(spool_dir, PROCESSING)
+        self.done_dir = os.path.join(spool_dir, DONE)
+        for directory in (self.incoming_dir, self.processing_dir, self.done_dir):
+            os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.spool_dir, _CHECKPOINT)
+
+    def _load_checkpoint(self) -> List[str]:
+        try:
+            with open(self._checkpoint_path(), "r", encoding="utf-8") as f:
+                return list(json.load(f)["committed"])
+        except FileNotFoundError:
+            return []
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid spool checkpoint in {self.spool_dir}, re-reading processing/: {e}")
+            return []
+
+    def _save_checkpoint(self, names: List[str]) -> None:
+        tmp_path = self._checkpoint_path() + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"committed": names}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._checkpoint_path())
+
+    def _recover(self) -> None:
+        """上次在 commit 途中崩潰：checkpoint 中的檔案已計數，只需刪除 / 移到 done/。"""
+        committed = self._load_checkpoint()
+        if committed:
+            logger.warning(f"Finishing commit of {len(committed)} spool segments interrupted by a restart")
+            self._finalize(committed)
+            self._save_checkpoint([])
+        processing_segments.set(len(os.listdir(self.processing_dir)))
+
+    def _finalize(self, names: List[str]) -> None:
+        for name in names:
+            path = os.path.join(self.processing_dir, name)
+            try:
+                if self.keep_done:
+                    os.rename(path, os.path.join(self.done_dir, name))
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def claim(self) -> List[str]:
+        """把 incoming/ 的 segment rename 到 processing/，連同上次未 commit 的一併回傳 (依檔名排序)。"""
+        claimed = 0
+        for name in sorted(os.listdir(self.incoming_dir)):
+            if name.startswith("."):
+                continue
+            try:
+                os.rename(os.path.join(self.incoming_dir, name), os.path.join(self.processing_dir, name))
+                claimed += 1
+            except FileNotFoundError:
+                # 其他 consumer 已先認領
+                continue
+        claimed_segments.inc(claimed)
+        names = sorted(os.listdir(self.processing_dir))
+        processing_segments.set(len(names))
+        return [os.path.join(self.processing_dir, name) for name in names]
+
+    def commit(self, paths: List[str]) -> None:
+        """這批 segment 已發佈：記錄 checkpoint 後收尾，之後不會再被解析。"""
+        if not paths:
+            return
+        names = [os.path.basename(path) for path in paths]
+        self._save_checkpoint(names)
+        self._finalize(names)
+        self._save_checkpoint([])
+        committed_segments.inc(len(names))
+        processing_segments.set(len(os.listdir(self.processing_dir)))